@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    bench_compaction.py - Byte reduction and per-stage timings of ImageCompactor (needs Pillow).
+#
+#    Usage: python3 benchmarks/bench_compaction.py [directory with sample images]
+#    Without directory a synthetic corpus of captcha-like images gets generated (big canvases, metadata, animations, noise).
+#
+
+import io
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from py9kw import ImageCompactor  # noqa: E402
+try:
+    from PIL import Image, ImageDraw, PngImagePlugin
+except ImportError:
+    sys.exit('bench_compaction.py needs Pillow: pip install Pillow (or pip install python3-py9kw[compaction])')
+
+
+def drawCaptcha(size: tuple, text: str, noise: int, background=(255, 255, 255)) -> Image.Image:
+    random.seed(text)
+    image = Image.new('RGB', size, background)
+    draw = ImageDraw.Draw(image)
+    # Text + noise in the middle, uniform border around it
+    left, top = size[0] // 3, size[1] // 3
+    for i in range(noise):
+        draw.line([(left + random.randint(0, size[0] // 3), top + random.randint(0, size[1] // 3)) for j in range(2)], fill=(random.randint(0, 200),) * 3)
+    draw.text((left + 10, top + 10), text, fill=(0, 0, 0))
+    return image
+
+
+def generateCorpus() -> list:
+    corpus = []
+    image = drawCaptcha((1200, 600), 'viearer', 40)
+    pnginfo = PngImagePlugin.PngInfo()
+    pnginfo.add_text('Comment', 'x' * 20000)
+    output = io.BytesIO()
+    image.save(output, 'PNG', pnginfo=pnginfo)
+    corpus.append(('png_metadata_big_canvas', output.getvalue()))
+
+    output = io.BytesIO()
+    drawCaptcha((300, 100), 'abc123', 400, (230, 230, 230)).save(output, 'PNG')
+    corpus.append(('png_noisy_small', output.getvalue()))
+
+    output = io.BytesIO()
+    drawCaptcha((2000, 1000), 'hello', 80).save(output, 'JPEG', quality=95)
+    corpus.append(('jpeg_huge', output.getvalue()))
+
+    frames = [drawCaptcha((500, 200), 'frame%d' % i, 30).convert('P') for i in range(10)]
+    output = io.BytesIO()
+    frames[0].save(output, 'GIF', save_all=True, append_images=frames[1:], duration=100, loop=0)
+    corpus.append(('gif_animated', output.getvalue()))
+
+    output = io.BytesIO()
+    drawCaptcha((120, 40), 'tiny', 5).save(output, 'PNG')
+    corpus.append(('png_tiny', output.getvalue()))
+    return corpus
+
+
+def loadCorpus(directory: str) -> list:
+    corpus = []
+    for filename in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, filename), 'rb') as file:
+            corpus.append((filename, file.read()))
+    return corpus
+
+
+def main():
+    logging.disable(logging.INFO)
+    corpus = loadCorpus(sys.argv[1]) if len(sys.argv) > 1 else generateCorpus()
+    compactor = ImageCompactor()
+    print('%-28s %10s %10s %8s %-6s %s' % ('image', 'bytes', 'compacted', 'saved', 'format', 'stage timings ms'))
+    start = time.perf_counter()
+    for name, imagedata in corpus:
+        compacted, report = compactor.compact(imagedata)
+        timings = ' '.join('%s=%.2f' % (stage, seconds * 1000) for stage, seconds in report.timings.items())
+        print('%-28s %10d %10d %7.1f%% %-6s %s' % (name, report.originalBytes, report.compactedBytes, 100.0 * report.getSavedBytes() / report.originalBytes,
+                                                  report.format or ('skip' if report.skipped else 'kept'), timings))
+    stats = compactor.getStats()
+    print('Total: %d -> %d bytes (%.1f%% saved) in %.1f ms | per stage ms: %s' % (
+        stats['originalBytes'], stats['compactedBytes'], 100.0 * (stats['originalBytes'] - stats['compactedBytes']) / stats['originalBytes'],
+        (time.perf_counter() - start) * 1000, ' '.join('%s=%.2f' % (stage, seconds * 1000) for stage, seconds in stats['stageSeconds'].items())))
+
+
+if __name__ == '__main__':
+    main()
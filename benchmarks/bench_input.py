@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    bench_input.py - Per-call CPU time and peak allocations of input type dispatch + building the upload request, without network.
+#
+#    Covers what uploadcaptcha does with its input before anything gets sent: URL check, base64 handling, result cache key and request body.
+#    Usage: python3 benchmarks/bench_input.py [image KB] [calls]
+#
+
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from base64 import b64encode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import py9kw  # noqa: E402
+
+
+def prepare(client: py9kw.Py9kw, imagedata):
+    """ Same steps as uploadcaptcha between credit reservation and sending. """
+    if client._isImageURL(imagedata):
+        return
+    client._getResultCacheKey(imagedata)
+    getdata, body = client._getUploadRequest(imagedata)
+    if body is not None:
+        for chunk in body:
+            pass
+
+
+def measure(client: py9kw.Py9kw, imagedata, calls: int):
+    prepare(client, imagedata)
+    starttime = time.perf_counter()
+    for _ in range(calls):
+        prepare(client, imagedata)
+    seconds = (time.perf_counter() - starttime) / calls
+    tracemalloc.start()
+    prepare(client, imagedata)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    logging.disable(logging.INFO)
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 50 * 1024
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    imagedata = os.urandom(size)
+    client = py9kw.Py9kw('bench')
+    with tempfile.NamedTemporaryFile(suffix='.png') as imagefile:
+        imagefile.write(imagedata)
+        imagefile.flush()
+        inputs = [('bytes', imagedata), ('memoryview', memoryview(imagedata)), ('base64', py9kw.Base64Image(b64encode(imagedata))),
+                  ('path (mmap)', py9kw.ImageFile(imagefile.name)), ('URL', 'https://www.example.com/captcha.png')]
+        print('%-12s %-5s %14s %14s' % ('input', 'mode', 'us per call', 'peak bytes'))
+        for uploadmode in (py9kw.UPLOAD_MODE_POST, py9kw.UPLOAD_MODE_GET):
+            client.setUploadMode(uploadmode)
+            for name, source in inputs:
+                with client._openImage(source) as data:
+                    seconds, peak = measure(client, data, calls)
+                print('%-12s %-5s %14.1f %14d' % (name, uploadmode, seconds * 1e6, peak))
+
+
+if __name__ == '__main__':
+    main()
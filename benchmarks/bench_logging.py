@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    bench_logging.py - Client side CPU time and log records per result poll and per captcha in every log mode, without network.
+#
+#    The API gets answered in-process (no answer for <polls> polls, then the answer) and all records go to a handler writing to os.devnull,
+#    so the numbers are what logging costs on top of parsing and bookkeeping.
+#    Usage: python3 benchmarks/bench_logging.py [polls per captcha] [captchas]
+#
+
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import py9kw  # noqa: E402
+
+IMAGEDATA = os.urandom(4 * 1024)
+
+
+class InProcessTransport:
+    """ Answers like index.cgi: every upload gets a new captchaid, the answer comes with poll number <polls>. """
+
+    def __init__(self, polls: int):
+        self.polls = polls
+        self.captchaid = 0
+        self.pollsleft = 0
+
+    def get(self, url: str, sink=None, maxBytes: int = None, timeout: float = None) -> bytes:
+        if 'usercaptchacorrectdata' not in url:
+            return b'{"credits": "100000", "status": {"success": true}}'
+        self.pollsleft -= 1
+        if self.pollsleft > 0:
+            return b'{"answer": "NO DATA", "nodata": 1, "try_again": 1, "info": 1, "credits": "100000", "message": "OK", "status": {"success": true}}'
+        return json.dumps({'answer': 'answer%d' % self.captchaid, 'info': 1, 'credits': '100000', 'message': 'OK', 'status': {'success': True}}).encode()
+
+    def post(self, url: str, body, contenttype: str) -> bytes:
+        for chunk in body:
+            pass
+        self.captchaid += 1
+        self.pollsleft = self.polls
+        return b'{"captchaid": "%d", "status": {"success": true}}' % self.captchaid
+
+    def close(self):
+        pass
+
+
+class CountingHandler(logging.StreamHandler):
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self.records = 0
+
+    def emit(self, record):
+        self.records += 1
+        super().emit(record)
+
+
+def solve(client: py9kw.Py9kw) -> float:
+    """ Upload + polls without waiting in between. Returns the seconds spent polling. """
+    client.uploadcaptcha(IMAGEDATA)
+    starttime = time.perf_counter()
+    while client.getresult() is None:
+        pass
+    return time.perf_counter() - starttime
+
+
+def main():
+    polls = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    captchas = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    with open(os.devnull, 'w') as devnull:
+        handler = CountingHandler(devnull)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        modes = [('no handler', None, None, None), ('quiet', py9kw.LOG_MODE_QUIET, False, None), ('text', py9kw.LOG_MODE_TEXT, False, None),
+                 ('text debug', py9kw.LOG_MODE_TEXT, True, None), ('events', py9kw.LOG_MODE_EVENTS, False, None),
+                 ('events 1%', py9kw.LOG_MODE_EVENTS, False, py9kw.LogSampler({'solved': 0.01}))]
+        print('%-12s %12s %14s %14s %14s' % ('mode', 'us per poll', 'us per captcha', 'records/poll', 'records/captcha'))
+        for name, mode, debug, sampler in modes:
+            root = logging.getLogger()
+            if mode is not None:
+                py9kw.setLogMode(mode, debug)
+                root.addHandler(handler)
+                root.setLevel(logging.DEBUG)
+            if sampler is not None:
+                py9kw.eventlogger.addFilter(sampler)
+            client = py9kw.Py9kw('bench', transport=InProcessTransport(polls))
+            client.setApiUrl('http://127.0.0.1/index.cgi')
+            solve(client)
+            handler.records = 0
+            pollseconds = 0
+            starttime = time.perf_counter()
+            for _ in range(captchas):
+                pollseconds += solve(client)
+            captchaseconds = (time.perf_counter() - starttime) / captchas
+            print('%-12s %12.1f %14.1f %14.2f %14.2f' % (name, pollseconds / (captchas * polls) * 1e6, captchaseconds * 1e6,
+                                                       handler.records / (captchas * polls), handler.records / captchas))
+            root.removeHandler(handler)
+            py9kw.eventlogger.removeFilter(sampler)
+            py9kw.setLogMode(py9kw.LOG_MODE_QUIET)
+
+
+if __name__ == '__main__':
+    main()
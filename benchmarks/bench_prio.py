@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    bench_prio.py - End-to-end latency percentiles and credits per captcha with static prios vs. PrioOptimizer with and without hedging
+#    against the local 9kw API stand-in (py9kw_fakeserver) where higher prios get solved faster.
+#
+#    Every scenario solves the same number of captchas via one CaptchaPoller with its own API key so credits can be told apart.
+#    Usage: python3 benchmarks/bench_prio.py [--captchas 300] [--concurrency 32] [--solve-median 2] [--prio-speedup 0.2] [--target 1.5]
+#
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import py9kw  # noqa: E402
+import py9kw_fakeserver  # noqa: E402
+import py9kw_poller  # noqa: E402
+
+IMAGEDATA = os.urandom(4 * 1024)
+CREDITS = 10 ** 9
+
+
+def percentile(values: list, quantile: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(quantile * (len(values) - 1))))]
+
+
+def run(fakeserver: py9kw_fakeserver.FakeApiServer, apikey: str, args, prio: int = None, priooptimizer: py9kw.PrioOptimizer = None) -> dict:
+    client = py9kw.Py9kw(apikey)
+    client.setApiUrl(fakeserver.getApiUrl())
+    client.setWaitSecondsPerLoop(args.poll_seconds)
+    client.setTimeout(py9kw.PARAM_MIN_MAXTIMEOUT)
+    if prio is not None:
+        client.setPriority(prio)
+    client.setPrioOptimizer(priooptimizer)
+    latencies = []
+    failed = 0
+    with py9kw_poller.CaptchaPoller(client, args.concurrency) as poller:
+        for start in range(0, args.captchas, args.concurrency):
+            tickets = [poller.upload(IMAGEDATA) for _ in range(min(args.concurrency, args.captchas - start))]
+            for ticket in tickets:
+                # Latency = until the ticket got resolved, not until this loop gets to it
+                ticket.addCallback(lambda ticket: latencies.append(time.monotonic() - ticket.uploadtime) if ticket.answer is not None else None)
+            for ticket in tickets:
+                if ticket.result() is None:
+                    failed += 1
+    client.close()
+    credits = CREDITS - fakeserver.credits[apikey]
+    return {'p50': percentile(latencies, 0.5), 'p90': percentile(latencies, 0.9), 'p99': percentile(latencies, 0.99),
+            'credits': credits / max(1, len(latencies)), 'failed': failed}
+
+
+def main():
+    logging.disable(logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--captchas', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--solve-median', type=float, default=2)
+    parser.add_argument('--prio-speedup', type=float, default=0.2, help='Solve times get divided by 1 + prio speedup * prio')
+    parser.add_argument('--target', type=float, default=1.5, help='Latency target (p90) of the optimizer in seconds')
+    parser.add_argument('--poll-seconds', type=float, default=0.25)
+    parser.add_argument('--control-rate', type=float, default=0.2, help='Share of unhedged captchas to estimate the latency saved by hedges')
+    args = parser.parse_args()
+    config = py9kw_fakeserver.FakeApiConfig(solveTime=py9kw_fakeserver.lognormal(args.solve_median, 0.8), credits=CREDITS,
+                                            prioSpeedup=args.prio_speedup)
+    fakeserver = py9kw_fakeserver.FakeApiServer(config).start()
+    scenarios = [('prio 0', 0, None), ('prio 20', 20, None),
+                 ('optimizer', None, py9kw.PrioOptimizer(args.target, hedgeQuantile=None)),
+                 ('opt+hedging', None, py9kw.PrioOptimizer(args.target, controlRate=args.control_rate))]
+    print('%-12s %8s %8s %8s %16s %8s %20s' % ('scenario', 'p50 s', 'p90 s', 'p99 s', 'credits/captcha', 'failed', 'credits/second saved'))
+    for index, (name, prio, priooptimizer) in enumerate(scenarios):
+        result = run(fakeserver, 'bench%d' % index, args, prio, priooptimizer)
+        creditsPerSecondSaved = priooptimizer.getStats()['creditsPerSecondSaved'] if priooptimizer is not None else None
+        print('%-12s %8.2f %8.2f %8.2f %16.1f %8d %20s' % (name, result['p50'], result['p90'], result['p99'], result['credits'], result['failed'],
+                                                         '-' if creditsPerSecondSaved is None else '%.1f' % creditsPerSecondSaved))
+    fakeserver.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    bench_throughput.py - Captchas per second, requests per solved captcha, end-to-end latency percentiles and peak client memory at several
+#    concurrency levels against the local 9kw API stand-in (py9kw_fakeserver).
+#
+#    The stand-in runs in its own process so tracemalloc only sees client side allocations. Every worker thread uses its own Py9kw client
+#    (upload + sleepAndGetResult), 'poller' uses one CaptchaPoller for all captchas instead.
+#    Usage: python3 benchmarks/bench_throughput.py [--captchas 200] [--concurrency 1,4,16,64] [--solve-median 1] [--scheduler fixed]
+#
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import py9kw  # noqa: E402
+import py9kw_fakeserver  # noqa: E402
+import py9kw_poller  # noqa: E402
+
+IMAGEDATA = os.urandom(4 * 1024)
+
+
+def serve(portqueue, solveMedian: float, latency: float, noUserRate: float):
+    config = py9kw_fakeserver.FakeApiConfig(solveTime=py9kw_fakeserver.lognormal(solveMedian), latency=py9kw_fakeserver.constant(latency),
+                                            noUserRate=noUserRate, credits=10 ** 9)
+    server = py9kw_fakeserver.FakeApiServer(config)
+    portqueue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def percentile(values: list, quantile: float) -> float:
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(quantile * (len(values) - 1))))]
+
+
+class Bench:
+
+    def __init__(self, apiurl: str, args):
+        self.apiurl = apiurl
+        self.args = args
+        self.pollscheduler = self.createPollScheduler()
+        self.local = threading.local()
+
+    def createPollScheduler(self) -> py9kw.PollScheduler:
+        if self.args.scheduler == 'backoff':
+            return py9kw.ExponentialBackoffPollScheduler(initialWaitSeconds=self.args.poll_seconds, maxWaitSeconds=10 * self.args.poll_seconds)
+        elif self.args.scheduler == 'adaptive':
+            return py9kw.AdaptivePollScheduler(minWaitSeconds=self.args.poll_seconds / 4, maxWaitSeconds=10 * self.args.poll_seconds)
+        return py9kw.FixedPollScheduler()
+
+    def createClient(self) -> py9kw.Py9kw:
+        client = py9kw.Py9kw('bench')
+        client.setApiUrl(self.apiurl)
+        client.setWaitSecondsPerLoop(self.args.poll_seconds)
+        client.setPollScheduler(self.pollscheduler)
+        return client
+
+    def solveOne(self, _) -> tuple:
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.createClient()
+        starttime = time.monotonic()
+        client.uploadcaptcha(IMAGEDATA)
+        answer = client.sleepAndGetResult()
+        return answer, time.monotonic() - starttime
+
+    def runThreads(self, concurrency: int) -> list:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(self.solveOne, range(self.args.captchas)))
+
+    def runPoller(self, concurrency: int) -> list:
+        client = self.createClient()
+        results = []
+        with py9kw_poller.CaptchaPoller(client, maxParallelPolls=concurrency) as poller:
+            pending = []
+            for _ in range(self.args.captchas):
+                pending.append((time.monotonic(), poller.upload(IMAGEDATA)))
+            for starttime, ticket in pending:
+                answer = ticket.result()
+                results.append((answer, ticket.lastpolltime - starttime if answer is not None else 0))
+        return results
+
+    def getServerStats(self) -> dict:
+        return json.loads(py9kw.HTTPConnectionPool().get(self.apiurl + '?action=fakestats'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and latency against the local 9kw API stand-in')
+    parser.add_argument('--captchas', type=int, default=200, help='Captchas per concurrency level')
+    parser.add_argument('--concurrency', default='1,4,16,64', help='Comma separated concurrency levels')
+    parser.add_argument('--solve-median', type=float, default=1, help='Median solve time in seconds (lognormal distribution)')
+    parser.add_argument('--latency', type=float, default=0, help='Extra server seconds per request')
+    parser.add_argument('--no-user-rate', type=float, default=0)
+    parser.add_argument('--poll-seconds', type=float, default=1, help='Seconds between polls (fixed) or initial / minimum wait (backoff, adaptive)')
+    parser.add_argument('--scheduler', choices=('fixed', 'backoff', 'adaptive'), default='fixed')
+    parser.add_argument('--mode', choices=('threads', 'poller'), default='threads')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    portqueue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(portqueue, args.solve_median, args.latency, args.no_user_rate), daemon=True)
+    server.start()
+    bench = Bench('http://127.0.0.1:%d/index.cgi' % portqueue.get(), args)
+    tracemalloc.start()
+    print('%-6s %11s %8s %10s %8s %8s %8s %14s' % ('conc', 'captchas/s', 'solved', 'req/solve', 'p50 s', 'p95 s', 'p99 s', 'peak memory'))
+    for concurrency in [int(level) for level in args.concurrency.split(',')]:
+        statsbefore = bench.getServerStats()
+        tracemalloc.reset_peak()
+        membefore = tracemalloc.get_traced_memory()[0]
+        starttime = time.monotonic()
+        if args.mode == 'poller':
+            results = bench.runPoller(concurrency)
+        else:
+            results = bench.runThreads(concurrency)
+        duration = time.monotonic() - starttime
+        peak = tracemalloc.get_traced_memory()[1] - membefore
+        statsafter = bench.getServerStats()
+        latencies = [seconds for answer, seconds in results if answer is not None]
+        requests = statsafter.get('requests', 0) - statsbefore.get('requests', 0) - 1
+        print('%-6d %11.2f %8d %10.2f %8.2f %8.2f %8.2f %14d' % (concurrency, len(latencies) / duration, len(latencies), requests / max(1, len(latencies)),
+                                                                percentile(latencies, 0.5), percentile(latencies, 0.95), percentile(latencies, 0.99), peak))
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    bench_transport.py - Compares pooled keep-alive connections against one new connection per request.
+#
+#    Runs against a local HTTPS stand-in for index.cgi (self-signed certificate created via the openssl command line tool).
+#    Usage: python3 benchmarks/bench_transport.py [requests per run] [threads]
+#
+
+import http.server
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from py9kw import HTTPConnectionPool  # noqa: E402
+
+
+class CreditsHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps({'credits': 1000, 'status': {'https': 1, 'success': True}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def startHTTPSServer(certdir: str):
+    certfile = os.path.join(certdir, 'cert.pem')
+    keyfile = os.path.join(certdir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), CreditsHandler)
+    servercontext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    servercontext.load_cert_chain(certfile, keyfile)
+    server.socket = servercontext.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    clientcontext = ssl.create_default_context(cafile=certfile)
+    clientcontext.check_hostname = False
+    return server, clientcontext
+
+
+def run(pool: HTTPConnectionPool, url: str, numrequests: int, threads: int):
+    def timedRequest(i):
+        start = time.perf_counter()
+        pool.get(url)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = sorted(executor.map(timedRequest, range(numrequests)))
+    total = time.perf_counter() - start
+    return numrequests / total, statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+def main():
+    numrequests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    with tempfile.TemporaryDirectory() as certdir:
+        server, clientcontext = startHTTPSServer(certdir)
+        url = 'https://127.0.0.1:%d/index.cgi?action=usercaptchaguthaben&apikey=bench&json=1' % server.server_address[1]
+        print('%d requests | %d thread(s)' % (numrequests, threads))
+        print('%-10s %12s %10s %10s %12s' % ('mode', 'requests/s', 'p50 ms', 'p99 ms', 'connections'))
+        for mode, maxsize in (('unpooled', 0), ('pooled', max(threads, 1))):
+            pool = HTTPConnectionPool(maxsize=maxsize, sslcontext=clientcontext)
+            rps, p50, p99 = run(pool, url, numrequests, threads)
+            print('%-10s %12.1f %10.2f %10.2f %12d' % (mode, rps, p50 * 1000, p99 * 1000, pool.connectionsCreated))
+            pool.close()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    bench_upload.py - Bytes on the wire and peak client memory per captcha upload: GET (base64 in the URL) vs. POST (multipart/form-data).
+#
+#    The local index.cgi stand-in runs in its own process so tracemalloc only sees client side allocations.
+#    Usage: python3 benchmarks/bench_upload.py
+#
+
+import http.server
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import py9kw  # noqa: E402
+
+
+class UploadHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    lastwirebytes = 0
+
+    def do_GET(self):
+        if 'action=stats' in self.path:
+            self.respond({'wirebytes': UploadHandler.lastwirebytes})
+        else:
+            self.countAndRespond(0)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        while length > 0:
+            length -= len(self.rfile.read(min(length, 65536)))
+        self.countAndRespond(int(self.headers.get('Content-Length', 0)))
+
+    def countAndRespond(self, bodylength: int):
+        UploadHandler.lastwirebytes = len(self.raw_requestline) + len(self.headers.as_bytes()) + bodylength
+        self.respond({'captchaid': '1'})
+
+    def respond(self, response: dict):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(portqueue):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), UploadHandler)
+    portqueue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def measure(client: py9kw.Py9kw, imagedata):
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    try:
+        client.uploadcaptcha(imagedata)
+        error = None
+    except IOError as e:
+        error = str(e).split(' for url')[0]
+    peak = tracemalloc.get_traced_memory()[1] - before
+    if error is not None:
+        return '-', peak, error
+    wirebytes = json.loads(client.transport.get(client.getApiUrl() + '?action=stats'))['wirebytes']
+    return wirebytes, peak, error
+
+
+def main():
+    logging.disable(logging.INFO)
+    portqueue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(portqueue,), daemon=True)
+    server.start()
+    client = py9kw.Py9kw('bench')
+    client.setApiUrl('http://127.0.0.1:%d/index.cgi' % portqueue.get())
+    client.getCreditLedger().absorb(1000)
+    tracemalloc.start()
+    print('%-10s %-14s %14s %14s  %s' % ('image', 'mode', 'wire bytes', 'peak memory', 'error'))
+    for size in (10 * 1024, 200 * 1024, 2 * 1024 * 1024):
+        imagedata = os.urandom(size)
+        with tempfile.TemporaryFile() as imagefile:
+            imagefile.write(imagedata)
+            for mode, uploadmode, source in (('GET bytes', py9kw.UPLOAD_MODE_GET, imagedata), ('POST bytes', py9kw.UPLOAD_MODE_POST, imagedata),
+                                             ('POST file', py9kw.UPLOAD_MODE_POST, imagefile)):
+                imagefile.seek(0)
+                client.setUploadMode(uploadmode)
+                wirebytes, peak, error = measure(client, source)
+                print('%-10s %-14s %14s %14d  %s' % ('%d KB' % (size // 1024), mode, wirebytes, peak, error or ''))
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,525 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    py9kw_async.py - asyncio counterpart of py9kw for the Captcha-solvingservice 9kw.eu
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import io
+import json
+import ssl
+import time
+from base64 import b64encode
+from typing import Tuple, Union
+from urllib.parse import urlencode, urljoin, urlsplit, unquote
+
+from py9kw import Py9kw, CACHED_CAPTCHA_ID, CancellationToken, CaptchaFeedback, CircuitOpenError, GivenUpError, HTTPStatusError, MultipartBody, ResponseTooLargeError, HTTP_MAX_REDIRECTS, \
+    HTTP_BODY_CHUNK_SIZE, HTTP_POOL_IDLE_TIMEOUT_SECONDS, HTTP_POOL_MAXSIZE, HTTP_TIMEOUT_SECONDS, HTTP_USER_AGENT, PHASE_DOWNLOAD, PHASE_ENCODE, PHASE_FEEDBACK, \
+    PHASE_UPLOAD, getTimeoutForDeadline, logger, _TeeWriter
+
+
+class AsyncHTTPClient:
+    """ Minimal HTTP/1.1 client on top of asyncio streams with persistent keep-alive connections per host. Only does what the 9kw API and captcha image downloads need.
+    maxsize = max. number of idle connections kept per host (0 = no pooling), idletimeout = seconds after which idle connections get dropped. """
+
+    def __init__(self, maxsize: int = HTTP_POOL_MAXSIZE, idletimeout: float = HTTP_POOL_IDLE_TIMEOUT_SECONDS, timeout: float = HTTP_TIMEOUT_SECONDS, proxy: str = None,
+                 sslcontext: ssl.SSLContext = None):
+        self.maxsize = maxsize
+        self.idletimeout = idletimeout
+        self.timeout = timeout
+        self.proxy = urlsplit(proxy) if proxy else None
+        self.sslcontext = sslcontext if sslcontext is not None else ssl.create_default_context()
+        self.idle = {}
+        self.connectionsCreated = 0
+
+    async def get(self, url: str, maxBytes: int = None, timeout: float = None, sink=None) -> bytes:
+        """ Returns the body of the given URL. Follows redirects and raises IOError on connection failures and http error status codes just like urlopen does.
+        See request for maxBytes, timeout and sink. """
+        for redirect in range(HTTP_MAX_REDIRECTS + 1):
+            status, headers, body = await self.request('GET', url, maxBytes=maxBytes, timeout=timeout, sink=sink)
+            location = headers.get('location')
+            if status in (301, 302, 303, 307, 308) and location is not None:
+                url = urljoin(url, location)
+                continue
+            if status >= 400:
+                raise HTTPStatusError(status, url)
+            return body
+        raise IOError('Too many redirects for url: %s' % url)
+
+    async def post(self, url: str, body, contenttype: str) -> bytes:
+        """ POSTs the given body (bytes or MultipartBody) and returns the response body. Raises IOError on failures just like get. """
+        status, headers, data = await self.request('POST', url, body, {'Content-Type': contenttype})
+        if status >= 400:
+            raise HTTPStatusError(status, url)
+        return data
+
+    async def request(self, method: str, url: str, body=None, headers: dict = None, maxBytes: int = None, timeout: float = None, sink=None) -> Tuple[int, dict, bytes]:
+        """ Sends one request and returns status, headers (lowercase keys) and body. Stale pooled connections get replaced transparently.
+        Bodies larger than maxBytes raise ResponseTooLargeError as soon as they get that large, timeout = max. seconds for the whole request (default: timeout of
+        this client). With sink (binary file like object), the body of 2xx responses gets written to it in chunks and b'' is returned as body. """
+        return await asyncio.wait_for(self._request(method, url, body, headers, maxBytes, sink), timeout if timeout is not None else self.timeout)
+
+    async def close(self):
+        """ Closes all idle connections. """
+        idle = self.idle
+        self.idle = {}
+        for connections in idle.values():
+            for reader, writer, lastused in connections:
+                await self._closeWriter(writer)
+
+    async def _closeWriter(self, writer: asyncio.StreamWriter):
+        """ Closes the connection and waits until it is closed. Errors of connections which are broken anyways get ignored. """
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            pass
+
+    async def _request(self, method: str, url: str, body: bytes, headers: dict, maxBytes: Union[int, None], sink):
+        parsedurl = urlsplit(url)
+        key = (parsedurl.scheme, parsedurl.hostname, parsedurl.port or (443 if parsedurl.scheme == 'https' else 80))
+        if self.proxy is not None and parsedurl.scheme == 'http':
+            path = url
+        else:
+            path = parsedurl.path or '/'
+            if parsedurl.query:
+                path += '?' + parsedurl.query
+        requestheaders = {'Host': parsedurl.netloc, 'User-Agent': HTTP_USER_AGENT, 'Accept-Encoding': 'identity', 'Content-Length': str(len(body)) if body is not None else None}
+        if headers is not None:
+            requestheaders.update(headers)
+        head = '%s %s HTTP/1.1\r\n' % (method, path) + ''.join('%s: %s\r\n' % (k, v) for k, v in requestheaders.items() if v is not None) + '\r\n'
+        while True:
+            reader, writer, reused = await self._acquire(key)
+            sent = False
+            received = False
+            try:
+                writer.write(head.encode('latin-1'))
+                if isinstance(body, (bytes, bytearray, memoryview)):
+                    writer.write(body)
+                elif body is not None:
+                    # Streamed body e.g. MultipartBody
+                    for chunk in body:
+                        writer.write(chunk)
+                        await writer.drain()
+                await writer.drain()
+                sent = True
+                status_line = await reader.readline()
+                received = len(status_line) > 0
+                status, responseheaders, data, keepalive = await self._readResponse(reader, status_line, url, maxBytes, sink)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                await self._closeWriter(writer)
+                if reused and not received and (method != 'POST' or not sent):
+                    # Server has closed the idle connection in the meantime --> Retry with a new one. Never after a POST got sent completely:
+                    # The server may have processed it (e.g. an upload which would get charged twice).
+                    continue
+                if isinstance(e, OSError):
+                    raise
+                raise IOError('HTTP failure for url %s: %r' % (url, e)) from e
+            except BaseException:
+                # e.g. cancelled --> Connection is in an undefined state, do not wait for it anymore
+                writer.close()
+                raise
+            if keepalive:
+                await self._release(key, reader, writer)
+            else:
+                await self._closeWriter(writer)
+            return status, responseheaders, data
+
+    async def _acquire(self, key):
+        now = time.monotonic()
+        connections = self.idle.get(key)
+        while connections:
+            reader, writer, lastused = connections.pop()
+            if now - lastused <= self.idletimeout and not reader.at_eof():
+                return reader, writer, True
+            await self._closeWriter(writer)
+        self.connectionsCreated += 1
+        scheme, host, port = key
+        if self.proxy is None:
+            reader, writer = await asyncio.open_connection(host, port, ssl=self.sslcontext if scheme == 'https' else None)
+            return reader, writer, False
+        reader, writer = await asyncio.open_connection(self.proxy.hostname, self.proxy.port or 8080)
+        if scheme == 'https':
+            # Tunnel through the proxy via CONNECT
+            connect = 'CONNECT %s:%d HTTP/1.1\r\nHost: %s:%d\r\n' % (host, port, host, port)
+            if self.proxy.username is not None:
+                credentials = b64encode(('%s:%s' % (unquote(self.proxy.username), unquote(self.proxy.password or ''))).encode('utf-8')).decode('ascii')
+                connect += 'Proxy-Authorization: Basic %s\r\n' % credentials
+            writer.write((connect + '\r\n').encode('latin-1'))
+            await writer.drain()
+            status_line = (await reader.readline()).decode('latin-1')
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if ' 200 ' not in status_line:
+                await self._closeWriter(writer)
+                raise IOError('Proxy CONNECT failed: %s' % status_line.strip())
+            # StreamWriter.start_tls needs Python 3.11+
+            await writer.start_tls(self.sslcontext, server_hostname=host)
+        return reader, writer, False
+
+    async def _release(self, key, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connections = self.idle.setdefault(key, [])
+        if len(connections) < self.maxsize:
+            connections.append((reader, writer, time.monotonic()))
+        else:
+            await self._closeWriter(writer)
+
+    @staticmethod
+    async def _readResponse(reader: asyncio.StreamReader, status_line: bytes, url: str, maxBytes: Union[int, None], sink):
+        status_line = status_line.decode('latin-1')
+        if status_line == '':
+            raise asyncio.IncompleteReadError(b'', None)
+        try:
+            version, status = status_line.split(' ', 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise IOError('Invalid http status line: %r' % status_line)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        keepalive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        body = _BodyReader(reader, url, sink if 200 <= status < 300 else None, maxBytes)
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            while True:
+                chunksize = int((await reader.readline()).split(b';', 1)[0].strip(), 16)
+                if chunksize == 0:
+                    # Skip trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                await body.read(chunksize)
+                await reader.readline()
+        elif 'content-length' in headers:
+            if maxBytes is not None and int(headers['content-length']) > maxBytes:
+                raise ResponseTooLargeError(maxBytes, url)
+            await body.read(int(headers['content-length']))
+        elif status not in (204, 304):
+            await body.read()
+            keepalive = False
+        return status, headers, body.getvalue(), keepalive
+
+
+class _BodyReader:
+    """ Reads a response body in chunks of HTTP_BODY_CHUNK_SIZE into sink (or memory) and raises ResponseTooLargeError as soon as it exceeds maxBytes. """
+
+    def __init__(self, reader: asyncio.StreamReader, url: str, sink, maxBytes: Union[int, None]):
+        self.reader = reader
+        self.url = url
+        self.sink = sink
+        self.maxBytes = maxBytes
+        self.chunks = []
+        self.total = 0
+
+    async def read(self, length: int = None):
+        """ Reads length bytes, None = until EOF. """
+        while length is None or length > 0:
+            chunk = await self.reader.read(HTTP_BODY_CHUNK_SIZE if length is None else min(HTTP_BODY_CHUNK_SIZE, length))
+            if not chunk:
+                if length is None:
+                    return
+                raise asyncio.IncompleteReadError(b'', length)
+            self.total += len(chunk)
+            if self.maxBytes is not None and self.total > self.maxBytes:
+                raise ResponseTooLargeError(self.maxBytes, self.url)
+            if length is not None:
+                length -= len(chunk)
+            if self.sink is not None:
+                self.sink.write(chunk)
+            else:
+                self.chunks.append(chunk)
+
+    def getvalue(self) -> bytes:
+        return b''.join(self.chunks)
+
+
+class AsyncPy9kw(Py9kw):
+    """ asyncio counterpart of Py9kw: Same settings, error codes and return values but all network calls and waits are awaitable. """
+
+    def __init__(self, apikey: str, env_proxy: bool = False, proxy: str = None, httpclient: AsyncHTTPClient = None):
+        super().__init__(apikey, env_proxy, proxy)
+        self.httpclient = httpclient if httpclient is not None else AsyncHTTPClient(proxy=self.proxy)
+
+    async def close(self):
+        """ Closes all idle connections of this instance. """
+        await self.httpclient.close()
+        # Sync transport and image fetcher of Py9kw: Never used for requests here, the image fetcher only holds maxBytes and timeout of downloads
+        super().close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def getCaptchaImageFromWebsite(self, image_url: str, image_path: str = None):
+        """ Returns (captcha) image file obtained from website. And optionally saves it to <image_path>. """
+        imagefile = None
+        starttime = self._getPhaseStartTime()
+        try:
+            if not image_url.startswith(('http://', 'https://')):
+                raise IOError('Not a http(s) URL: %.100s' % image_url)
+            buffer = io.BytesIO()
+            if image_path is None:
+                await self.httpclient.get(image_url, self.imagefetcher.maxBytes, self.imagefetcher.timeout, buffer)
+            else:
+                # Write-through like ImageFetcher: Every chunk goes to the file and the buffer
+                with open(image_path, 'wb') as file:
+                    await self.httpclient.get(image_url, self.imagefetcher.maxBytes, self.imagefetcher.timeout, _TeeWriter(buffer, file))
+            imagefile = buffer.getvalue()
+            logger.debug('[getCaptchaImageFromWebsite] [OK]')
+        except (IOError, asyncio.TimeoutError) as e:
+            logger.warning('[getCaptchaImageFromWebsite] %s', e)
+            self._setDownloadFailure()
+        self._onPhaseDone(PHASE_DOWNLOAD, starttime)
+        return imagefile
+
+    async def _apiRequest(self, getdata: dict, body: MultipartBody = None) -> dict:
+        while True:
+            waitSeconds = self._getThrottleSeconds(getdata, body)
+            if waitSeconds <= 0:
+                break
+            await self._waitForRateGovernor(waitSeconds)
+        starttime = self._getPhaseStartTime()
+        try:
+            if self.circuitbreaker is not None:
+                self.circuitbreaker.allowRequest()
+            if body is not None:
+                json_plain = (await self.httpclient.post(self.apiurl, body, body.contenttype)).decode('utf-8', 'ignore')
+            else:
+                json_plain = (await self.httpclient.get(self.apiurl + '?' + urlencode(getdata))).decode('utf-8', 'ignore')
+            logger.debug('[apiRequest] json debug: %s', json_plain)
+            response = json.loads(json_plain)
+        except Exception as e:
+            self._onRequestDone(getdata, body, starttime, error=e)
+            raise
+        self._onRequestDone(getdata, body, starttime, response)
+        return response
+
+    async def uploadcaptcha(self, imagedata, store_image_path=None, maxtimeout: int = None, prio: int = -1) -> int:
+        """Upload the Captcha to 9kw.eu (gif/jpg/png). imagedata = raw image as bytes, bytearray, memoryview or binary file object, ImageFile (path),
+        Base64Image (already base64 encoded) or URL (str). """
+        logger_prefix = '[uploadcaptcha] '
+        if self.ledger.needsRefresh():
+            await self.getcredits()
+        if not self._prepareUpload(maxtimeout, prio):
+            return -1
+        try:
+            with self._openImage(imagedata) as imagedata:
+                if self._isImageURL(imagedata):
+                    logger.debug(logger_prefix + 'Provided source is an URL: %s', imagedata)
+                    imagedata = await self.getCaptchaImageFromWebsite(imagedata, store_image_path)
+                    if self.errorcode > -1:
+                        logger.warning(logger_prefix + 'Error during picture download')
+                        self.ledger.release(self.reservation)
+                        return self.captchaid
+                if self._findCachedAnswer(imagedata):
+                    return self.captchaid
+                return self._handleUploadResponse(await self._sendUpload(imagedata))
+        except BaseException:
+            self.ledger.release(self.reservation)
+            raise
+
+    async def _sendUpload(self, imagedata) -> dict:
+        if self.imagecompactor is not None:
+            # CPU bound --> Keep the event loop free
+            imagedata = await asyncio.get_running_loop().run_in_executor(None, self._compactImage, imagedata)
+        starttime = self._getPhaseStartTime()
+        getdata, body = self._getUploadRequest(imagedata)
+        self._onPhaseDone(PHASE_ENCODE, starttime)
+        starttime = self._getPhaseStartTime()
+        try:
+            return await self._apiRequest(getdata, body)
+        except HTTPStatusError as e:
+            if not self._fallbackToGetUpload(body, e):
+                raise
+            return await self._apiRequest(*self._getUploadRequest(imagedata))
+        finally:
+            self._onPhaseDone(PHASE_UPLOAD, starttime)
+
+    async def solve(self, imagedata, deadline: float = None, token: CancellationToken = None, store_image_path=None) -> Union[str, None]:
+        """ Uploads the captcha and waits for its answer, see Py9kw.solve. Cancelling the awaiting task aborts the captcha as well. """
+        if self._isGivenUp(deadline, token):
+            return None
+        maxtimeout = self.maxtimeout
+        try:
+            with self._givingUp(deadline, token):
+                if await self.uploadcaptcha(imagedata, store_image_path, getTimeoutForDeadline(deadline) if deadline is not None else None, None) == -1:
+                    return None
+            return await self.sleepAndGetResult(deadline, token)
+        except GivenUpError as e:
+            self._setGivenUpBeforeUpload(e)
+            return None
+        finally:
+            self.maxtimeout = maxtimeout
+
+    async def sleepAndGetResult(self, deadline: float = None, token: CancellationToken = None) -> Union[str, None]:
+        """Wait until the Captcha is solved and return result. Only the waiting task gets suspended, the event loop keeps running.
+        deadline and token: See Py9kw.sleepAndGetResult. Cancelling the waiting task aborts the captcha as well."""
+        logger_prefix = '[sleepAndGetResult] '
+        logger.debug(logger_prefix + 'Waiting until the Captcha is solved or maxtimeout %d has expired ...', self.getTimeout())
+        if self.captchaid == -1:
+            logger.warning(logger_prefix + 'WARNING: No captchaid given - no way to get a result!')
+            return None
+        if self.cachedanswer is not None:
+            return self._getCachedResult()
+        try:
+            with self._givingUp(deadline, token):
+                return await self._waitForResult(deadline, token)
+        except asyncio.CancelledError:
+            if not self.captchadone:
+                # Shielded so that the abort request gets sent even if the task gets cancelled again
+                await asyncio.shield(self._abortEarly('cancelled'))
+            raise
+
+    async def _waitForResult(self, deadline: Union[float, None], token: Union[CancellationToken, None]) -> Union[str, None]:
+        logger_prefix = '[sleepAndGetResult] '
+        total_time_waited = 0
+        waitSecondsLeft = self._getWaitSecondsLeft(deadline)
+        while True:
+            thisSecondsWait = self._getNextPollWaitSeconds(waitSecondsLeft)
+            if thisSecondsWait > 0:
+                if await self._sleep(thisSecondsWait, token):
+                    await self._abortEarly('cancelled')
+                    return None
+                total_time_waited += thisSecondsWait
+                waitSecondsLeft -= thisSecondsWait
+            try:
+                captchaResult = await self.getresult()
+            except CircuitOpenError as e:
+                # Poll got shed --> Try again once the circuit breaker lets requests through
+                thisSecondsWait = min(e.retryAfter, waitSecondsLeft)
+                if await self._sleep(thisSecondsWait, token):
+                    await self._abortEarly('cancelled')
+                    return None
+                total_time_waited += thisSecondsWait
+                waitSecondsLeft -= thisSecondsWait
+                if waitSecondsLeft <= 0:
+                    break
+                continue
+            except GivenUpError as e:
+                # Poll waited for the rate governor until the caller gave up
+                if e.reason == 'cancelled' or self._isAbortableAt(deadline):
+                    await self._abortEarly(e.reason)
+                else:
+                    self._setInternalTimeout()
+                return None
+            if captchaResult is not None:
+                logger.debug(logger_prefix + 'Done!Total seconds waited for result: %d | Polls: %d', total_time_waited, self.polls)
+                return captchaResult
+            if self._shouldStopPolling():
+                if self.errorcode in (-1, 602):
+                    # Server does not want us to try again. API errors like 600 ERROR_NO_USER are kept.
+                    self._setInternalTimeout()
+                return None
+            if waitSecondsLeft <= 0:
+                break
+        # Out of time, also if the last polls got shed by the circuit breaker
+        if self._isAbortableAt(deadline):
+            await self._abortEarly('deadline')
+            return None
+        self._setInternalTimeout()
+        return None
+
+    @staticmethod
+    async def _sleep(seconds: float, token: Union[CancellationToken, None]) -> bool:
+        """ Sleeps, returns True as soon as the token got cancelled. """
+        if token is None:
+            await asyncio.sleep(seconds)
+            return False
+        loop = asyncio.get_running_loop()
+        cancelled = asyncio.Event()
+
+        def wakeUp():
+            loop.call_soon_threadsafe(cancelled.set)
+        token.addCallback(wakeUp)
+        try:
+            await asyncio.wait_for(cancelled.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            token.removeCallback(wakeUp)
+        return token.isCancelled()
+
+    async def _waitForRateGovernor(self, waitSeconds: float):
+        """ See Py9kw._waitForRateGovernor. """
+        deadline, token = self.giveup if self.giveup is not None else (None, None)
+        if deadline is not None and time.monotonic() + waitSeconds >= deadline:
+            raise GivenUpError('deadline')
+        if await self._sleep(waitSeconds, token):
+            raise GivenUpError('cancelled')
+
+    async def _abortEarly(self, reason: str):
+        """ The caller gave up on the current captcha (reason = 'deadline' or 'cancelled') --> Abort it serverside so that it costs nothing. """
+        logger.info('[sleepAndGetResult] Captchaid %d is not needed anymore (%s) --> Aborting it', self.captchaid, reason)
+        credits = self.reservation.cost if self.reservation is not None and self.reservation.state == 'reserved' else 0
+        # The abort request has to wait for the rate governor no matter what
+        self.giveup = None
+        if not await self.abortCaptcha():
+            credits = 0
+        self._setAborted(reason, credits)
+
+    async def getresult(self) -> Union[str, None]:
+        """Get result from 9kw.eu. Use sleepAndGetResult for auto-wait handling! """
+        if self.cachedanswer is not None:
+            return self._getCachedResult()
+        logger.debug('[getresult] Try to fetch the solved result from 9kw.eu...')
+        return self._handleResultResponse(await self._apiRequest(self._getResultData()))
+
+    async def setCaptchaCorrect(self, iscorrect: bool) -> bool:
+        """Send feedback, is the Captcha result correct or not?"""
+        self._onCaptchaCorrect(iscorrect)
+        return await self.sendCaptchaFeedback(self._getCorrectFeedbackNumber(iscorrect))
+
+    async def abortCaptcha(self) -> bool:
+        """Send feedback, aborts the already sent captcha. If no answer is available yet, no credits will be used in this case!"""
+        return await self.sendCaptchaFeedback(CaptchaFeedback.CAPTCHA_ABORT_CURRENT_CAPTCHA.value)
+
+    async def sendCaptchaFeedback(self, captchaFeedbackNumber) -> bool:
+        """Send feedback, is the Captcha result correct(=1) or not(=2) or does the user want to abort(=3)?"""
+        if self.captchaid == CACHED_CAPTCHA_ID and self.cachedanswer is not None:
+            return True
+        getdata = self._getFeedbackData(captchaFeedbackNumber)
+        if getdata is None:
+            return False
+        if self.feedbackqueue is not None and self.feedbackqueue.put(getdata):
+            self._onFeedbackSent(captchaFeedbackNumber)
+            return True
+        starttime = self._getPhaseStartTime()
+        try:
+            self.checkError(await self._apiRequest(getdata))
+            self._onFeedbackSent(captchaFeedbackNumber)
+            return True
+        except Exception as e:
+            logger.warning('[sendCaptchaFeedback] Error in captcha_correct: %s', e)
+            return False
+        finally:
+            self._onPhaseDone(PHASE_FEEDBACK, starttime)
+
+    async def getcredits(self):
+        """Get aviable Credits..."""
+        logger.debug('[getcredits] Get available Credits...')
+        return self._handleCreditsResponse(await self._apiRequest(self._getCreditsData()))
+
+    async def canSolveOneMoreCaptcha(self) -> bool:
+        """ Returns True if there are enough credits available to solve one more captcha. Depending on the currently set priority.
+        Credits reserved for captchas in flight are not available. Only asks the server if the local credit ledger is outdated. """
+        if self.ledger.needsRefresh():
+            await self.getcredits()
+        return self.ledger.getAvailable() >= self.getCaptchaCost()
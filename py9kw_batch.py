@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    py9kw_batch.py - Solves directories, lists or JSONL streams of captchas with 9kw.eu and streams the results as JSONL
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import argparse
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import IO, Iterable, Iterator, List, Tuple, Union
+
+from py9kw import Py9kw, API_BASE, CACHED_CAPTCHA_ID, AdaptivePollScheduler, Base64Image, ImageFile, LOG_MODE_EVENTS, LOG_MODE_QUIET, LOG_MODE_TEXT, Metrics, logger, setLogMode
+from py9kw_poller import CaptchaTicket
+from py9kw_pool import CaptchaSolverPool
+
+# Shorter lines which are neither files nor URLs are not treated as base64 encoded images
+BASE64_MIN_LENGTH = 64
+
+
+def parseJob(line: str) -> Union[Tuple[str, object], None]:
+    """ Returns id and image (ImageFile, URL or Base64Image) of one input line or None for empty lines and comments.
+    Lines are JSON objects with 'path', 'url' or 'base64' and an optional 'id' or plain image paths, URLs or base64 blobs (also as data: URI).
+    Jobs without id get their path, URL or the hash of their base64 blob as id so that checkpoints still match after the input got reordered. """
+    line = line.strip()
+    if len(line) == 0 or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        item = json.loads(line)
+        if item.get('path') is not None:
+            return str(item.get('id', item['path'])), ImageFile(item['path'])
+        elif item.get('url') is not None:
+            return str(item.get('id', item['url'])), item['url']
+        elif item.get('base64') is not None:
+            data = item['base64'].split(',', 1)[1] if item['base64'].startswith('data:') else item['base64']
+            return str(item.get('id', 'sha1:' + hashlib.sha1(data.encode('ascii')).hexdigest())), Base64Image(data)
+        raise ValueError('Neither path nor url nor base64 given')
+    if line.startswith(('http://', 'https://')):
+        return line, line
+    if line.startswith('data:'):
+        line = line.split(',', 1)[1]
+    elif os.path.isfile(line):
+        return line, ImageFile(line)
+    elif len(line) < BASE64_MIN_LENGTH:
+        # Too short for an image --> Rather a path with a typo than a blob
+        raise ValueError('No such file: %s' % line)
+    try:
+        base64.b64decode(line, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError('Neither an existing file nor an URL nor base64: %.100s' % line)
+    return 'sha1:' + hashlib.sha1(line.encode('ascii')).hexdigest(), Base64Image(line)
+
+
+def iterJobs(inputs: Iterable[str], stdin: IO = None) -> Iterator[Tuple[str, object]]:
+    """ Yields id and image of all captchas of the given inputs: '-' = lines from stdin, directory = all its files, other files = one job per line. """
+    for source in inputs:
+        if source == '-':
+            lines = stdin if stdin is not None else sys.stdin
+            yield from _iterLines(lines, '<stdin>')
+        elif os.path.isdir(source):
+            for entry in sorted(os.scandir(source), key=lambda entry: entry.name):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    yield entry.path, ImageFile(entry.path)
+        else:
+            with open(source, 'r', encoding='utf-8') as lines:
+                yield from _iterLines(lines, source)
+
+
+def _iterLines(lines: Iterable[str], source: str) -> Iterator[Tuple[str, object]]:
+    for lineno, line in enumerate(lines, 1):
+        try:
+            job = parseJob(line)
+        except ValueError as e:
+            logger.warning('[batch] Skipping invalid line %s:%d: %s', source, lineno, e)
+            continue
+        if job is not None:
+            yield job
+
+
+def percentile(values: List[float], quantile: float) -> Union[float, None]:
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(quantile * (len(values) - 1))))]
+
+
+class BatchSolver:
+    """ Solves jobs (id, image) with a CaptchaSolverPool of concurrency workers and writes one JSON line per captcha to output as soon as it is done
+    (in the order in which they got done, not the input order). With checkpoint, the ids of done captchas get appended to that file and jobs found in
+    it get skipped on the next run: solved ones always, failed ones unless retryFailed. Stops submitting once the credits are used up. """
+
+    def __init__(self, pool: CaptchaSolverPool, output: IO, checkpoint: str = None, retryFailed: bool = False, metrics: Metrics = None):
+        self.pool = pool
+        self.output = output
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.done = set()
+        self.checkpoint = None
+        if checkpoint is not None:
+            if os.path.exists(checkpoint):
+                with open(checkpoint, 'r', encoding='utf-8') as file:
+                    for line in file:
+                        if len(line.strip()) > 0:
+                            entry = json.loads(line)
+                            if entry.get('ok') or not retryFailed:
+                                self.done.add(entry['id'])
+            self.checkpoint = open(checkpoint, 'a', encoding='utf-8')
+        self.submitted = 0
+        self.skipped = 0
+        self.solved = 0
+        self.cached = 0
+        self.failed = 0
+        self.latencies = []
+        self.starttime = None
+        self.endtime = None
+        # Set on Ctrl+C: Captchas which never got uploaded do not go into the checkpoint then
+        self.interrupted = False
+
+    def run(self, jobs: Iterable[Tuple[str, object]]) -> dict:
+        """ Solves all given jobs, returns the summary (see getSummary). """
+        self.starttime = time.monotonic()
+        try:
+            for jobid, imagedata in jobs:
+                if jobid in self.done:
+                    self.skipped += 1
+                    continue
+                # Same captcha listed twice
+                self.done.add(jobid)
+                ticket = self.pool.submit(imagedata)
+                if ticket.done() and ticket.captchaid == -1 and ticket.errorcode == -1 and ticket.future.exception() is None:
+                    logger.warning('[batch] Not enough credits to solve more captchas --> Stopping')
+                    break
+                self.submitted += 1
+                ticket.addCallback(lambda ticket, jobid=jobid: self._onDone(jobid, ticket))
+        finally:
+            # Waits for everything which got submitted, queued ones get cancelled after Ctrl+C
+            self.interrupted = sys.exc_info()[0] is not None
+            self.pool.close(cancelPending=self.interrupted)
+            self.endtime = time.monotonic()
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+        return self.getSummary()
+
+    def getSummary(self) -> dict:
+        """ Captchas submitted, skipped (in the checkpoint or listed twice), solved, cached, failed, seconds, captchas per second and minute, latency percentiles of the solved
+        ones (from submit until answer) and credits spent (needs metrics). """
+        seconds = (self.endtime if self.endtime is not None else time.monotonic()) - self.starttime if self.starttime is not None else 0
+        with self.lock:
+            finished = self.solved + self.failed
+            summary = {'submitted': self.submitted, 'skipped': self.skipped, 'solved': self.solved, 'cached': self.cached, 'failed': self.failed,
+                       'seconds': round(seconds, 3), 'perSecond': finished / seconds if seconds > 0 else 0,
+                       'perMinute': 60 * finished / seconds if seconds > 0 else 0,
+                       'p50': percentile(self.latencies, 0.5), 'p90': percentile(self.latencies, 0.9), 'p99': percentile(self.latencies, 0.99)}
+        if self.metrics is not None:
+            summary['credits'] = int(self.metrics.getCounter('py9kw_credits_spent_total'))
+        return summary
+
+    def _onDone(self, jobid: str, ticket: CaptchaTicket):
+        seconds = time.monotonic() - ticket.uploadtime
+        error = ticket.future.exception()
+        record = {'id': jobid, 'captchaid': ticket.captchaid, 'answer': ticket.answer, 'errorcode': ticket.errorcode,
+                  'errormsg': str(error) if error is not None else ticket.errormsg, 'polls': ticket.polls, 'seconds': round(seconds, 3),
+                  'phases': {phase: round(phaseSeconds, 3) for phase, phaseSeconds in ticket.phases.items()}}
+        with self.lock:
+            if ticket.answer is not None:
+                self.solved += 1
+                self.latencies.append(seconds)
+                if ticket.captchaid == CACHED_CAPTCHA_ID:
+                    self.cached += 1
+            else:
+                self.failed += 1
+            self.output.write(json.dumps(record) + '\n')
+            self.output.flush()
+            if self.checkpoint is not None and not (self.interrupted and ticket.captchaid == -1):
+                self.checkpoint.write(json.dumps({'id': jobid, 'ok': ticket.answer is not None}) + '\n')
+                self.checkpoint.flush()
+
+
+def formatSummary(summary: dict) -> str:
+    def formatSeconds(seconds: Union[float, None]) -> str:
+        return '-' if seconds is None else '%.2f' % seconds
+
+    lines = ['Solved %d of %d captchas (%d from cache, %d failed, %d skipped as done before) in %.1f seconds' % (
+        summary['solved'], summary['submitted'], summary['cached'], summary['failed'], summary['skipped'], summary['seconds']),
+             'Throughput: %.2f captchas per second (%.1f per minute)' % (summary['perSecond'], summary['perMinute']),
+             'Latency: p50 %s s | p90 %s s | p99 %s s' % (formatSeconds(summary['p50']), formatSeconds(summary['p90']), formatSeconds(summary['p99']))]
+    if 'credits' in summary:
+        lines.append('Credits spent: %d (%.1f per solved captcha)' % (summary['credits'], summary['credits'] / summary['solved'] if summary['solved'] > 0
+                                                                      else 0))
+    return '\n'.join(lines)
+
+
+def main(argv: List[str] = None, prog: str = None) -> int:
+    parser = argparse.ArgumentParser(prog=prog, description='Solves captchas with 9kw.eu and writes one JSON line per captcha as soon as it is done')
+    parser.add_argument('inputs', nargs='*', default=['-'],
+                        help='Directories (all files), files with one image path, URL, base64 blob or JSON object ({"id", "path" | "url" | "base64"}) '
+                             'per line, - = the same from stdin (default)')
+    parser.add_argument('--apikey', default=os.environ.get('PY9KW_APIKEY'), help='Default: environment variable PY9KW_APIKEY')
+    parser.add_argument('--concurrency', type=int, default=8, help='Captchas in flight at once')
+    parser.add_argument('--prio', type=int, default=None)
+    parser.add_argument('--timeout', type=int, default=None, help='maxtimeout per captcha in seconds')
+    parser.add_argument('--param', action='append', default=[], metavar='KEY=VALUE', help='Additional upload param e.g. numeric=1, can be repeated')
+    parser.add_argument('--poll-seconds', type=float, default=None, help='Seconds between result polls')
+    parser.add_argument('--adaptive-polling', action='store_true', help='Poll densely around the expected answer (see AdaptivePollScheduler)')
+    parser.add_argument('--output', default='-', help='JSONL results, - = stdout (default)')
+    parser.add_argument('--checkpoint', default=None, help='File with the ids of done captchas: They get skipped when running again')
+    parser.add_argument('--retry-failed', action='store_true', help='Solve captchas which failed in a previous run (see --checkpoint) again')
+    parser.add_argument('--api-url', default=API_BASE, help='e.g. the one of py9kw_fakeserver for testing')
+    parser.add_argument('--env-proxy', action='store_true', help='Use the https_proxy/http_proxy environment variables')
+    parser.add_argument('--proxy', default=None)
+    parser.add_argument('--log-mode', choices=(LOG_MODE_TEXT, LOG_MODE_EVENTS, LOG_MODE_QUIET), default=LOG_MODE_QUIET)
+    args = parser.parse_args(argv)
+    if not args.apikey:
+        parser.error('--apikey or PY9KW_APIKEY is required')
+    params = {}
+    for param in args.param:
+        key, separator, value = param.partition('=')
+        if len(separator) == 0:
+            parser.error('--param needs KEY=VALUE: %s' % param)
+        params[key] = value
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    setLogMode(args.log_mode)
+    metrics = Metrics()
+    pollscheduler = AdaptivePollScheduler() if args.adaptive_polling else None
+
+    def configure(client: Py9kw):
+        client.setApiUrl(args.api_url)
+        client.setMetrics(metrics)
+        client.setAdditionalCaptchaUploadParams(params)
+        if args.prio is not None:
+            client.setPriority(args.prio)
+        if args.timeout is not None:
+            client.setTimeout(args.timeout)
+        if args.poll_seconds is not None:
+            client.setWaitSecondsPerLoop(args.poll_seconds)
+        if pollscheduler is not None:
+            client.setPollScheduler(pollscheduler)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'a', encoding='utf-8')
+    pool = CaptchaSolverPool(args.apikey, args.concurrency, configure=configure, env_proxy=args.env_proxy, proxy=args.proxy)
+    solver = BatchSolver(pool, output, args.checkpoint, args.retry_failed, metrics)
+    try:
+        solver.run(iterJobs(args.inputs))
+    except KeyboardInterrupt:
+        print('Interrupted --> Captchas which were not done yet get solved on the next run', file=sys.stderr)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(formatSummary(solver.getSummary()), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    py9kw_fakeserver.py - Local stand-in for the 9kw.eu API (index.cgi) for tests and benchmarks without spending credits
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import collections
+import email.parser
+import email.policy
+import http.server
+import itertools
+import json
+import random
+import threading
+import time
+from typing import Callable, Union
+from urllib.parse import parse_qsl, urlsplit
+
+from py9kw import PARAM_MAX_PRIO, PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA, PARAM_MIN_MAXTIMEOUT, PARAM_MAX_MAXTIMEOUT
+
+
+def constant(seconds: float) -> Callable[[], float]:
+    return lambda: seconds
+
+
+def uniform(minSeconds: float, maxSeconds: float) -> Callable[[], float]:
+    return lambda: random.uniform(minSeconds, maxSeconds)
+
+
+def lognormal(medianSeconds: float, sigma: float = 0.5) -> Callable[[], float]:
+    """ Right-skewed like real solve times: Most captchas are solved around the median, some take much longer. """
+    return lambda: medianSeconds * random.lognormvariate(0, sigma)
+
+
+class FakeApiConfig:
+    """ Behavior of the FakeApiServer. Times are functions returning seconds, rates are probabilities between 0 and 1.
+    solveTime = seconds from upload until a user answers, latency = extra delay per request, noUserRate = captchas nobody solves (ERROR NO USER),
+    httpErrorRate = requests failing with http status 500, credits = initial credits of every API key, stringCredits = return credits as String like
+    the real API sometimes does, apikeys = valid API keys (None = all), prioSpeedup = solve times get divided by 1 + prioSpeedup * prio. """
+
+    def __init__(self, solveTime: Callable[[], float] = lognormal(1), latency: Callable[[], float] = constant(0), noUserRate: float = 0,
+                 httpErrorRate: float = 0, credits: int = 100000, stringCredits: bool = True, apikeys: set = None, prioSpeedup: float = 0):
+        self.solveTime = solveTime
+        self.latency = latency
+        self.noUserRate = noUserRate
+        self.httpErrorRate = httpErrorRate
+        self.credits = credits
+        self.stringCredits = stringCredits
+        self.apikeys = apikeys
+        self.prioSpeedup = prioSpeedup
+
+
+class FakeCaptcha:
+
+    def __init__(self, captchaid: int, apikey: str, cost: int, maxtimeout: int, solveSeconds: float, nouser: bool):
+        self.captchaid = captchaid
+        self.apikey = apikey
+        self.cost = cost
+        self.uploadtime = time.monotonic()
+        self.maxtimeout = maxtimeout
+        self.nouser = nouser or solveSeconds > maxtimeout
+        self.readytime = self.uploadtime + (maxtimeout if self.nouser else solveSeconds)
+        self.answer = None if self.nouser else 'answer%d' % captchaid
+        self.charged = False
+        self.aborted = False
+        self.feedback = None
+
+
+class FakeApiServer(http.server.ThreadingHTTPServer):
+    """ Threaded HTTP server which answers like index.cgi of 9kw.eu: usercaptchaupload (GET with base64 or multipart POST), usercaptchacorrectdata,
+    usercaptchacorrectback and usercaptchaguthaben. Use getApiUrl() as Py9kw.setApiUrl and getStats() for request counters.
+    Answers are 'answer<captchaid>'. Solved captchas cost 10 + prio credits which get refunded on negative feedback.
+    failNext() injects http errors deterministically, e.g. for tests of retries. """
+
+    daemon_threads = True
+
+    def __init__(self, config: FakeApiConfig = None, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), FakeApiRequestHandler)
+        self.config = config if config is not None else FakeApiConfig()
+        self.lock = threading.Lock()
+        self.captchas = {}
+        self.credits = collections.defaultdict(lambda: self.config.credits)
+        self.captchaids = itertools.count(1)
+        self.stats = collections.Counter()
+        self.failures = []
+        self.thread = None
+
+    def getApiUrl(self) -> str:
+        return 'http://%s:%d/index.cgi' % self.server_address[:2]
+
+    def start(self) -> 'FakeApiServer':
+        """ Serves in a background thread. """
+        self.thread = threading.Thread(target=self.serve_forever, name='py9kw-fakeserver', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def getStats(self) -> dict:
+        with self.lock:
+            return dict(self.stats)
+
+    def failNext(self, count: int = 1, status: int = 500, action: str = None):
+        """ The next count requests of action (None = of any action) fail with http status status. """
+        with self.lock:
+            self.failures.extend([(action, status)] * count)
+
+    def takeFailure(self, action: str) -> Union[int, None]:
+        """ Returns the http status the request of action has to fail with because of failNext(), None if it gets answered. """
+        with self.lock:
+            for index, (failaction, status) in enumerate(self.failures):
+                if failaction is None or failaction == action:
+                    del self.failures[index]
+                    self.stats['failures'] += 1
+                    return status
+        return None
+
+    def handleAction(self, params: dict) -> dict:
+        action = params.get('action')
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['requests_' + str(action)] += 1
+        apikey = params.get('apikey')
+        if self.config.apikeys is not None and apikey not in self.config.apikeys:
+            return self._error('0001 API Key existiert nicht.')
+        if action == 'usercaptchaupload':
+            return self._upload(apikey, params)
+        elif action == 'usercaptchacorrectdata':
+            return self._correctdata(apikey, params)
+        elif action == 'usercaptchacorrectback':
+            return self._correctback(apikey, params)
+        elif action == 'usercaptchaguthaben':
+            with self.lock:
+                return self._ok({'credits': self._credits(apikey)})
+        elif action == 'fakestats':
+            return self.getStats()
+        return self._error('0015 Unbekannte Aktion.')
+
+    def _upload(self, apikey: str, params: dict) -> dict:
+        if not params.get('file-upload-01'):
+            return self._error('0016 Keine Datei gefunden.')
+        prio = min(max(int(params.get('prio', 0)), 0), PARAM_MAX_PRIO)
+        maxtimeout = min(max(int(params.get('maxtimeout', PARAM_MIN_MAXTIMEOUT)), PARAM_MIN_MAXTIMEOUT), PARAM_MAX_MAXTIMEOUT)
+        cost = PARAM_MIN_CREDITS_TO_SOLVE_ONE_CAPTCHA + prio
+        nouser = random.random() < self.config.noUserRate
+        with self.lock:
+            if self.credits[apikey] < cost:
+                return self._error('0010 Nicht genug Guthaben.')
+            solveSeconds = self.config.solveTime() / (1 + self.config.prioSpeedup * prio)
+            captcha = FakeCaptcha(next(self.captchaids), apikey, cost, maxtimeout, solveSeconds, nouser)
+            self.captchas[captcha.captchaid] = captcha
+            self.stats['uploads'] += 1
+        return self._ok({'captchaid': str(captcha.captchaid)})
+
+    def _getCaptcha(self, apikey: str, params: dict):
+        try:
+            captcha = self.captchas.get(int(params.get('id', -1)))
+        except ValueError:
+            captcha = None
+        if captcha is None or captcha.apikey != apikey:
+            return None
+        return captcha
+
+    def _correctdata(self, apikey: str, params: dict) -> dict:
+        with self.lock:
+            captcha = self._getCaptcha(apikey, params)
+            if captcha is None:
+                return self._error('0013 Captcha nicht gefunden.')
+            credits = self._credits(apikey)
+            if captcha.aborted or (captcha.nouser and time.monotonic() >= captcha.readytime):
+                return self._ok({'answer': 'ERROR NO USER'})
+            if time.monotonic() < captcha.readytime:
+                return self._ok({'answer': 'NO DATA', 'nodata': 1, 'try_again': 1, 'info': 1, 'credits': credits})
+            if not captcha.charged:
+                captcha.charged = True
+                self.credits[apikey] -= captcha.cost
+                self.stats['solved'] += 1
+                credits = self._credits(apikey)
+            response = {'answer': captcha.answer, 'info': 1, 'credits': credits}
+            if captcha.feedback is not None:
+                # Real API: Answer is still returned but also this error
+                response['error'] = '0012 Bereits erledigt.'
+            return self._ok(response)
+
+    def _correctback(self, apikey: str, params: dict) -> dict:
+        with self.lock:
+            captcha = self._getCaptcha(apikey, params)
+            if captcha is None:
+                return self._error('0013 Captcha nicht gefunden.')
+            if captcha.feedback is not None:
+                return self._error('0012 Bereits erledigt.')
+            captcha.feedback = params.get('correct')
+            self.stats['feedback_' + str(captcha.feedback)] += 1
+            if captcha.feedback == '2' and captcha.charged:
+                self.credits[apikey] += captcha.cost
+            elif captcha.feedback == '3' and not captcha.charged:
+                captcha.aborted = True
+            return self._ok({})
+
+    def _credits(self, apikey: str):
+        if self.config.stringCredits:
+            return str(self.credits[apikey])
+        return self.credits[apikey]
+
+    @staticmethod
+    def _ok(response: dict) -> dict:
+        response.update({'message': 'OK', 'status': {'https': 1, 'success': True}})
+        return response
+
+    @staticmethod
+    def _error(error: str) -> dict:
+        return {'error': error, 'status': {'https': 1, 'success': False}}
+
+
+class FakeApiRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._respond(dict(parse_qsl(urlsplit(self.path).query)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        contenttype = self.headers.get('Content-Type', '')
+        if contenttype.startswith('multipart/form-data'):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(b'Content-Type: ' + contenttype.encode('latin-1') + b'\r\n\r\n' + body)
+            params = {}
+            for part in message.iter_parts():
+                value = part.get_payload(decode=True)
+                params[part.get_param('name', header='content-disposition')] = value if part.get_filename() else value.decode('utf-8', 'ignore')
+        else:
+            params = dict(parse_qsl(body.decode('utf-8', 'ignore')))
+        self._respond(params)
+
+    def _respond(self, params: dict):
+        config = self.server.config
+        latency = config.latency()
+        if latency > 0:
+            time.sleep(latency)
+        status = self.server.takeFailure(params.get('action'))
+        if status is None and random.random() < config.httpErrorRate:
+            status = 500
+        if status is not None:
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps(self.server.handleAction(params)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local stand-in for the 9kw.eu API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--solve-median', type=float, default=1, help='Median solve time in seconds (lognormal distribution)')
+    parser.add_argument('--latency', type=float, default=0, help='Extra seconds per request')
+    parser.add_argument('--no-user-rate', type=float, default=0)
+    parser.add_argument('--http-error-rate', type=float, default=0)
+    parser.add_argument('--prio-speedup', type=float, default=0, help='Solve times get divided by 1 + prio speedup * prio')
+    args = parser.parse_args()
+    fakeserver = FakeApiServer(FakeApiConfig(solveTime=lognormal(args.solve_median), latency=constant(args.latency), noUserRate=args.no_user_rate,
+                                             httpErrorRate=args.http_error_rate, prioSpeedup=args.prio_speedup), args.host, args.port)
+    print('Serving fake 9kw API on %s' % fakeserver.getApiUrl())
+    fakeserver.serve_forever()
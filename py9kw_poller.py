@@ -0,0 +1,566 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    py9kw_poller.py - One poll loop for many outstanding 9kw.eu captchas
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Union
+
+from py9kw import Py9kw, Base64Image, CACHED_CAPTCHA_ID, PHASE_FEEDBACK, PHASE_QUEUE, CancellationToken, CaptchaFeedback, CircuitOpenError, CreditLedger, \
+    CreditReservation, HTTPStatusError, Metrics, getTimeoutForDeadline, logCaptchaDone, logger, parseError, parseResult
+
+# Polls of one captcha which may fail in a row (e.g. network down) before its ticket fails with 605
+POLL_MAX_FAILURES = 5
+
+
+class UploadSettings:
+    """ Settings one captcha got uploaded with. Poll schedulers get it instead of the client (see PollScheduler) so that their history is kept per prio
+    and upload params of the captcha even if the settings of the client change for the next upload. waitSecondsPerLoop is the one of the poller. """
+
+    def __init__(self, client: Py9kw, waitSecondsPerLoop: float):
+        self.prio = client.getPrio()
+        self.extrauploaddata = dict(client.extrauploaddata or {})
+        self.waitSecondsPerLoop = waitSecondsPerLoop
+
+    def getPrio(self) -> int:
+        return self.prio
+
+    def getWaitSecondsPerLoop(self) -> float:
+        return self.waitSecondsPerLoop
+
+
+class CaptchaTicket:
+    """ Handle for one uploaded captcha. Holds all per-captcha state so that nothing leaks between captchas sharing one poller.
+    With logEvent, resolving it logs its captcha record (see py9kw.logCaptchaDone). """
+
+    def __init__(self, captchaid: int, timeout: int, ledger: CreditLedger = None, reservation: CreditReservation = None, metrics: Metrics = None,
+                 logEvent: bool = False):
+        self.captchaid = captchaid
+        self.ledger = ledger
+        self.reservation = reservation
+        self.uploadtime = time.monotonic()
+        self.deadline = self.uploadtime + timeout
+        # True if deadline is the one of the caller and earlier than its maxtimeout --> Gets aborted serverside once reached
+        self.abortondeadline = False
+        self.errorcode = -1
+        self.errormsg = None
+        self.response = {}
+        self.answer = None
+        self.polls = 0
+        self.lastpolltime = None
+        self.cachekey = None
+        self.metrics = metrics
+        self.logevent = logEvent
+        self.phases = {}
+        # Handed to the poll scheduler, see UploadSettings
+        self.settings = None
+        # Prio it got uploaded with, hedge = second upload of the same image with a faster prio (see PrioOptimizer)
+        self.prio = None
+        self.hedge = None
+        self.hedgeplan = None
+        self.unhedged = True
+        # Failure of its own captcha while its hedge may still get answered
+        self.failure = None
+        # Polls which failed in a row
+        self.pollfailures = 0
+        self.future = Future()
+
+    def getCaptchaID(self) -> int:
+        return self.captchaid
+
+    def getErrorCode(self) -> int:
+        return self.errorcode
+
+    def getResponse(self) -> dict:
+        return self.response
+
+    def getPollCount(self) -> int:
+        return self.polls
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: float = None) -> Union[str, None]:
+        """ Blocks until this captcha got solved or failed and returns the answer (None on failure -> see getErrorCode). """
+        return self.future.result(timeout)
+
+    def addCallback(self, callback: Callable[['CaptchaTicket'], None]):
+        """ Calls callback(ticket) as soon as this captcha got solved or failed (immediately if that already happened). """
+        self.future.add_done_callback(lambda future: callback(self))
+
+    def _resolve(self, answer: Union[str, None], errorcode: int = -1, errormsg: str = None):
+        self.answer = answer
+        self.errorcode = errorcode
+        self.errormsg = errormsg
+        if self.ledger is not None:
+            if answer is not None:
+                self.ledger.settle(self.reservation, self.response.get('credits', -1) != -1)
+            else:
+                self.ledger.release(self.reservation)
+        if not self.future.done():
+            credits = self.reservation.cost if answer is not None and self.reservation is not None else 0
+            if self.metrics is not None:
+                self.metrics.onCaptchaDone(self.captchaid, answer, errorcode, self.polls, credits, dict(self.phases))
+            if self.logevent:
+                logCaptchaDone(self.captchaid, answer, errorcode, errormsg, self.polls, time.monotonic() - self.uploadtime, credits, dict(self.phases))
+            self.future.set_result(answer)
+
+
+def setTicketCorrect(client: Py9kw, ticket: CaptchaTicket, iscorrect: bool) -> bool:
+    """ Sends feedback whether the answer of the given ticket is correct via client, wrong answers get evicted from its result cache. """
+    resultcache = client.getResultCache()
+    if not iscorrect and resultcache is not None and ticket.cachekey is not None:
+        resultcache.evict(ticket.cachekey)
+    return sendTicketFeedback(client, ticket, client._getCorrectFeedbackNumber(iscorrect))
+
+
+def sendTicketFeedback(client: Py9kw, ticket: CaptchaTicket, captchaFeedbackNumber) -> bool:
+    """ Sends feedback for the captcha of the given ticket via client: Queued if it has a FeedbackQueue, right away otherwise.
+    Negative feedback books the credits back (credit ledger and metrics of client). """
+    if ticket.captchaid == CACHED_CAPTCHA_ID:
+        # Answer came from result cache --> Nothing to tell the server
+        return True
+    getdata = client._getFeedbackData(captchaFeedbackNumber, ticket.captchaid)
+    if getdata is None:
+        return False
+    feedbackqueue = client.getFeedbackQueue()
+    if feedbackqueue is not None and feedbackqueue.put(getdata):
+        _onFeedbackSent(client, ticket, captchaFeedbackNumber)
+        return True
+    metrics = client.getMetrics()
+    starttime = time.perf_counter()
+    try:
+        parseError(client._apiRequest(getdata))
+        _onFeedbackSent(client, ticket, captchaFeedbackNumber)
+        return True
+    except Exception as e:
+        logger.warning('[sendCaptchaFeedback] Error in captcha_correct: %s', e)
+        return False
+    finally:
+        if metrics is not None:
+            ticket.phases[PHASE_FEEDBACK] = time.perf_counter() - starttime
+            metrics.onPhase(PHASE_FEEDBACK, ticket.phases[PHASE_FEEDBACK], ticket.captchaid)
+
+
+def _onFeedbackSent(client: Py9kw, ticket: CaptchaTicket, captchaFeedbackNumber):
+    if captchaFeedbackNumber == CaptchaFeedback.CAPTCHA_INCORRECT.value:
+        metrics = client.getMetrics()
+        if metrics is not None and ticket.reservation is not None and ticket.reservation.state == 'settled':
+            metrics.onCreditsRefunded(ticket.captchaid, ticket.reservation.cost)
+        client.getCreditLedger().refund(ticket.reservation)
+
+
+class CaptchaPoller:
+    """ Owns all outstanding captcha IDs of one Py9kw client and polls them all from one scheduling loop.
+    The client is only used for its settings (apikey, timeout, prio, wait seconds, upload params) and its transport; results end up in the tickets.
+    Tickets fail with 605 once maxPollFailures polls of their captcha failed in a row or right away on http 4xx errors. """
+
+    def __init__(self, client: Py9kw, maxParallelPolls: int = 4, maxPollFailures: int = POLL_MAX_FAILURES):
+        self.client = client
+        self.maxPollFailures = maxPollFailures
+        self.schedule = []
+        self.sequence = itertools.count()
+        self.outstanding = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=maxParallelPolls, thread_name_prefix='py9kw-poll')
+        # Resolution of tickets with hedges, see PrioOptimizer
+        self.hedgelock = threading.RLock()
+        self.hedgeuploadlock = threading.Lock()
+        self.hedgeclient = None
+        self.thread = threading.Thread(target=self._run, name='py9kw-poller', daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def upload(self, imagedata, store_image_path=None, client: Py9kw = None, deadline: float = None, token: CancellationToken = None,
+               phases: dict = None) -> CaptchaTicket:
+        """ Uploads one captcha (same image types as Py9kw.uploadcaptcha) with the current client settings and returns its ticket.
+        Failed uploads return an already resolved ticket with captchaid -1. client = client whose settings get used for this upload instead of the one
+        of this poller, e.g. one per thread to upload from many threads at once (it should share the credit ledger of the poller client).
+        deadline = time.monotonic() value after which the answer is of no use anymore (maxtimeout gets derived from it), token = CancellationToken.
+        Once either of them gave up on the captcha, polling stops and it gets aborted (errorcode 601 or 604, see abortCaptcha).
+        phases = timings of steps done for this captcha before, e.g. the image download, they end up in the ticket. """
+        if client is None:
+            client = self.client
+        if token is not None and token.isCancelled():
+            return self._failedTicket(*client._getAbortError('cancelled'))
+        if deadline is not None and time.monotonic() >= deadline:
+            return self._failedTicket(*client._getAbortError('deadline'))
+        priooptimizer = client.getPrioOptimizer()
+        if priooptimizer is not None:
+            client.setPriority(priooptimizer.choosePrio())
+        maxtimeout = client.maxtimeout
+        if deadline is not None:
+            client.setTimeout(getTimeoutForDeadline(deadline))
+        try:
+            ticket = self._upload(imagedata, store_image_path, client, priooptimizer is not None and priooptimizer.hedgeQuantile is not None, deadline,
+                                  phases)
+        finally:
+            client.maxtimeout = maxtimeout
+        if token is not None and not ticket.done():
+            def cancel():
+                self._submit(self.abortCaptcha, ticket, 'cancelled')
+            token.addCallback(cancel)
+            ticket.addCallback(lambda ticket: token.removeCallback(cancel))
+        return ticket
+
+    def _upload(self, imagedata, store_image_path, client: Py9kw, hedging: bool, deadline: float = None, phases: dict = None) -> CaptchaTicket:
+        logger_prefix = '[CaptchaPoller.upload] '
+        hedgedata = None
+        # Timings of download, compaction, encoding and upload of this captcha, the client only lends its settings
+        phases = dict(phases) if phases is not None else {}
+        ledger = client.getCreditLedger()
+        if ledger.needsRefresh():
+            client.getcredits()
+        reservation = ledger.reserve(client.getCaptchaCost(), client.getTimeout())
+        if reservation is None:
+            logger.info(logger_prefix + 'Not enough credits to solve a captcha')
+            return self._failedTicket(-1, None)
+        try:
+            with client._openImage(imagedata) as imagedata:
+                if client._isImageURL(imagedata):
+                    imagedata = client._fetchImage(imagedata, store_image_path, phases)
+                    if imagedata is None:
+                        logger.info(logger_prefix + 'Error during picture download')
+                        ledger.release(reservation)
+                        return self._failedTicket(603, 'CAPTCHA_DOWNLOAD_FAILURE', phases)
+                cachekey = None
+                resultcache = client.getResultCache()
+                if resultcache is not None:
+                    cachekey = client._getResultCacheKey(imagedata)
+                    answer = resultcache.get(cachekey, reservation.cost)
+                    if answer is not None:
+                        ledger.release(reservation)
+                        ticket = CaptchaTicket(CACHED_CAPTCHA_ID, 0, metrics=client.getMetrics(), logEvent=True)
+                        ticket.cachekey = cachekey
+                        ticket.phases.update(phases)
+                        ticket._resolve(answer)
+                        return ticket
+                if hedging:
+                    hedgedata = self._getHedgeData(imagedata)
+                response = client._sendUpload(imagedata, phases)
+        except BaseException:
+            ledger.release(reservation)
+            raise
+        errorcode, errormsg = parseError(response)
+        captchaid = int(response.get('captchaid', -1))
+        if errorcode > -1 or captchaid == -1:
+            logger.warning(logger_prefix + 'Error happened and/or did not get captchaid')
+            ledger.release(reservation)
+            return self._failedTicket(errorcode, errormsg, phases, response)
+        reservation.captchaid = captchaid
+        ticket = self.track(captchaid, reservation, client.getTimeout(), deadline, UploadSettings(client, self.client.getWaitSecondsPerLoop()))
+        ticket.phases.update(phases)
+        ticket.cachekey = cachekey
+        ticket.prio = client.getPrio()
+        if hedgedata is not None:
+            hedgeplan = client.getPrioOptimizer().getHedgePlan(ticket.prio)
+            if hedgeplan is not None:
+                ticket.hedgeplan = (ticket.uploadtime + hedgeplan[0], hedgeplan[1], hedgedata, client)
+                ticket.unhedged = False
+        return ticket
+
+    def track(self, captchaid: int, reservation: CreditReservation = None, timeout: int = None, deadline: float = None,
+              settings: UploadSettings = None) -> CaptchaTicket:
+        """ Starts polling an already uploaded captcha and returns its ticket. timeout = its maxtimeout, default = the one of the client.
+        deadline = time.monotonic() value after which the answer is of no use anymore --> Gets aborted then if it is still unsolved.
+        settings = the ones it got uploaded with, default = the current ones of the client. """
+        if timeout is None:
+            timeout = self.client.getTimeout()
+        ticket = CaptchaTicket(captchaid, timeout, self.client.getCreditLedger(), reservation, self.client.getMetrics(), True)
+        ticket.settings = settings if settings is not None else UploadSettings(self.client, self.client.getWaitSecondsPerLoop())
+        if deadline is not None and deadline < ticket.deadline:
+            ticket.deadline = deadline
+            ticket.abortondeadline = True
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('CaptchaPoller is closed')
+            self.outstanding += 1
+            firstpoll = ticket.uploadtime + self.client.getPollScheduler().getNextWaitSeconds(ticket.settings, 0, 0)
+            self._schedule(ticket, min(firstpoll, ticket.deadline) if ticket.abortondeadline else firstpoll)
+        return ticket
+
+    def getOutstandingCount(self) -> int:
+        return self.outstanding
+
+    def setCaptchaCorrect(self, ticket: CaptchaTicket, iscorrect: bool) -> bool:
+        """Send feedback, is the Captcha result correct or not?"""
+        return setTicketCorrect(self.client, ticket, iscorrect)
+
+    def abortCaptcha(self, ticket: CaptchaTicket, reason: str = None) -> bool:
+        """Aborts the given captcha and stops polling it. If no answer is available yet, no credits will be used in this case!
+        reason = 'deadline' or 'cancelled' if the caller gave up on it: Only unresolved tickets get aborted then, they get errorcode 601 or 604 and the
+        credits saved get counted (see Metrics.onCaptchaAborted)."""
+        if reason is None:
+            if not ticket.done():
+                ticket._resolve(None, 601, 'ERROR_INTERNAL_TIMEOUT')
+            return self.sendCaptchaFeedback(ticket, CaptchaFeedback.CAPTCHA_ABORT_CURRENT_CAPTCHA.value)
+        with self.hedgelock:
+            if ticket.done():
+                return False
+            credits = ticket.reservation.cost if ticket.reservation is not None and ticket.reservation.state == 'reserved' else 0
+            ticket._resolve(None, *self.client._getAbortError(reason))
+        logger.info('[CaptchaPoller] Captchaid %d is not needed anymore (%s) --> Aborting it', ticket.captchaid, reason)
+        aborted = self.sendCaptchaFeedback(ticket, CaptchaFeedback.CAPTCHA_ABORT_CURRENT_CAPTCHA.value)
+        if ticket.metrics is not None:
+            ticket.metrics.onCaptchaAborted(ticket.captchaid, reason, credits if aborted else 0)
+        return aborted
+
+    def sendCaptchaFeedback(self, ticket: CaptchaTicket, captchaFeedbackNumber) -> bool:
+        return sendTicketFeedback(self.client, ticket, captchaFeedbackNumber)
+
+    def close(self, abortOutstanding: bool = False):
+        """ Stops the poll loop. Outstanding tickets get resolved with ERROR_INTERNAL_TIMEOUT and optionally aborted serverside. """
+        with self.condition:
+            self.closed = True
+            pending = [entry[2] for entry in self.schedule]
+            self.schedule = []
+            self.condition.notify_all()
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        for ticket in pending:
+            if abortOutstanding:
+                self.abortCaptcha(ticket)
+            else:
+                ticket._resolve(None, 601, 'ERROR_INTERNAL_TIMEOUT')
+            self._finished(ticket)
+
+    def _failedTicket(self, errorcode: int, errormsg: Union[str, None], phases: dict = None, response: dict = None) -> CaptchaTicket:
+        ticket = CaptchaTicket(-1, 0, metrics=self.client.getMetrics(), logEvent=True)
+        if phases is not None:
+            ticket.phases.update(phases)
+        if response is not None:
+            ticket.response = response
+        ticket._resolve(None, errorcode, errormsg)
+        return ticket
+
+    def _schedule(self, ticket: CaptchaTicket, when: float):
+        heapq.heappush(self.schedule, (when, next(self.sequence), ticket))
+        self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (len(self.schedule) == 0 or self.schedule[0][0] > time.monotonic()):
+                    self.condition.wait(None if len(self.schedule) == 0 else self.schedule[0][0] - time.monotonic())
+                if self.closed:
+                    return
+                ticket = heapq.heappop(self.schedule)[2]
+            if ticket.done():
+                # e.g. aborted while waiting for its next poll
+                self._finished(ticket)
+                continue
+            self.executor.submit(self._poll, ticket)
+
+    def _poll(self, ticket: CaptchaTicket):
+        logger_prefix = '[CaptchaPoller] '
+        try:
+            response = self.client._apiRequest(self.client._getResultData(ticket.captchaid))
+        except CircuitOpenError:
+            # Shed --> Same as no answer yet
+            response = {'nodata': 1, 'try_again': 1}
+        except Exception as e:
+            ticket.pollfailures += 1
+            if ticket.pollfailures < self.maxPollFailures and not (isinstance(e, HTTPStatusError) and 400 <= e.status < 500):
+                logger.warning(logger_prefix + 'Poll of captchaid %d failed (%d in a row): %s', ticket.captchaid, ticket.pollfailures, e)
+                response = {'nodata': 1, 'try_again': 1}
+            else:
+                logger.warning(logger_prefix + 'Poll of captchaid %d failed (%d in a row) --> Giving up: %s', ticket.captchaid, ticket.pollfailures, e)
+                self._resolveTicket(ticket, None, 605, 'CAPTCHA_POLL_FAILURE')
+                self._finished(ticket)
+                return
+        else:
+            ticket.pollfailures = 0
+        if ticket.done():
+            # Its hedge won while this poll was running
+            self._finished(ticket)
+            return
+        ticket.response = response
+        answer, errorcode, errormsg = parseResult(response)
+        self.client._updateCredits(response.get('credits', -1))
+        now = time.monotonic()
+        ticket.polls += 1
+        pollscheduler = self.client.getPollScheduler()
+        priooptimizer = self.client.getPrioOptimizer()
+        if answer is not None:
+            # Answer came in somewhere between the previous and this poll
+            lastpolltime = ticket.lastpolltime if ticket.lastpolltime is not None else ticket.uploadtime
+            pollscheduler.onResult(ticket.settings, (lastpolltime + now) / 2 - ticket.uploadtime, ticket.polls)
+            if priooptimizer is not None and ticket.prio is not None:
+                priooptimizer.onResult(ticket.prio, (lastpolltime + now) / 2 - ticket.uploadtime, ticket.unhedged)
+            if ticket.metrics is not None:
+                ticket.phases[PHASE_QUEUE] = now - ticket.uploadtime
+                ticket.metrics.onPhase(PHASE_QUEUE, now - ticket.uploadtime, ticket.captchaid)
+            resultcache = self.client.getResultCache()
+            if resultcache is not None and ticket.cachekey is not None:
+                resultcache.put(ticket.cachekey, answer, now - ticket.uploadtime)
+        ticket.lastpolltime = now
+        if answer is not None:
+            logger.info(logger_prefix + '[SUCCESS] Captcha solved! captchaid %d --> Answer: \'%s\'', ticket.captchaid, answer)
+            self._resolveTicket(ticket, answer, errorcode, errormsg)
+        elif errorcode > -1 and errorcode != 602:
+            if errorcode == 600 and priooptimizer is not None and ticket.prio is not None:
+                priooptimizer.onNoAnswer(ticket.prio, ticket.unhedged)
+            self._resolveTicket(ticket, None, errorcode, errormsg)
+        elif ticket.abortondeadline and now >= ticket.deadline:
+            # The caller gave up on it while the server would still hand it out to users
+            self.abortCaptcha(ticket, 'deadline')
+        elif response.get('try_again', False) == 0 or time.monotonic() >= ticket.deadline:
+            if priooptimizer is not None and ticket.prio is not None:
+                priooptimizer.onNoAnswer(ticket.prio, ticket.unhedged)
+            self._resolveTicket(ticket, None, 601, 'ERROR_INTERNAL_TIMEOUT')
+        else:
+            ticket.errorcode, ticket.errormsg = errorcode, errormsg
+            nextpoll = min(now + pollscheduler.getNextWaitSeconds(ticket.settings, ticket.polls, now - ticket.uploadtime), ticket.deadline)
+            hedgeplan = ticket.hedgeplan
+            if hedgeplan is not None:
+                if now >= hedgeplan[0]:
+                    ticket.hedgeplan = None
+                    self._submit(self._hedge, ticket, hedgeplan)
+                else:
+                    nextpoll = min(nextpoll, hedgeplan[0])
+            with self.condition:
+                if not self.closed:
+                    self._schedule(ticket, nextpoll)
+                    return
+            ticket._resolve(None, 601, 'ERROR_INTERNAL_TIMEOUT')
+        self._finished(ticket)
+
+    def _resolveTicket(self, ticket: CaptchaTicket, answer: Union[str, None], errorcode: int = -1, errormsg: str = None):
+        """ Resolves the ticket unless its hedge already did. Failures wait for the hedge if that may still get answered. """
+        with self.hedgelock:
+            if ticket.done():
+                return
+            if answer is None and ticket.hedge is not None and not ticket.hedge.done():
+                ticket.failure = (errorcode, errormsg)
+                if ticket.ledger is not None:
+                    ticket.ledger.release(ticket.reservation)
+                return
+            ticket._resolve(answer, errorcode, errormsg)
+
+    @staticmethod
+    def _getHedgeData(imagedata):
+        """ Returns the image in a form which can be uploaded again later or None for file objects. """
+        if isinstance(imagedata, (bytes, Base64Image)):
+            return imagedata
+        if isinstance(imagedata, (bytearray, memoryview)):
+            return bytes(imagedata)
+        return None
+
+    def _getHedgeClient(self, uploadclient: Py9kw) -> Py9kw:
+        """ Client for hedge uploads with the settings of uploadclient, only used while holding hedgeuploadlock. """
+        if self.hedgeclient is None:
+            self.hedgeclient = Py9kw(self.client.apikey, proxy=self.client.proxy, transport=self.client.transport)
+        client = self.hedgeclient
+        client.setApiUrl(uploadclient.apiurl)
+        client.setCreditLedger(uploadclient.getCreditLedger())
+        client.setRateGovernor(uploadclient.getRateGovernor())
+        client.setCircuitBreaker(uploadclient.getCircuitBreaker())
+        client.setMetrics(uploadclient.getMetrics())
+        client.setResultCache(uploadclient.getResultCache())
+        client.setImageCompactor(uploadclient.getImageCompactor())
+        client.setUploadMode(uploadclient.getUploadMode())
+        client.setAdditionalCaptchaUploadParams(uploadclient.extrauploaddata)
+        client.setTimeout(uploadclient.getTimeout())
+        return client
+
+    def _hedge(self, ticket: CaptchaTicket, hedgeplan: tuple):
+        """ Uploads the image of the still unsolved ticket again with a faster prio. """
+        logger_prefix = '[CaptchaPoller] '
+        hedgetime, prio, imagedata, uploadclient = hedgeplan
+        if ticket.done():
+            return
+        with self.hedgeuploadlock:
+            client = self._getHedgeClient(uploadclient)
+            client.setPriority(prio)
+            try:
+                hedge = self._upload(imagedata, None, client, False)
+            except Exception as e:
+                logger.warning(logger_prefix + 'Hedge upload for captchaid %d failed: %s', ticket.captchaid, e)
+                return
+        if hedge.captchaid == -1:
+            return
+        # Reported via its primary ticket
+        hedge.logevent = False
+        hedge.metrics = None
+        logger.info(logger_prefix + 'Captchaid %d still unsolved after %.1f seconds --> Hedging with captchaid %d (prio %d)', ticket.captchaid,
+                    time.monotonic() - ticket.uploadtime, hedge.captchaid, prio)
+        with self.hedgelock:
+            ticket.hedge = hedge
+        hedge.addCallback(lambda hedge: self._onHedgeDone(ticket, hedge))
+        ticket.addCallback(lambda ticket: self._onPrimaryDone(ticket, hedge))
+
+    def _onPrimaryDone(self, ticket: CaptchaTicket, hedge: CaptchaTicket):
+        if not hedge.done():
+            # Got answered first --> The hedge is not needed anymore
+            self._submit(self.abortCaptcha, hedge)
+
+    def _onHedgeDone(self, ticket: CaptchaTicket, hedge: CaptchaTicket):
+        elapsedSeconds = time.monotonic() - ticket.uploadtime
+        prio = ticket.prio
+        won = False
+        with self.hedgelock:
+            if ticket.done():
+                # Both got charged if the hedge got answered anyways
+                extraCredits = hedge.reservation.cost if hedge.answer is not None and hedge.reservation is not None else 0
+            elif hedge.answer is None:
+                extraCredits = 0
+                if ticket.failure is not None:
+                    ticket._resolve(None, *ticket.failure)
+            else:
+                won = True
+                extraCredits = hedge.reservation.cost - ticket.reservation.cost if hedge.reservation is not None and ticket.reservation is not None else 0
+                priooptimizer = self.client.getPrioOptimizer()
+                if priooptimizer is not None and prio is not None and ticket.failure is None:
+                    # Its own captcha only got aborted because the hedge won: It would have taken longer than elapsedSeconds, but not forever
+                    priooptimizer.onCensoredResult(prio, elapsedSeconds)
+                if ticket.failure is None:
+                    # Abort its own captcha so that it costs nothing
+                    if ticket.ledger is not None:
+                        ticket.ledger.release(ticket.reservation)
+                    self._submit(self.sendCaptchaFeedback, CaptchaTicket(ticket.captchaid, 0), CaptchaFeedback.CAPTCHA_ABORT_CURRENT_CAPTCHA.value)
+                logger.info('[CaptchaPoller] Hedge captchaid %d won against captchaid %d', hedge.captchaid, ticket.captchaid)
+                # From now on the ticket stands for the hedge e.g. for feedback
+                ticket.captchaid = hedge.captchaid
+                ticket.reservation = hedge.reservation
+                ticket.response = hedge.response
+                ticket.prio = hedge.prio
+                ticket.polls += hedge.polls
+                ticket._resolve(hedge.answer, hedge.errorcode, hedge.errormsg)
+        priooptimizer = self.client.getPrioOptimizer()
+        if priooptimizer is not None and prio is not None:
+            priooptimizer.onHedgeDone(prio, elapsedSeconds, won, extraCredits)
+
+    def _submit(self, function: Callable, *args):
+        """ Runs function in the poll threads, right here if they are shut down already. """
+        try:
+            self.executor.submit(function, *args)
+        except RuntimeError:
+            function(*args)
+
+    def _finished(self, ticket: CaptchaTicket):
+        with self.condition:
+            self.outstanding -= 1
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    py9kw_pool.py - Bounded thread pool solving many 9kw.eu captchas concurrently with credit-aware admission
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from typing import Callable, Iterable, Iterator
+
+from py9kw import Py9kw, CaptchaFeedback, HTTPConnectionPool, getProxy, logger
+from py9kw_poller import CaptchaTicket, sendTicketFeedback, setTicketCorrect
+
+
+class CaptchaSolverPool:
+    """ Solves captchas with <workers> threads. Every worker owns one Py9kw client (they are not thread-safe) but all of them share one connection pool
+    and the credit ledger of the API key. submit() blocks while maxQueued captchas are waiting for a worker and only admits captchas which the available
+    credits (minus the cost of already admitted ones) can pay for. configure(client) gets called once per worker client to apply settings like prio,
+    timeout, poll scheduler, result cache or metrics. The prio of every captcha (the configured one or the pick of its PrioOptimizer) gets chosen on
+    admission, its worker uploads it with exactly that prio. """
+
+    def __init__(self, apikey: str, workers: int = 4, maxQueued: int = None, configure: Callable[[Py9kw], None] = None, env_proxy: bool = False,
+                 proxy: str = None):
+        self.workers = workers
+        self.maxQueued = maxQueued if maxQueued is not None else 2 * workers
+        self.configure = configure
+        self.queue = queue.Queue(self.maxQueued)
+        self.lock = threading.Lock()
+        self.admittedcost = 0
+        self.closed = False
+        proxy = getProxy(proxy, env_proxy)
+        # Used for admission, credits and feedback from the calling threads --> Only its stateless helpers get used
+        self.client = self._createClient(Py9kw(apikey, proxy=proxy, transport=HTTPConnectionPool(maxsize=workers + 1, proxy=proxy)))
+        self.threads = []
+        for number in range(workers):
+            thread = threading.Thread(target=self._run, name='py9kw-pool-%d' % number, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def getClient(self) -> Py9kw:
+        """ Client with the settings of all workers e.g. to read getCaptchaCost() or getCreditLedger(). """
+        return self.client
+
+    def submit(self, imagedata, store_image_path=None, timeout: float = None) -> CaptchaTicket:
+        """ Queues one image (or image URL) and returns its ticket. Blocks while the queue is full and raises queue.Full if that takes longer than timeout.
+        If the available credits cannot pay for one more captcha, an already resolved ticket with captchaid -1 gets returned. """
+        logger_prefix = '[CaptchaSolverPool.submit] '
+        if self.closed:
+            raise RuntimeError('CaptchaSolverPool is closed')
+        prio = self._choosePrio()
+        cost = self.client.getCaptchaCost(prio)
+        ledger = self.client.getCreditLedger()
+        if ledger.needsRefresh():
+            self.client.getcredits()
+        with self.lock:
+            if ledger.getAvailable() - self.admittedcost < cost:
+                logger.info(logger_prefix + 'Not enough credits to solve a captcha')
+                ticket = CaptchaTicket(-1, 0)
+                ticket._resolve(None)
+                return ticket
+            self.admittedcost += cost
+        ticket = CaptchaTicket(-1, self.client.getTimeout())
+        try:
+            self.queue.put((ticket, prio, cost, imagedata, store_image_path), timeout=timeout)
+        except queue.Full:
+            self._unadmit(cost)
+            raise
+        return ticket
+
+    def solveAll(self, images: Iterable, store_image_path=None) -> Iterator[CaptchaTicket]:
+        """ Submits images from the given iterable while there is room in the pool and yields their tickets in the order in which they got done. """
+        pending = {}
+        images = iter(images)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < self.workers + self.maxQueued:
+                try:
+                    imagedata = next(images)
+                except StopIteration:
+                    exhausted = True
+                    break
+                ticket = self.submit(imagedata, store_image_path)
+                pending[ticket.future] = ticket
+            if len(pending) == 0:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future)
+
+    @staticmethod
+    def asCompleted(tickets: Iterable[CaptchaTicket], timeout: float = None) -> Iterator[CaptchaTicket]:
+        """ Yields the given tickets as they get done. """
+        tickets = {ticket.future: ticket for ticket in tickets}
+        for future in as_completed(tickets, timeout):
+            yield tickets[future]
+
+    def setCaptchaCorrect(self, ticket: CaptchaTicket, iscorrect: bool) -> bool:
+        """Send feedback, is the Captcha result correct or not?"""
+        return setTicketCorrect(self.client, ticket, iscorrect)
+
+    def abortCaptcha(self, ticket: CaptchaTicket) -> bool:
+        """Aborts the given captcha. Queued captchas will never get uploaded, uploaded ones get aborted serverside so no credits will be used if no answer
+        is available yet (counted as credits saved, see Metrics.onCaptchaAborted)."""
+        if ticket.captchaid == -1 and not ticket.done():
+            ticket._resolve(None, 601, 'ERROR_INTERNAL_TIMEOUT')
+            return True
+        inflight = not ticket.done()
+        credits = ticket.reservation.cost if inflight and ticket.reservation is not None and ticket.reservation.state == 'reserved' else 0
+        aborted = self.sendCaptchaFeedback(ticket, CaptchaFeedback.CAPTCHA_ABORT_CURRENT_CAPTCHA.value)
+        metrics = self.client.getMetrics()
+        if inflight and metrics is not None:
+            metrics.onCaptchaAborted(ticket.captchaid, 'cancelled', credits if aborted else 0)
+        return aborted
+
+    def sendCaptchaFeedback(self, ticket: CaptchaTicket, captchaFeedbackNumber) -> bool:
+        """ Via the FeedbackQueue of the clients if they have one (see CaptchaPoller.sendCaptchaFeedback). """
+        return sendTicketFeedback(self.client, ticket, captchaFeedbackNumber)
+
+    def close(self, cancelPending: bool = False):
+        """ Waits until all queued captchas are done and stops the workers. With cancelPending, queued captchas which have not been uploaded yet get
+        resolved with ERROR_INTERNAL_TIMEOUT instead. """
+        self.closed = True
+        if cancelPending:
+            while True:
+                try:
+                    ticket, prio, cost, imagedata, store_image_path = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._unadmit(cost)
+                ticket._resolve(None, 601, 'ERROR_INTERNAL_TIMEOUT')
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.client.close()
+
+    def _createClient(self, client: Py9kw) -> Py9kw:
+        if self.configure is not None:
+            self.configure(client)
+        return client
+
+    def _choosePrio(self) -> int:
+        priooptimizer = self.client.getPrioOptimizer()
+        if priooptimizer is not None:
+            return priooptimizer.choosePrio()
+        return self.client.getPrio()
+
+    def _unadmit(self, cost: int):
+        with self.lock:
+            self.admittedcost -= cost
+
+    def _run(self):
+        client = self._createClient(Py9kw(self.client.apikey, proxy=self.client.proxy, transport=self.client.transport))
+        # Admission and request limits only work if all workers share them
+        client.setCreditLedger(self.client.getCreditLedger())
+        client.setRateGovernor(self.client.getRateGovernor())
+        client.setCircuitBreaker(self.client.getCircuitBreaker())
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            ticket, prio, cost, imagedata, store_image_path = item
+            # Its credits get reserved by the upload from now on
+            self._unadmit(cost)
+            if ticket.done():
+                # Aborted while queued
+                continue
+            try:
+                self._solve(client, ticket, prio, imagedata, store_image_path)
+            except Exception as e:
+                logger.warning('[CaptchaSolverPool] Failed to solve captcha: %s', e)
+                client.resetSolver()
+                ticket.errorcode = -1
+                ticket.errormsg = str(e)
+                if not ticket.future.done():
+                    ticket.future.set_exception(e)
+
+    @staticmethod
+    def _solve(client: Py9kw, ticket: CaptchaTicket, prio: int, imagedata, store_image_path):
+        client.resetSolver()
+        client.setErrorCode(-1)
+        client.errormsg = None
+        answer = None
+        # Got picked on admission already --> Must not pick another one for the upload
+        priooptimizer = client.getPrioOptimizer()
+        client.setPrioOptimizer(None)
+        try:
+            uploaded = client.uploadcaptcha(imagedata, store_image_path, prio=prio) != -1
+        finally:
+            client.setPrioOptimizer(priooptimizer)
+        if uploaded:
+            if ticket.done():
+                # Aborted during upload
+                client.abortCaptcha()
+                return
+            # Available for feedback and aborts from now on
+            ticket.captchaid = client.getCaptchaID()
+            ticket.reservation = client.reservation
+            ticket.cachekey = client.cachekey
+            answer = client.sleepAndGetResult()
+        ticket.response = client.getResponse()
+        ticket.polls = client.getPollCount()
+        ticket.phases = dict(client.phases)
+        ticket._resolve(answer, client.getErrorCode(), client.errormsg)
@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    py9kw_router.py - Spreads 9kw.eu captchas across several API keys with pluggable routing strategies
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import random
+import threading
+import time
+import weakref
+from typing import Callable, Iterable, List, Union
+
+from py9kw import Py9kw, PHASE_DOWNLOAD, CancellationToken, CircuitBreaker, CircuitOpenError, HTTPConnectionPool, ImageFetcher, getProxy, logger
+from py9kw_poller import CaptchaPoller, CaptchaTicket
+
+# Weight of the latest solve time in the moving average of an account
+LATENCY_SMOOTHING = 0.2
+
+
+class RouterAccount:
+    """ One API key of an AccountRouter: Its client (credit ledger, circuit breaker and settings like prio of this key), its poller and what the router
+    has observed: Captchas in flight and recent solve latency. """
+
+    def __init__(self, client: Py9kw, maxParallelPolls: int):
+        self.client = client
+        self.poller = CaptchaPoller(client, maxParallelPolls)
+        self.enabled = True
+        self.outstanding = 0
+        # Moving average of the seconds from upload until answer, None until the first answer
+        self.latency = None
+        self.uploads = 0
+        self.solved = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+        # Py9kw clients are not thread-safe, images get downloaded before taking it
+        self.uploadlock = threading.Lock()
+
+    def getApiKey(self) -> str:
+        return self.client.apikey
+
+    def getName(self) -> str:
+        """ Shortened API key for log messages. """
+        return self.client.apikey[:4] + '...'
+
+    def getClient(self) -> Py9kw:
+        return self.client
+
+    def getPoller(self) -> CaptchaPoller:
+        return self.poller
+
+    def getOutstandingCount(self) -> int:
+        return self.outstanding
+
+    def getLatency(self) -> Union[float, None]:
+        return self.latency
+
+    def getAvailableCredits(self) -> int:
+        return self.client.getCreditLedger().getAvailable()
+
+    def setEnabled(self, enabled: bool):
+        """ Takes this account out of rotation (False) or puts it back. """
+        self.enabled = enabled
+
+    def isAvailable(self) -> bool:
+        """ True if this account is in rotation: Enabled, its circuit breaker is not shedding requests and it can pay for one more captcha. """
+        if not self.enabled:
+            return False
+        breaker = self.client.getCircuitBreaker()
+        if breaker is not None and breaker.getStats()['retryAfter'] > 0:
+            return False
+        return self.getAvailableCredits() >= self.client.getCaptchaCost()
+
+    def getStats(self) -> dict:
+        breaker = self.client.getCircuitBreaker()
+        return {'apikey': self.getApiKey(), 'enabled': self.enabled, 'available': self.isAvailable(), 'credits': self.getAvailableCredits(),
+                'outstanding': self.outstanding, 'latency': self.latency, 'uploads': self.uploads, 'solved': self.solved, 'failed': self.failed,
+                'breaker': breaker.getState() if breaker is not None else None}
+
+    def _onUpload(self, ticket: CaptchaTicket):
+        with self.lock:
+            self.uploads += 1
+            if ticket.captchaid > 0:
+                self.outstanding += 1
+                ticket.addCallback(self._onDone)
+
+    def _onDone(self, ticket: CaptchaTicket):
+        with self.lock:
+            self.outstanding -= 1
+            if ticket.answer is None:
+                self.failed += 1
+                return
+            self.solved += 1
+            seconds = time.monotonic() - ticket.uploadtime
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
+
+
+class RoutingStrategy:
+    """ Decides which account gets the next captcha. Subclass and override choose for own strategies. """
+
+    def choose(self, accounts: List[RouterAccount]) -> RouterAccount:
+        """ Returns one of the given accounts: All of them are in rotation and can pay for one more captcha, never empty. """
+        raise NotImplementedError
+
+
+class CreditWeightedStrategy(RoutingStrategy):
+    """ Random account, weighted by available credits --> Balances drain at about the same rate. This is the default. """
+
+    def choose(self, accounts: List[RouterAccount]) -> RouterAccount:
+        return random.choices(accounts, [account.getAvailableCredits() for account in accounts])[0]
+
+
+class LeastOutstandingStrategy(RoutingStrategy):
+    """ Account with the fewest captchas in flight, the one with more credits on ties. """
+
+    def choose(self, accounts: List[RouterAccount]) -> RouterAccount:
+        return min(accounts, key=lambda account: (account.getOutstandingCount(), -account.getAvailableCredits()))
+
+
+class LowestLatencyStrategy(RoutingStrategy):
+    """ Account with the lowest recent solve latency (moving average from upload until answer). Accounts without answers yet get captchas first and
+    explorationRate of all captchas go to a random account so that latencies of the others stay up to date. """
+
+    def __init__(self, explorationRate: float = 0.05):
+        self.explorationRate = explorationRate
+
+    def choose(self, accounts: List[RouterAccount]) -> RouterAccount:
+        unmeasured = [account for account in accounts if account.getLatency() is None]
+        if len(unmeasured) > 0:
+            return min(unmeasured, key=lambda account: account.getOutstandingCount())
+        if random.random() < self.explorationRate:
+            return random.choice(accounts)
+        return min(accounts, key=lambda account: account.getLatency())
+
+
+class AccountRouter:
+    """ Spreads uploads across several API keys, each with its own client, credit ledger, circuit breaker and poller. strategy picks the account of
+    every upload among the ones in rotation: Accounts drop out while they can not pay for one more captcha or while their circuit breaker sheds
+    requests (default: CircuitBreaker.forApiKey) and come back on their own. Uploads which fail for account reasons are retried with the next account.
+    configure(client) gets called for the client of every account e.g. to set prio per API key (see client.apikey).
+    Feedback and aborts go to the account which owns the captcha. """
+
+    def __init__(self, apikeys: Iterable[str], strategy: RoutingStrategy = None, configure: Callable[[Py9kw], None] = None, maxParallelPolls: int = 4,
+                 env_proxy: bool = False, proxy: str = None):
+        apikeys = list(apikeys)
+        if len(apikeys) == 0:
+            raise ValueError('At least one API key is required')
+        self.strategy = strategy if strategy is not None else CreditWeightedStrategy()
+        proxy = getProxy(proxy, env_proxy)
+        transport = HTTPConnectionPool(maxsize=len(apikeys) * (maxParallelPolls + 1), proxy=proxy)
+        self.accounts = []
+        for apikey in apikeys:
+            client = Py9kw(apikey, proxy=proxy, transport=transport)
+            if configure is not None:
+                configure(client)
+            if client.getCircuitBreaker() is None:
+                client.setCircuitBreaker(CircuitBreaker.forApiKey(apikey))
+            self.accounts.append(RouterAccount(client, maxParallelPolls))
+        self.transport = transport
+        # Image URLs get downloaded once, before an account is chosen
+        self.imagefetcher = ImageFetcher(transport)
+        # Ticket -> account which owns the captcha
+        self.owners = weakref.WeakKeyDictionary()
+        self.ownersLock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def getAccounts(self) -> List[RouterAccount]:
+        return list(self.accounts)
+
+    def getAccount(self, apikey: str) -> Union[RouterAccount, None]:
+        for account in self.accounts:
+            if account.getApiKey() == apikey:
+                return account
+        return None
+
+    def getAccountForTicket(self, ticket: CaptchaTicket) -> Union[RouterAccount, None]:
+        with self.ownersLock:
+            return self.owners.get(ticket)
+
+    def getStats(self) -> List[dict]:
+        return [account.getStats() for account in self.accounts]
+
+    def setStrategy(self, strategy: RoutingStrategy):
+        self.strategy = strategy
+
+    def getStrategy(self) -> RoutingStrategy:
+        return self.strategy
+
+    def upload(self, imagedata, store_image_path=None, deadline: float = None, token: CancellationToken = None) -> CaptchaTicket:
+        """ Uploads one captcha (same image types as Py9kw.uploadcaptcha) via the account chosen by the strategy and returns its ticket.
+        If no account is in rotation, the ticket is already resolved with captchaid -1. deadline and token: See CaptchaPoller.upload. """
+        logger_prefix = '[AccountRouter.upload] '
+        phases = {}
+        if Py9kw._isImageURL(imagedata):
+            # Outside of the upload lock: One slow image URL must not hold up the other uploads of an account
+            starttime = time.perf_counter()
+            try:
+                imagedata = self.imagefetcher.fetch(imagedata, store_image_path)
+            except IOError as e:
+                logger.warning(logger_prefix + 'Error during picture download: %s', e)
+                imagedata = None
+            phases[PHASE_DOWNLOAD] = time.perf_counter() - starttime
+            if imagedata is None:
+                ticket = CaptchaTicket(-1, 0, logEvent=True)
+                ticket.phases.update(phases)
+                ticket._resolve(None, 603, 'CAPTCHA_DOWNLOAD_FAILURE')
+                return ticket
+        tried = []
+        # File objects get rewound if the upload has to be retried with the next account
+        startposition = imagedata.tell() if hasattr(imagedata, 'seekable') and imagedata.seekable() else None
+        retryable = not hasattr(imagedata, 'read') or startposition is not None
+        ticket = None
+        while True:
+            account = self._choose(tried)
+            if account is None:
+                break
+            tried.append(account)
+            if startposition is not None:
+                imagedata.seek(startposition)
+            try:
+                with account.uploadlock:
+                    ticket = account.poller.upload(imagedata, store_image_path, deadline=deadline, token=token, phases=phases)
+            except CircuitOpenError:
+                logger.info(logger_prefix + 'Account %s is shedding requests --> Trying next account', account.getName())
+                continue
+            except Exception as e:
+                if not retryable or len(tried) == len(self.accounts):
+                    raise
+                logger.warning(logger_prefix + 'Upload via account %s failed --> Trying next account: %s', account.getName(), e)
+                continue
+            account._onUpload(ticket)
+            with self.ownersLock:
+                self.owners[ticket] = account
+            if ticket.captchaid != -1 or ticket.errorcode == 603 or not retryable:
+                # Got a captchaid (or a cached answer) or the image itself is the problem
+                return ticket
+            if (token is not None and token.isCancelled()) or (deadline is not None and time.monotonic() >= deadline):
+                # The caller gave up on it
+                return ticket
+            logger.info(logger_prefix + 'Upload via account %s failed (errorcode %d) --> Trying next account', account.getName(), ticket.errorcode)
+        if ticket is None:
+            logger.warning(logger_prefix + 'No account can solve a captcha right now')
+            ticket = CaptchaTicket(-1, 0, logEvent=True)
+            ticket._resolve(None, -1, 'No account available')
+        return ticket
+
+    def setCaptchaCorrect(self, ticket: CaptchaTicket, iscorrect: bool) -> bool:
+        """Send feedback via the account which solved the captcha, is the Captcha result correct or not?"""
+        account = self.getAccountForTicket(ticket)
+        return account is not None and account.poller.setCaptchaCorrect(ticket, iscorrect)
+
+    def abortCaptcha(self, ticket: CaptchaTicket) -> bool:
+        """Aborts the given captcha via the account which owns it. If no answer is available yet, no credits will be used in this case!"""
+        account = self.getAccountForTicket(ticket)
+        return account is not None and account.poller.abortCaptcha(ticket)
+
+    def sendCaptchaFeedback(self, ticket: CaptchaTicket, captchaFeedbackNumber) -> bool:
+        account = self.getAccountForTicket(ticket)
+        return account is not None and account.poller.sendCaptchaFeedback(ticket, captchaFeedbackNumber)
+
+    def close(self, abortOutstanding: bool = False):
+        """ Stops polling of all accounts (see CaptchaPoller.close) and closes their connections. """
+        for account in self.accounts:
+            account.poller.close(abortOutstanding)
+            account.client.close()
+        self.imagefetcher.close()
+
+    def _choose(self, tried: List[RouterAccount]) -> Union[RouterAccount, None]:
+        candidates = []
+        for account in self.accounts:
+            if account in tried or not account.enabled:
+                continue
+            if account.client.getCreditLedger().needsRefresh():
+                try:
+                    account.client.getcredits()
+                except Exception as e:
+                    logger.warning('[AccountRouter] Failed to get credits of account %s: %s', account.getName(), e)
+                    continue
+            if account.isAvailable():
+                candidates.append(account)
+        if len(candidates) == 0:
+            return None
+        return self.strategy.choose(candidates)
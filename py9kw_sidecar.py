@@ -0,0 +1,545 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    py9kw_sidecar.py - Long-running local daemon owning all 9kw.eu traffic of a host plus a Py9kw compatible client for worker processes
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import collections
+import itertools
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Tuple, Union
+
+from py9kw import Py9kw, Base64Image, CancellationToken, CaptchaFeedback, CreditLedger, HTTPConnectionPool, HTTP_TIMEOUT_SECONDS, IMAGE_MAX_BYTES, getProxy, logger
+from py9kw_poller import CaptchaPoller, CaptchaTicket
+
+SIDECAR_SOCKET_PATH = '/tmp/py9kw-sidecar.sock'
+# Extra seconds a SidecarPy9kw waits for a result after maxtimeout before giving up on the sidecar
+SIDECAR_RESULT_GRACE_SECONDS = 30
+# Answered captchas per worker connection which can still get feedback
+SIDECAR_FEEDBACK_TICKETS = 1000
+# Every message: length of the json header and of the payload (network byte order), json header, payload (raw image of uploads)
+FRAME_HEADER = struct.Struct('!II')
+FRAME_MAX_JSON_BYTES = 64 * 1024
+
+
+def sendFrame(sock: socket.socket, message: dict, payload=b''):
+    header = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    payloadlength = memoryview(payload).nbytes
+    sock.sendall(FRAME_HEADER.pack(len(header), payloadlength) + header)
+    if payloadlength > 0:
+        sock.sendall(payload)
+
+
+def readFrame(file) -> Tuple[Union[dict, None], bytes]:
+    """ Reads one message from the given buffered binary file. Returns None as message once the other side has closed the connection. """
+    header = file.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None, b''
+    jsonlength, payloadlength = FRAME_HEADER.unpack(header)
+    if jsonlength > FRAME_MAX_JSON_BYTES or payloadlength > IMAGE_MAX_BYTES:
+        raise IOError('Frame too large: %d + %d bytes' % (jsonlength, payloadlength))
+    message = json.loads(file.read(jsonlength))
+    payload = file.read(payloadlength) if payloadlength > 0 else b''
+    if len(payload) < payloadlength:
+        return None, b''
+    return message, payload
+
+
+class SolverSidecar(socketserver.ThreadingUnixStreamServer):
+    """ Solves the captchas of all worker processes of a host with one API key: Workers (see SidecarPy9kw) send their images over the Unix domain socket
+    at path and get the results pushed back as soon as they are there. All captchas get polled by one CaptchaPoller, all requests share one connection
+    pool, credit ledger, result cache, rate governor and circuit breaker. Uploads run on uploadWorkers threads, each with its own Py9kw client using the
+    prio, maxtimeout and upload params sent by the worker. configure(client) gets called for every client to apply settings like result cache,
+    metrics or poll scheduler. Captchas of workers which disconnect before their result is there get aborted. The sidecar writes images of URL uploads
+    to the store_image_path of a worker only if that file is directly in imageDir (default: None = never).
+    Protocol: see FRAME_HEADER. Requests {op: 'upload' | 'feedback' | 'credits', id: n, ...} get answered with the same op and id, uploads additionally
+    get a {op: 'result', id: n, ...} message once solved or failed. """
+
+    daemon_threads = True
+
+    def __init__(self, apikey: str, path: str = SIDECAR_SOCKET_PATH, uploadWorkers: int = 4, maxParallelPolls: int = 16,
+                 configure: Callable[[Py9kw], None] = None, env_proxy: bool = False, proxy: str = None, mode: int = 0o600, imageDir: str = None):
+        self._removeStaleSocket(path)
+        # Socket file gets created with mode right away, nobody else may connect in the meantime and spend the credits of this API key
+        umask = os.umask(0o777 & ~mode)
+        try:
+            super().__init__(path, SidecarRequestHandler)
+        finally:
+            os.umask(umask)
+        self.path = path
+        self.configure = configure
+        self.imageDir = os.path.realpath(imageDir) if imageDir is not None else None
+        proxy = getProxy(proxy, env_proxy)
+        self.client = self._createClient(Py9kw(apikey, proxy=proxy, transport=HTTPConnectionPool(maxsize=uploadWorkers + maxParallelPolls, proxy=proxy)))
+        self.poller = CaptchaPoller(self.client, maxParallelPolls)
+        self.executor = ThreadPoolExecutor(max_workers=uploadWorkers, thread_name_prefix='py9kw-sidecar')
+        self.local = threading.local()
+        self.thread = None
+
+    def getClient(self) -> Py9kw:
+        """ Client with the settings of all upload clients e.g. to read getCreditLedger() or getMetrics(). """
+        return self.client
+
+    def start(self) -> 'SolverSidecar':
+        """ Serves in a background thread. """
+        self.thread = threading.Thread(target=self.serve_forever, name='py9kw-sidecar', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Stops accepting requests and aborts all captchas which are still in flight. """
+        if self.thread is not None:
+            self.shutdown()
+        self.server_close()
+        self.executor.shutdown(wait=True)
+        self.poller.close(abortOutstanding=True)
+        self.client.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def handleMessage(self, handler: 'SidecarRequestHandler', message: dict, payload: bytes):
+        op = message.get('op')
+        if op == 'upload':
+            self.executor.submit(self._upload, handler, message, payload)
+        elif op == 'feedback':
+            self.executor.submit(self._feedback, handler, message)
+        elif op == 'credits':
+            self.executor.submit(self._credits, handler, message)
+        else:
+            handler.send({'op': op, 'id': message.get('id'), 'errormsg': 'Unknown op'})
+
+    def _createClient(self, client: Py9kw) -> Py9kw:
+        if self.configure is not None:
+            self.configure(client)
+        return client
+
+    def _getUploadClient(self) -> Py9kw:
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self._createClient(Py9kw(self.client.apikey, proxy=self.client.proxy, transport=self.client.transport))
+            # Everything which has to be accounted for centrally
+            client.setCreditLedger(self.client.getCreditLedger())
+            client.setResultCache(self.client.getResultCache())
+            client.setMetrics(self.client.getMetrics())
+            client.setRateGovernor(self.client.getRateGovernor())
+            client.setCircuitBreaker(self.client.getCircuitBreaker())
+        return client
+
+    def _upload(self, handler: 'SidecarRequestHandler', message: dict, payload: bytes):
+        requestid = message.get('id')
+        client = self._getUploadClient()
+        client.setPriority(message.get('prio', self.client.getPrio()))
+        client.setTimeout(message.get('maxtimeout', self.client.getTimeout()))
+        client.setAdditionalCaptchaUploadParams(message.get('params', self.client.extrauploaddata))
+        if message.get('url') is not None:
+            imagedata = message['url']
+        elif message.get('base64'):
+            imagedata = Base64Image(payload)
+        else:
+            imagedata = payload
+        try:
+            ticket = self.poller.upload(imagedata, self._getImagePath(message.get('store_image_path')), client)
+        except Exception as e:
+            logger.warning('[SolverSidecar] Failed to upload captcha: %s', e)
+            ticket = self.poller._failedTicket(-1, str(e))
+        handler.addTicket(requestid, ticket)
+        if handler.closed and not ticket.done():
+            # Worker is gone already
+            self.poller.abortCaptcha(ticket)
+        handler.send({'op': 'upload', 'id': requestid, 'captchaid': ticket.captchaid, 'errorcode': ticket.errorcode, 'errormsg': ticket.errormsg})
+        ticket.addCallback(lambda ticket: self._sendResult(handler, requestid, ticket))
+
+    def _getImagePath(self, store_image_path: Union[str, None]) -> Union[str, None]:
+        """ Returns the path the image of an upload may be written to. Raises ValueError for paths outside of imageDir: Workers must not make the
+        sidecar overwrite arbitrary files of the user running it. """
+        if store_image_path is None:
+            return None
+        if self.imageDir is None:
+            raise ValueError('store_image_path is not allowed: The sidecar has no image directory')
+        path = os.path.realpath(store_image_path)
+        if os.path.dirname(path) != self.imageDir:
+            raise ValueError('store_image_path must be a file in the image directory of the sidecar: %s' % self.imageDir)
+        return path
+
+    @staticmethod
+    def _sendResult(handler: 'SidecarRequestHandler', requestid, ticket: CaptchaTicket):
+        # Before sending: Feedback right after the result has to find it already
+        handler.releaseTicket(requestid, ticket)
+        handler.send({'op': 'result', 'id': requestid, 'captchaid': ticket.captchaid, 'answer': ticket.answer, 'errorcode': ticket.errorcode,
+                      'errormsg': ticket.errormsg, 'polls': ticket.polls})
+
+    def _feedback(self, handler: 'SidecarRequestHandler', message: dict):
+        ticket = handler.getTicket(message.get('ref'))
+        captchaFeedbackNumber = message.get('feedback')
+        if ticket is None:
+            ok = False
+        elif captchaFeedbackNumber in (CaptchaFeedback.CAPTCHA_CORRECT.value, CaptchaFeedback.CAPTCHA_INCORRECT.value):
+            ok = self.poller.setCaptchaCorrect(ticket, captchaFeedbackNumber == CaptchaFeedback.CAPTCHA_CORRECT.value)
+        elif captchaFeedbackNumber == CaptchaFeedback.CAPTCHA_ABORT_CURRENT_CAPTCHA.value:
+            ok = self.poller.abortCaptcha(ticket, message.get('reason'))
+        else:
+            ok = self.poller.sendCaptchaFeedback(ticket, captchaFeedbackNumber)
+        handler.send({'op': 'feedback', 'id': message.get('id'), 'ok': ok})
+
+    def _credits(self, handler: 'SidecarRequestHandler', message: dict):
+        client = self._getUploadClient()
+        ledger = client.getCreditLedger()
+        if ledger.needsRefresh():
+            client.getcredits()
+        handler.send({'op': 'credits', 'id': message.get('id'), 'credits': ledger.getBalance(), 'available': ledger.getAvailable()})
+
+    @staticmethod
+    def _removeStaleSocket(path: str):
+        if not os.path.exists(path):
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            # Nobody listening --> Left over by a sidecar which did not stop cleanly
+            os.unlink(path)
+            return
+        finally:
+            sock.close()
+        raise OSError('A sidecar is already listening on %s' % path)
+
+
+class SidecarRequestHandler(socketserver.StreamRequestHandler):
+    """ One worker connection: Reads its requests and pushes answers and results back. """
+
+    def setup(self):
+        super().setup()
+        self.writelock = threading.Lock()
+        # Request id of the upload -> ticket of captchas in flight, for feedback and aborts
+        self.tickets = {}
+        # Request id of the upload -> what feedback needs of the latest SIDECAR_FEEDBACK_TICKETS answered captchas
+        self.answered = collections.OrderedDict()
+        self.ticketlock = threading.Lock()
+        self.closed = False
+
+    def handle(self):
+        while True:
+            try:
+                message, payload = readFrame(self.rfile)
+            except (IOError, ValueError) as e:
+                logger.warning('[SolverSidecar] Invalid request --> Closing connection: %s', e)
+                return
+            if message is None:
+                return
+            self.server.handleMessage(self, message, payload)
+
+    def finish(self):
+        self.closed = True
+        with self.ticketlock:
+            tickets = list(self.tickets.values())
+        for ticket in tickets:
+            if not ticket.done():
+                self.server.executor.submit(self.server.poller.abortCaptcha, ticket)
+        super().finish()
+
+    def addTicket(self, requestid, ticket: CaptchaTicket):
+        with self.ticketlock:
+            self.tickets[requestid] = ticket
+
+    def getTicket(self, requestid) -> Union[CaptchaTicket, None]:
+        with self.ticketlock:
+            ticket = self.tickets.get(requestid)
+            return ticket if ticket is not None else self.answered.get(requestid)
+
+    def releaseTicket(self, requestid, ticket: CaptchaTicket):
+        """ Drops the ticket (answer, response, hedge image, ...), answered captchas only keep what feedback needs. """
+        with self.ticketlock:
+            self.tickets.pop(requestid, None)
+            if ticket.answer is None:
+                return
+            feedbackticket = CaptchaTicket(ticket.captchaid, 0, reservation=ticket.reservation)
+            feedbackticket.cachekey = ticket.cachekey
+            feedbackticket._resolve(None)
+            self.answered[requestid] = feedbackticket
+            if len(self.answered) > SIDECAR_FEEDBACK_TICKETS:
+                self.answered.popitem(last=False)
+
+    def send(self, message: dict):
+        with self.writelock:
+            try:
+                sendFrame(self.connection, message)
+            except OSError:
+                # Worker is gone
+                pass
+
+
+class SidecarPy9kw(Py9kw):
+    """ Py9kw compatible client for worker processes: Uploads, results, feedback and credits go through the SolverSidecar listening on path instead
+    of talking to 9kw.eu. Prio, maxtimeout and additional upload params get sent along with every upload, all other settings (result cache, metrics,
+    poll scheduler, ...) are the ones of the sidecar. sleepAndGetResult does not poll, the sidecar pushes the result. store_image_path has to be in
+    the imageDir of the sidecar. """
+
+    def __init__(self, path: str = SIDECAR_SOCKET_PATH, timeout: float = HTTP_TIMEOUT_SECONDS):
+        # Everything goes through the sidecar: No connections and no credit ledger shared per API key of its own
+        super().__init__(None, transport=HTTPConnectionPool(maxsize=0), ledger=CreditLedger())
+        self.path = path
+        self.requesttimeout = timeout
+        self.sock = None
+        self.requestids = itertools.count(1)
+        # (op, request id) -> message received from the sidecar
+        self.messages = {}
+        self.condition = threading.Condition()
+        self.uploadid = None
+        self.result = None
+
+    def close(self):
+        with self.condition:
+            sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        super().close()
+
+    def uploadcaptcha(self, imagedata, store_image_path=None, maxtimeout: int = None, prio: int = -1) -> int:
+        """Upload the Captcha via the sidecar (same image types as Py9kw.uploadcaptcha). Returns the captchaid or -1."""
+        if maxtimeout is not None:
+            self.setTimeout(maxtimeout)
+        if prio is not None:
+            self.setPriority(prio)
+        with self.condition:
+            # Results of previous captchas are not needed anymore
+            self.messages.pop(('result', self.uploadid), None)
+        self.captchaid = -1
+        self.uploadid = None
+        self.result = None
+        self.polls = 0
+        message = {'op': 'upload', 'prio': self.getPrio(), 'maxtimeout': self.getTimeout(), 'params': self.extrauploaddata or {}}
+        if store_image_path is not None:
+            message['store_image_path'] = os.path.abspath(store_image_path)
+        with self._openImage(imagedata) as imagedata:
+            if self._isImageURL(imagedata):
+                message['url'] = imagedata
+                payload = b''
+            elif isinstance(imagedata, Base64Image):
+                message['base64'] = 1
+                payload = imagedata.data
+            elif hasattr(imagedata, 'read'):
+                payload = imagedata.read()
+            else:
+                payload = imagedata
+            response = self._request(message, payload)
+        self.setResponse(response)
+        self.uploadid = response['id']
+        self.uploadtime = time.monotonic()
+        self.captchaid = response.get('captchaid', -1)
+        self.errorcode = response.get('errorcode', -1)
+        self.errormsg = response.get('errormsg')
+        return self.captchaid
+
+    def sleepAndGetResult(self, deadline: float = None, token: CancellationToken = None) -> Union[str, None]:
+        """Wait until the sidecar pushes the result of the Captcha and return it. deadline and token: See Py9kw.sleepAndGetResult, the sidecar aborts
+        the captcha once the caller gave up on it."""
+        if self.captchaid == -1 or self.uploadid is None:
+            logger.warning('[sleepAndGetResult] WARNING: No captchaid given - no way to get a result!')
+            return None
+        if self.result is None:
+            timeout = self.getTimeout() + SIDECAR_RESULT_GRACE_SECONDS
+            if deadline is not None:
+                timeout = max(0, min(timeout, deadline - time.monotonic()))
+            self.result = self._waitFor('result', self.uploadid, timeout, token)
+        if self.result is None:
+            if token is not None and token.isCancelled():
+                return self._abortEarly('cancelled')
+            elif self._isAbortableAt(deadline):
+                return self._abortEarly('deadline')
+            self._setInternalTimeout()
+            return None
+        return self._handleSidecarResult(self.result)
+
+    def _abortEarly(self, reason: str) -> Union[str, None]:
+        """ Lets the sidecar abort the captcha (it counts the credits saved). Returns the answer if it got solved meanwhile. """
+        logger.info('[sleepAndGetResult] Captchaid %d is not needed anymore (%s) --> Aborting it', self.captchaid, reason)
+        try:
+            self._request({'op': 'feedback', 'ref': self.uploadid, 'feedback': CaptchaFeedback.CAPTCHA_ABORT_CURRENT_CAPTCHA.value, 'reason': reason})
+        except IOError:
+            logger.warning('[sendCaptchaFeedback] Error in captcha_correct')
+        # The sidecar pushes the result before it answers the abort request
+        with self.condition:
+            self.result = self.messages.pop(('result', self.uploadid), None)
+        if self.result is not None and self.result.get('answer') is not None:
+            return self._handleSidecarResult(self.result)
+        self.errorcode, self.errormsg = self._getAbortError(reason)
+        return None
+
+    def getresult(self) -> Union[str, None]:
+        """Returns the result if the sidecar has already pushed it, otherwise None with errorcode 602. Never blocks."""
+        if self.uploadid is None:
+            return None
+        if self.result is None:
+            self.result = self._waitFor('result', self.uploadid, 0)
+        if self.result is None:
+            self.errorcode = 602
+            self.errormsg = 'NO_ANSWER_YET'
+            return None
+        return self._handleSidecarResult(self.result)
+
+    def sendCaptchaFeedback(self, captchaFeedbackNumber) -> bool:
+        """Send feedback, is the Captcha result correct(=1) or not(=2) or does the user want to abort(=3)?"""
+        if self.uploadid is None:
+            logger.warning('[sendCaptchaFeedback] Cannot send captcha feedback because captchaid is not given')
+            return False
+        try:
+            return self._request({'op': 'feedback', 'ref': self.uploadid, 'feedback': captchaFeedbackNumber}).get('ok', False)
+        except IOError:
+            logger.warning('[sendCaptchaFeedback] Error in captcha_correct')
+            return False
+
+    def getcredits(self):
+        """Get available Credits (as known by the sidecar)..."""
+        response = self._request({'op': 'credits'})
+        self.credits = response.get('credits', -1)
+        return self.credits
+
+    def canSolveOneMoreCaptcha(self) -> bool:
+        """ Returns True if the credits which are neither spent nor reserved for captchas in flight of all workers are enough for one more captcha. """
+        return self._request({'op': 'credits'}).get('available', -1) >= self.getCaptchaCost()
+
+    def _handleSidecarResult(self, message: dict) -> Union[str, None]:
+        self.setResponse(message)
+        self.polls = message.get('polls', 0)
+        self.errorcode = message.get('errorcode', -1)
+        self.errormsg = message.get('errormsg')
+        return message.get('answer')
+
+    def _request(self, message: dict, payload=b'') -> dict:
+        """ Sends one request to the sidecar and returns its answer. Raises IOError if the sidecar is not reachable or does not answer in time. """
+        message['id'] = next(self.requestids)
+        with self.condition:
+            self._connect()
+            sendFrame(self.sock, message, payload)
+        response = self._waitFor(message['op'], message['id'], self.requesttimeout)
+        if response is None:
+            raise IOError('Sidecar did not answer within %d seconds' % self.requesttimeout)
+        return response
+
+    def _waitFor(self, op: str, requestid: int, timeout: float, token: CancellationToken = None) -> Union[dict, None]:
+        """ Returns the given message once it has been received or None after timeout seconds or once token got cancelled.
+        Raises IOError if the connection got lost. """
+        deadline = time.monotonic() + timeout
+        if token is not None:
+            token.addCallback(self._wakeUp)
+        try:
+            with self.condition:
+                while (op, requestid) not in self.messages:
+                    if self.sock is None:
+                        raise IOError('Connection to the sidecar got lost')
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or (token is not None and token.isCancelled()):
+                        return None
+                    self.condition.wait(remaining)
+                return self.messages.pop((op, requestid))
+        finally:
+            if token is not None:
+                token.removeCallback(self._wakeUp)
+
+    def _wakeUp(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def _connect(self):
+        if self.sock is not None:
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        threading.Thread(target=self._read, args=(sock,), name='py9kw-sidecar-client', daemon=True).start()
+
+    def _read(self, sock: socket.socket):
+        try:
+            with sock.makefile('rb') as file:
+                while True:
+                    message, payload = readFrame(file)
+                    if message is None:
+                        break
+                    with self.condition:
+                        self.messages[(message.get('op'), message.get('id'))] = message
+                        self.condition.notify_all()
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.condition:
+                if self.sock is sock:
+                    self.sock = None
+                self.condition.notify_all()
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+
+    from py9kw import LOG_MODE_EVENTS, LOG_MODE_QUIET, LOG_MODE_TEXT, FeedbackQueue, RateGovernor, ResultCache, setLogMode
+
+    parser = argparse.ArgumentParser(description='Local sidecar solving the captchas of all worker processes of this host')
+    parser.add_argument('--apikey', default=os.environ.get('PY9KW_APIKEY'), help='Default: environment variable PY9KW_APIKEY')
+    parser.add_argument('--socket', default=SIDECAR_SOCKET_PATH)
+    parser.add_argument('--workers', type=int, default=4, help='Parallel uploads')
+    parser.add_argument('--polls', type=int, default=16, help='Parallel result polls')
+    parser.add_argument('--result-cache', type=int, default=0, help='Max. entries of the result cache, 0 = no cache')
+    parser.add_argument('--rate', type=float, default=None, help='Max. API requests per second')
+    parser.add_argument('--feedback-journal', default=None, help='SQLite file keeping feedback which has not been sent yet across restarts')
+    parser.add_argument('--image-dir', default=None, help='Directory workers may let the sidecar store downloaded images in (store_image_path)')
+    parser.add_argument('--log-mode', choices=(LOG_MODE_TEXT, LOG_MODE_EVENTS, LOG_MODE_QUIET), default=LOG_MODE_EVENTS)
+    args = parser.parse_args()
+    if not args.apikey:
+        parser.error('--apikey or PY9KW_APIKEY is required')
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    setLogMode(args.log_mode)
+    resultcache = ResultCache(args.result_cache) if args.result_cache > 0 else None
+    ratelimit = RateGovernor(args.rate, max(1, args.rate)) if args.rate is not None else None
+
+    feedbackqueue = None
+
+    def configure(client: Py9kw):
+        global feedbackqueue
+        client.setResultCache(resultcache)
+        client.setRateGovernor(ratelimit)
+        if args.feedback_journal is not None:
+            if feedbackqueue is None:
+                # Sends via the first client, which is the one of the poller
+                feedbackqueue = FeedbackQueue(client, journalPath=args.feedback_journal)
+            client.setFeedbackQueue(feedbackqueue)
+
+    sidecar = SolverSidecar(args.apikey, args.socket, args.workers, args.polls, configure, imageDir=args.image_dir)
+    logger.warning('Serving py9kw sidecar on %s', args.socket)
+    try:
+        sidecar.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sidecar.stop()
+        if feedbackqueue is not None:
+            feedbackqueue.close()
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(name='python3-py9kw',
       version='2.2.5',
@@ -9,5 +9,7 @@ setup(name='python3-py9kw',
       author='over_nine_thousand',
       author_url='https://github.com/farOverNinethousand',
       url='https://github.com/farOverNinethousand/py9kw',
-      py_modules=['py9kw']
+      py_modules=['py9kw', 'py9kw_async', 'py9kw_poller', 'py9kw_pool', 'py9kw_fakeserver', 'py9kw_sidecar', 'py9kw_router', 'py9kw_batch'],
+      # ImageCompactor and benchmarks/bench_compaction.py: pip install python3-py9kw[compaction]
+      extras_require={'compaction': ['Pillow']}
       )
@@ -0,0 +1,62 @@
+import http.server
+import itertools
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import py9kw  # noqa: E402
+import py9kw_fakeserver  # noqa: E402
+
+apikeys = itertools.count(1)
+
+
+@pytest.fixture
+def apikey() -> str:
+    """ Fresh API key per test: Credit ledgers, rate governors and circuit breakers are shared per API key within the process. """
+    return 'testkey%d' % next(apikeys)
+
+
+@pytest.fixture
+def fakeserver():
+    server = py9kw_fakeserver.FakeApiServer(py9kw_fakeserver.FakeApiConfig(solveTime=py9kw_fakeserver.constant(0.1))).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def configure(fakeserver):
+    """ Applies the settings every client of a test needs: fake API and fast polling. """
+    def configure(client: py9kw.Py9kw):
+        client.setApiUrl(fakeserver.getApiUrl())
+        client.setWaitSecondsPerLoop(0.05)
+    return configure
+
+
+class ImageRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/missing':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', '5')
+        self.end_headers()
+        self.wfile.write(b'image')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def imageserver():
+    """ Base URL of a server answering /image with b'image' and /missing with 404. """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ImageRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%d' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from py9kw_async import AsyncPy9kw
+from py9kw_fakeserver import FakeApiServer, constant
+
+
+@pytest.fixture
+def run(configure, apikey):
+    """ Runs test(asyncclient) with a fresh AsyncPy9kw against the fake server and returns what it returns. """
+    def run(test):
+        async def main():
+            async with AsyncPy9kw(apikey) as asyncclient:
+                configure(asyncclient)
+                return await test(asyncclient)
+        return asyncio.run(main())
+    return run
+
+
+def test_solve(run, fakeserver, apikey):
+    async def test(asyncclient):
+        captchaid = await asyncclient.uploadcaptcha(b'image')
+        assert captchaid > 0 and asyncclient.getCaptchaID() == captchaid
+        # Credits of the upload in flight are reserved until the answer is there
+        assert asyncclient.getCreditLedger().getReserved() == 10
+        answer = await asyncclient.sleepAndGetResult()
+        return answer, captchaid, asyncclient.getErrorCode(), asyncclient.getPollCount()
+
+    answer, captchaid, errorcode, polls = run(test)
+    assert answer == 'answer%d' % captchaid and errorcode == -1 and polls >= 2
+    assert fakeserver.getStats()['solved'] == 1
+
+
+def test_credits_go_into_the_ledger(run, fakeserver, apikey):
+    async def test(asyncclient):
+        assert await asyncclient.getcredits() == fakeserver.config.credits
+        assert await asyncclient.solve(b'image') is not None
+        ledger = asyncclient.getCreditLedger()
+        return ledger.getBalance(), ledger.getReserved(), await asyncclient.canSolveOneMoreCaptcha()
+
+    # Settled with the balance of the answer
+    assert run(test) == (fakeserver.config.credits - 10, 0, True)
+
+
+def test_no_answer_yet(run, fakeserver):
+    fakeserver.config.solveTime = constant(60)
+
+    async def test(asyncclient):
+        assert await asyncclient.uploadcaptcha(b'image') > 0
+        return await asyncclient.getresult(), asyncclient.getErrorCode()
+
+    assert run(test) == (None, 602)
+
+
+def test_no_user(run, fakeserver, monkeypatch):
+    # Real API and fake server answer this at the maxtimeout of the captcha, at least 60 seconds
+    def noUser(self, apikey: str, params: dict) -> dict:
+        return self._ok({'answer': 'ERROR NO USER'})
+
+    monkeypatch.setattr(FakeApiServer, '_correctdata', noUser)
+
+    async def test(asyncclient):
+        assert await asyncclient.uploadcaptcha(b'image') > 0
+        return await asyncclient.sleepAndGetResult(), asyncclient.getErrorCode(), asyncclient.getCreditLedger().getReserved()
+
+    assert run(test) == (None, 600, 0)
+
+
+def test_download_failure(run, fakeserver, imageserver):
+    async def test(asyncclient):
+        return await asyncclient.uploadcaptcha(imageserver + '/missing'), asyncclient.getErrorCode()
+
+    assert run(test) == (-1, 603)
+    assert fakeserver.getStats().get('uploads') is None
+
+
+def test_polling_stops_once_server_does_not_want_us_to_try_again(run, fakeserver, monkeypatch):
+    fakeserver.config.solveTime = constant(60)
+
+    def noTryAgain(self, apikey: str, params: dict) -> dict:
+        return self._ok({'answer': 'NO DATA', 'nodata': 1, 'try_again': 0, 'info': 1})
+
+    monkeypatch.setattr(FakeApiServer, '_correctdata', noTryAgain)
+
+    async def test(asyncclient):
+        assert await asyncclient.uploadcaptcha(b'image') > 0
+        return await asyncclient.sleepAndGetResult(), asyncclient.getErrorCode(), asyncclient.getPollCount()
+
+    assert run(test) == (None, 601, 1)
+
+
+def test_close_waits_for_connections_and_closes_sync_transport(fakeserver, configure, apikey):
+    async def test():
+        asyncclient = AsyncPy9kw(apikey)
+        configure(asyncclient)
+        assert await asyncclient.getcredits() > 0
+        writers = [writer for connections in asyncclient.httpclient.idle.values() for reader, writer, lastused in connections]
+        asyncclient.getImageFetcher().prefetch('http://127.0.0.1:1/image')
+        await asyncclient.close()
+        return writers, asyncclient
+
+    writers, asyncclient = asyncio.run(test())
+    assert len(writers) == 1
+    # Closed for real, not only scheduled to get closed
+    assert writers[0].get_extra_info('socket').fileno() == -1
+    assert asyncclient.getImageFetcher().executor is None and asyncclient.transport.idle == {}
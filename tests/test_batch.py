@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+
+import py9kw_batch
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_prio_is_uploaded_and_charged(fakeserver, apikey, tmp_path):
+    captchas = tmp_path / 'captchas'
+    captchas.mkdir()
+    for number in range(5):
+        (captchas / ('captcha%d.png' % number)).write_bytes(b'image%d' % number)
+    output = tmp_path / 'results.jsonl'
+    assert py9kw_batch.main([str(captchas), '--apikey', apikey, '--api-url', fakeserver.getApiUrl(), '--prio', '5', '--poll-seconds', '0.05',
+                             '--output', str(output), '--concurrency', '2']) == 0
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(results) == 5
+    assert all(result['answer'] is not None for result in results)
+    assert [captcha.cost for captcha in fakeserver.captchas.values()] == [15] * 5
+    assert fakeserver.credits[apikey] == fakeserver.config.credits - 75
+
+
+def test_batch_subcommand_of_py9kw(fakeserver, apikey, tmp_path):
+    captchas = tmp_path / 'captchas'
+    captchas.mkdir()
+    (captchas / 'captcha.png').write_bytes(b'image')
+    output = tmp_path / 'results.jsonl'
+    # Looks like the arguments of the self test but is a batch run
+    (tmp_path / 'other.png').write_bytes(b'other')
+    (tmp_path / '5').write_text(str(tmp_path / 'other.png') + '\n')
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(REPOSITORY, 'py9kw.py'), 'batch', str(captchas), '5', '--apikey', apikey,
+                             '--api-url', fakeserver.getApiUrl(), '--poll-seconds', '0.05', '--output', str(output)], cwd=str(tmp_path),
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    results = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(results) == 2 and all(result['answer'] is not None for result in results)
+    # py9kw_batch uses the running py9kw instead of importing it again
+    imported = [line.split('|')[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')]
+    assert 'py9kw_batch' in imported and 'py9kw' not in imported
+
+
+def test_py9kw_without_subcommand_does_not_run_batch(tmp_path):
+    result = subprocess.run([sys.executable, os.path.join(REPOSITORY, 'py9kw.py'), str(tmp_path)], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 2 and 'py9kw.py batch' in result.stdout
+    result = subprocess.run([sys.executable, os.path.join(REPOSITORY, 'py9kw.py'), 'batch', '--help'], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0 and result.stdout.startswith('usage: py9kw.py batch ')
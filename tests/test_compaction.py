@@ -0,0 +1,102 @@
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+import py9kw
+from py9kw import Py9kw, ImageCompactor
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def Image():
+    return pytest.importorskip('PIL.Image')
+
+
+def encode(image, imageformat: str, **params) -> bytes:
+    output = io.BytesIO()
+    image.save(output, imageformat, **params)
+    return output.getvalue()
+
+
+def test_compactor_needs_pillow(monkeypatch):
+    monkeypatch.setattr(py9kw, 'Image', None)
+    with pytest.raises(ImportError, match='Pillow'):
+        ImageCompactor()
+
+
+def test_benchmark_fails_clearly_without_pillow():
+    # PIL = None in sys.modules makes every import of it fail, no matter whether Pillow is installed
+    code = 'import runpy, sys\nsys.modules["PIL"] = None\nrunpy.run_path(%r, run_name="__main__")' % os.path.join(REPOSITORY, 'benchmarks', 'bench_compaction.py')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert result.returncode == 1
+    assert 'needs Pillow' in result.stderr
+    assert 'Traceback' not in result.stderr
+
+
+def test_small_images_are_skipped(Image):
+    imagedata = encode(Image.new('RGB', (20, 20), (255, 0, 0)), 'PNG')
+    compactor = ImageCompactor(minBytes=len(imagedata) + 1)
+    compacted, report = compactor.compact(imagedata)
+    assert compacted is imagedata
+    assert report.skipped and report.getSavedBytes() == 0 and report.timings == {}
+
+
+def test_unknown_format_is_uploaded_as_it_is(Image):
+    imagedata = b'no image' * 10
+    compacted, report = ImageCompactor(minBytes=0).compact(imagedata)
+    assert compacted is imagedata
+    assert report.format is None and not report.skipped
+
+
+def test_big_canvas_gets_cropped_downscaled_and_reencoded(Image):
+    image = Image.new('RGB', (2000, 1000), (255, 255, 255))
+    image.paste(Image.effect_noise((600, 200), 64).convert('RGB'), (700, 400))
+    imagedata = encode(image, 'BMP')
+    compacted, report = ImageCompactor(minBytes=0, maxDimension=300).compact(imagedata)
+    assert report.format in ('PNG', 'JPEG') and report.compactedBytes == len(compacted) < len(imagedata)
+    assert set(report.timings) == {'decode', 'crop', 'downscale', 'encode'}
+    result = Image.open(io.BytesIO(compacted))
+    assert result.format == report.format
+    # Cropped to the noise (600x200), then downscaled to maxDimension
+    assert result.size == (300, 100)
+
+
+def test_only_first_frame_of_animations(Image):
+    frames = [Image.effect_noise((200, 100), 32 + i).convert('P') for i in range(5)]
+    imagedata = encode(frames[0], 'GIF', save_all=True, append_images=frames[1:], duration=100, loop=0)
+    compacted, report = ImageCompactor(minBytes=0, formats=('PNG', 'GIF')).compact(imagedata)
+    assert getattr(Image.open(io.BytesIO(compacted)), 'n_frames', 1) == 1
+
+
+def test_results_which_are_not_smaller_are_discarded(Image):
+    imagedata = encode(Image.new('L', (10, 10), 0), 'PNG', optimize=True)
+    compacted, report = ImageCompactor(minBytes=0, formats=('BMP',)).compact(imagedata)
+    assert compacted is imagedata
+    assert report.format is None and report.getSavedBytes() == 0
+
+
+def test_stats(Image):
+    compactor = ImageCompactor(minBytes=0, maxDimension=100)
+    imagedata = encode(Image.effect_noise((400, 400), 50).convert('RGB'), 'BMP')
+    for _ in range(2):
+        compacted, report = compactor.compact(imagedata)
+    stats = compactor.getStats()
+    assert stats['images'] == 2
+    assert stats['originalBytes'] == 2 * len(imagedata) and stats['compactedBytes'] == 2 * len(compacted)
+    assert set(stats['stageSeconds']) == set(report.timings)
+
+
+def test_solver_uploads_compacted_image(Image, fakeserver, configure, apikey):
+    client = Py9kw(apikey)
+    configure(client)
+    client.setImageCompactor(ImageCompactor(minBytes=0, maxDimension=100))
+    imagedata = encode(Image.effect_noise((400, 400), 50).convert('RGB'), 'BMP')
+    assert client.uploadcaptcha(imagedata) > 0
+    assert client.sleepAndGetResult() is not None
+    report = client.getLastCompactionReport()
+    assert report.originalBytes == len(imagedata) and 0 < report.compactedBytes < len(imagedata)
+    client.close()
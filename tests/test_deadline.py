@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from py9kw import Py9kw, CancellationToken, Metrics, RateGovernor
+from py9kw_async import AsyncPy9kw
+from py9kw_fakeserver import constant
+from py9kw_poller import CaptchaPoller
+
+
+def waitFor(condition, seconds: float = 5) -> bool:
+    """ The poller sends abort requests after it resolved the ticket. """
+    until = time.monotonic() + seconds
+    while not condition() and time.monotonic() < until:
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def slowserver(fakeserver):
+    """ Nothing gets solved before the callers give up. """
+    fakeserver.config.solveTime = constant(5)
+    return fakeserver
+
+
+@pytest.fixture
+def client(slowserver, configure, apikey):
+    client = Py9kw(apikey)
+    configure(client)
+    client.setMetrics(Metrics())
+    yield client
+    client.close()
+
+
+def assertAbortedServerside(fakeserver, apikey: str, metrics: Metrics, reason: str):
+    # Counted once the abort request got answered
+    assert waitFor(lambda: metrics.getCounter('py9kw_aborts_total', reason=reason) == 1)
+    assert fakeserver.getStats().get('feedback_3') == 1
+    assert fakeserver.getStats().get('solved') is None
+    assert fakeserver.credits[apikey] == fakeserver.config.credits
+    assert metrics.getCounter('py9kw_credits_saved_total') == 10
+
+
+def test_deadline(client, slowserver, apikey):
+    starttime = time.monotonic()
+    assert client.solve(b'image', deadline=time.monotonic() + 0.3) is None
+    assert time.monotonic() - starttime < 1
+    assert client.getErrorCode() == 601
+    assertAbortedServerside(slowserver, apikey, client.getMetrics(), 'deadline')
+    assert client.getCreditLedger().getReserved() == 0
+
+
+def test_cancel(client, slowserver, apikey):
+    token = CancellationToken()
+    threading.Timer(0.3, token.cancel).start()
+    starttime = time.monotonic()
+    assert client.solve(b'image', token=token) is None
+    # Stops waiting right away, not after the next poll
+    assert time.monotonic() - starttime < 1
+    assert client.getErrorCode() == 604
+    assertAbortedServerside(slowserver, apikey, client.getMetrics(), 'cancelled')
+
+
+def test_given_up_before_upload(client, slowserver):
+    token = CancellationToken()
+    token.cancel()
+    assert client.solve(b'image', token=token) is None
+    assert client.getErrorCode() == 604
+    assert client.solve(b'image', deadline=time.monotonic() - 1) is None
+    assert client.getErrorCode() == 601
+    # Nothing uploaded --> Nothing to abort or save
+    assert slowserver.getStats().get('uploads') is None
+    assert client.getMetrics().getCounter('py9kw_aborts_total') == 0
+
+
+def getGovernor(action: str) -> RateGovernor:
+    """ One request of action, the next one only after 10 seconds. """
+    governor = RateGovernor(ratePerSecond=None)
+    governor.setLimit(0.1, 1, action)
+    return governor
+
+
+def test_deadline_stops_rate_governor_wait(client, slowserver, apikey):
+    client.setRateGovernor(getGovernor('usercaptchacorrectdata'))
+    starttime = time.monotonic()
+    assert client.solve(b'image', deadline=time.monotonic() + 0.5) is None
+    assert time.monotonic() - starttime < 1
+    assert client.getErrorCode() == 601 and client.getPollCount() == 1
+    assertAbortedServerside(slowserver, apikey, client.getMetrics(), 'deadline')
+
+
+def test_cancel_stops_rate_governor_wait(client, slowserver, apikey):
+    client.setRateGovernor(getGovernor('usercaptchacorrectdata'))
+    token = CancellationToken()
+    threading.Timer(0.5, token.cancel).start()
+    starttime = time.monotonic()
+    assert client.solve(b'image', token=token) is None
+    assert time.monotonic() - starttime < 1.5
+    assert client.getErrorCode() == 604 and client.getPollCount() == 1
+    assertAbortedServerside(slowserver, apikey, client.getMetrics(), 'cancelled')
+
+
+def test_given_up_while_upload_waits_for_rate_governor(client, slowserver):
+    governor = getGovernor('usercaptchaupload')
+    client.setRateGovernor(governor)
+    assert governor.tryAcquire('usercaptchaupload') == 0
+    token = CancellationToken()
+    threading.Timer(0.3, token.cancel).start()
+    starttime = time.monotonic()
+    assert client.solve(b'image', token=token) is None
+    assert time.monotonic() - starttime < 1
+    assert (client.getErrorCode(), client.getCaptchaID()) == (604, -1)
+    assert client.solve(b'image', deadline=time.monotonic() + 5) is None
+    assert client.getErrorCode() == 601
+    assert slowserver.getStats().get('uploads') is None
+    assert client.getCreditLedger().getReserved() == 0
+
+
+@pytest.fixture
+def solveAsync(slowserver, configure, apikey):
+    """ Runs solve(asyncclient) on a fresh AsyncPy9kw, returns its result, errorcode and metrics. """
+    def solveAsync(solve) -> tuple:
+        async def run():
+            async with AsyncPy9kw(apikey) as asyncclient:
+                configure(asyncclient)
+                asyncclient.setMetrics(Metrics())
+                result = await solve(asyncclient)
+                return result, asyncclient.getErrorCode(), asyncclient.getMetrics()
+        return asyncio.run(run())
+    return solveAsync
+
+
+def test_async_deadline(solveAsync, slowserver, apikey):
+    async def solve(asyncclient):
+        return await asyncclient.solve(b'image', deadline=time.monotonic() + 0.3)
+
+    result, errorcode, metrics = solveAsync(solve)
+    assert (result, errorcode) == (None, 601)
+    assertAbortedServerside(slowserver, apikey, metrics, 'deadline')
+
+
+def test_async_cancel(solveAsync, slowserver, apikey):
+    async def solve(asyncclient):
+        token = CancellationToken()
+        asyncio.get_running_loop().call_later(0.3, token.cancel)
+        return await asyncclient.solve(b'image', token=token)
+
+    result, errorcode, metrics = solveAsync(solve)
+    assert (result, errorcode) == (None, 604)
+    assertAbortedServerside(slowserver, apikey, metrics, 'cancelled')
+
+
+def test_async_deadline_stops_rate_governor_wait(solveAsync, slowserver, apikey):
+    async def solve(asyncclient):
+        asyncclient.setRateGovernor(getGovernor('usercaptchacorrectdata'))
+        return await asyncclient.solve(b'image', deadline=time.monotonic() + 0.5), asyncclient.getPollCount()
+
+    starttime = time.monotonic()
+    result, errorcode, metrics = solveAsync(solve)
+    assert time.monotonic() - starttime < 1.5
+    assert (result, errorcode) == ((None, 1), 601)
+    assertAbortedServerside(slowserver, apikey, metrics, 'deadline')
+
+
+def test_async_task_cancel(solveAsync, slowserver, apikey):
+    async def solve(asyncclient):
+        task = asyncio.ensure_future(asyncclient.solve(b'image'))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return 'cancelled'
+
+    result, errorcode, metrics = solveAsync(solve)
+    assert (result, errorcode) == ('cancelled', 604)
+    assertAbortedServerside(slowserver, apikey, metrics, 'cancelled')
+
+
+def test_poller_deadline(client, slowserver, apikey):
+    with CaptchaPoller(client) as poller:
+        ticket = poller.upload(b'image', deadline=time.monotonic() + 0.3)
+        assert ticket.result(2) is None
+        assert ticket.errorcode == 601
+        assertAbortedServerside(slowserver, apikey, client.getMetrics(), 'deadline')
+    assert client.getCreditLedger().getReserved() == 0
+
+
+def test_poller_cancel(client, slowserver, apikey):
+    token = CancellationToken()
+    with CaptchaPoller(client) as poller:
+        tickets = [poller.upload(b'image', token=token) for _ in range(2)]
+        time.sleep(0.2)
+        token.cancel()
+        assert [ticket.result(1) for ticket in tickets] == [None, None]
+        assert [ticket.errorcode for ticket in tickets] == [604, 604]
+        assert waitFor(lambda: client.getMetrics().getCounter('py9kw_aborts_total', reason='cancelled') == 2)
+    assert slowserver.getStats().get('feedback_3') == 2
+    assert slowserver.getStats().get('solved') is None
+    assert client.getMetrics().getCounter('py9kw_credits_saved_total') == 20
+    # Already cancelled --> Not even uploaded
+    with CaptchaPoller(client) as poller:
+        ticket = poller.upload(b'image', token=token)
+        assert ticket.done() and ticket.captchaid == -1 and ticket.errorcode == 604
+    assert slowserver.getStats()['uploads'] == 2
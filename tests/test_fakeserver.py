@@ -0,0 +1,108 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+import pytest
+
+from py9kw_fakeserver import FakeApiConfig, FakeApiServer, constant
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def call(fakeserver: FakeApiServer, action: str, apikey: str = 'key', **params) -> dict:
+    params.update({'action': action, 'apikey': apikey, 'json': 1})
+    with urllib.request.urlopen(fakeserver.getApiUrl() + '?' + urlencode(params), timeout=10) as response:
+        return json.loads(response.read())
+
+
+def upload(fakeserver: FakeApiServer, apikey: str = 'key', **params) -> int:
+    response = call(fakeserver, 'usercaptchaupload', apikey, **{'file-upload-01': 'aW1hZ2U=', 'base64': 1}, **params)
+    return int(response['captchaid'])
+
+
+def test_answer_after_solve_time(fakeserver):
+    fakeserver.config.solveTime = constant(0.2)
+    captchaid = upload(fakeserver, prio=3)
+    response = call(fakeserver, 'usercaptchacorrectdata', id=captchaid)
+    assert (response['answer'], response['nodata'], response['try_again']) == ('NO DATA', 1, 1)
+    time.sleep(0.3)
+    response = call(fakeserver, 'usercaptchacorrectdata', id=captchaid)
+    assert response['answer'] == 'answer%d' % captchaid
+    # Credits as String like the real API, charged once with 10 + prio
+    assert response['credits'] == str(100000 - 13)
+    assert call(fakeserver, 'usercaptchacorrectdata', id=captchaid)['credits'] == str(100000 - 13)
+    assert call(fakeserver, 'usercaptchaguthaben')['credits'] == str(100000 - 13)
+    assert fakeserver.getStats()['solved'] == 1
+
+
+def test_feedback(fakeserver):
+    fakeserver.config.solveTime = constant(0)
+    captchaid = upload(fakeserver)
+    call(fakeserver, 'usercaptchacorrectdata', id=captchaid)
+    assert call(fakeserver, 'usercaptchacorrectback', id=captchaid, correct=2)['status']['success']
+    assert call(fakeserver, 'usercaptchaguthaben')['credits'] == str(100000)
+    assert call(fakeserver, 'usercaptchacorrectback', id=captchaid, correct=1)['error'].startswith('0012')
+    # Answer still comes along with the error
+    response = call(fakeserver, 'usercaptchacorrectdata', id=captchaid)
+    assert response['answer'] == 'answer%d' % captchaid and response['error'].startswith('0012')
+    assert fakeserver.getStats()['feedback_2'] == 1
+
+
+def test_aborted_captchas_are_not_charged(fakeserver):
+    fakeserver.config.solveTime = constant(60)
+    captchaid = upload(fakeserver)
+    call(fakeserver, 'usercaptchacorrectback', id=captchaid, correct=3)
+    assert call(fakeserver, 'usercaptchacorrectdata', id=captchaid)['answer'] == 'ERROR NO USER'
+    assert call(fakeserver, 'usercaptchaguthaben')['credits'] == str(100000)
+
+
+@pytest.mark.parametrize('action, params, error', [
+    ('usercaptchaupload', {}, '0016'),
+    ('usercaptchacorrectdata', {'id': 12345}, '0013'),
+    ('unknown', {}, '0015'),
+])
+def test_errors(fakeserver, action, params, error):
+    response = call(fakeserver, action, **params)
+    assert response['error'].startswith(error) and not response['status']['success']
+
+
+def test_config():
+    fakeserver = FakeApiServer(FakeApiConfig(credits=5, stringCredits=False, apikeys={'valid'})).start()
+    try:
+        assert call(fakeserver, 'usercaptchaguthaben', 'invalid')['error'].startswith('0001')
+        assert call(fakeserver, 'usercaptchaguthaben', 'valid')['credits'] == 5
+        response = call(fakeserver, 'usercaptchaupload', 'valid', **{'file-upload-01': 'aW1hZ2U=', 'base64': 1})
+        assert response['error'].startswith('0010')
+    finally:
+        fakeserver.stop()
+
+
+def test_fail_next(fakeserver):
+    fakeserver.failNext(2, 503, 'usercaptchaupload')
+    # Other actions are not affected
+    assert 'credits' in call(fakeserver, 'usercaptchaguthaben')
+    for _ in range(2):
+        with pytest.raises(urllib.error.HTTPError) as e:
+            upload(fakeserver)
+        assert e.value.code == 503
+    assert upload(fakeserver) > 0
+    fakeserver.failNext()
+    with pytest.raises(urllib.error.HTTPError):
+        call(fakeserver, 'usercaptchaguthaben')
+    assert fakeserver.getStats()['failures'] == 3
+
+
+def test_throughput_benchmark_runs():
+    result = subprocess.run([sys.executable, os.path.join(REPOSITORY, 'benchmarks', 'bench_throughput.py'), '--captchas', '4', '--concurrency', '1,2',
+                             '--solve-median', '0.05', '--poll-seconds', '0.05'], capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert lines[0].split()[:2] == ['conc', 'captchas/s']
+    assert [line.split()[0] for line in lines[1:]] == ['1', '2']
+    # All captchas solved
+    assert [line.split()[2] for line in lines[1:]] == ['4', '4']
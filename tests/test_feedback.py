@@ -0,0 +1,169 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from py9kw import Py9kw, FeedbackQueue
+from py9kw_fakeserver import FakeApiRequestHandler
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEEDBACK = 'usercaptchacorrectback'
+
+
+def waitFor(condition, seconds: float = 5) -> bool:
+    until = time.monotonic() + seconds
+    while not condition() and time.monotonic() < until:
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def feedbacktimes(monkeypatch):
+    """ time.monotonic() of every feedback request the fake server gets, also of those failNext() fails. """
+    feedbacktimes = []
+    do_GET = FakeApiRequestHandler.do_GET
+
+    def recordingGet(self):
+        if 'action=' + FEEDBACK in self.path:
+            feedbacktimes.append(time.monotonic())
+        do_GET(self)
+
+    monkeypatch.setattr(FakeApiRequestHandler, 'do_GET', recordingGet)
+    return feedbacktimes
+
+
+@pytest.fixture
+def client(fakeserver, configure, apikey):
+    """ Client with a solved captcha to send feedback for. """
+    client = Py9kw(apikey)
+    configure(client)
+    assert client.uploadcaptcha(b'image') > 0
+    assert client.sleepAndGetResult() is not None
+    yield client
+    client.close()
+
+
+def test_retry_with_backoff(client, fakeserver, apikey, feedbacktimes):
+    fakeserver.failNext(2, 500, FEEDBACK)
+    with FeedbackQueue(client, initialWaitSeconds=0.2, factor=2) as feedbackqueue:
+        client.setFeedbackQueue(feedbackqueue)
+        balance = client.getCreditLedger().getBalance()
+        starttime = time.monotonic()
+        assert client.setCaptchaCorrect(False)
+        # Queued only, the refund gets booked right away
+        assert time.monotonic() - starttime < 0.1
+        assert client.getCreditLedger().getBalance() == balance + 10
+        assert waitFor(lambda: feedbackqueue.getStats()['sent'] == 1)
+        assert feedbackqueue.getStats() == {'pending': 0, 'sent': 1, 'rejected': 0, 'failed': 0, 'retries': 2}
+    assert fakeserver.getStats()['failures'] == 2 and fakeserver.getStats()['feedback_2'] == 1
+    assert fakeserver.credits[apikey] == fakeserver.config.credits
+    gaps = [later - earlier for earlier, later in zip(feedbacktimes, feedbacktimes[1:])]
+    assert len(gaps) == 2 and 0.2 <= gaps[0] < 0.4 <= gaps[1] < 0.8
+
+
+def test_gives_up_after_max_attempts_and_rejected_feedback_is_not_retried(client, fakeserver, feedbacktimes):
+    fakeserver.failNext(3, 503, FEEDBACK)
+    with FeedbackQueue(client, maxAttempts=3, initialWaitSeconds=0.01) as feedbackqueue:
+        assert feedbackqueue.put(client._getFeedbackData(2))
+        assert waitFor(lambda: feedbackqueue.getStats()['failed'] == 1)
+        # Accepted once --> The second one gets 0012 from the API
+        for _ in range(2):
+            assert feedbackqueue.put(client._getFeedbackData(1))
+        assert feedbackqueue.flush(5)
+        assert feedbackqueue.getStats() == {'pending': 0, 'sent': 1, 'rejected': 1, 'failed': 1, 'retries': 2}
+    assert len(feedbacktimes) == 5
+    assert not feedbackqueue.put(client._getFeedbackData(1))
+
+
+def test_close_flushes_backoff(client, fakeserver):
+    fakeserver.failNext(1, 500, FEEDBACK)
+    feedbackqueue = FeedbackQueue(client, initialWaitSeconds=60)
+    assert feedbackqueue.put(client._getFeedbackData(2))
+    assert waitFor(lambda: feedbackqueue.getStats()['retries'] == 1)
+    starttime = time.monotonic()
+    feedbackqueue.close()
+    # Sent right away instead of after the backoff
+    assert time.monotonic() - starttime < 5
+    assert feedbackqueue.getStats()['sent'] == 1
+    assert fakeserver.getStats()['feedback_2'] == 1
+
+
+def getJournal(path: str) -> list:
+    db = sqlite3.connect(path)
+    try:
+        return db.execute('SELECT request FROM feedback').fetchall()
+    finally:
+        db.close()
+
+
+def test_journal_survives_close_with_server_down(client, fakeserver, apikey, tmp_path):
+    journal = str(tmp_path / 'feedback.sqlite')
+    fakeserver.failNext(1000, 500, FEEDBACK)
+    feedbackqueue = FeedbackQueue(client, initialWaitSeconds=0.05, journalPath=journal, flushSeconds=0.3)
+    assert feedbackqueue.put(client._getFeedbackData(2))
+    feedbackqueue.close()
+    assert feedbackqueue.getStats()['sent'] == 0
+    assert len(getJournal(journal)) == 1
+    # API keys stay out of the journal
+    assert 'apikey' not in json.loads(getJournal(journal)[0][0])
+    assert apikey not in getJournal(journal)[0][0]
+    # Server is back after the restart
+    fakeserver.failures.clear()
+    with FeedbackQueue(client, journalPath=journal) as feedbackqueue:
+        assert waitFor(lambda: feedbackqueue.getStats()['sent'] == 1)
+    assert fakeserver.getStats()['feedback_2'] == 1
+    assert getJournal(journal) == []
+
+
+def test_journal_replay_after_crash(client, fakeserver, apikey, tmp_path):
+    journal = str(tmp_path / 'feedback.sqlite')
+    fakeserver.failNext(1000, 500, FEEDBACK)
+    code = '''
+import os
+import sys
+import time
+sys.path.insert(0, %r)
+from py9kw import Py9kw, FeedbackQueue
+client = Py9kw(%r)
+client.setApiUrl(%r)
+feedbackqueue = FeedbackQueue(client, initialWaitSeconds=0.05, journalPath=%r)
+feedbackqueue.put(client._getFeedbackData(2, %d))
+while feedbackqueue.getStats()['retries'] == 0:
+    time.sleep(0.01)
+# Crash: No close(), nothing got sent
+os._exit(0)
+''' % (REPOSITORY, apikey, fakeserver.getApiUrl(), journal, client.getCaptchaID())
+    subprocess.run([sys.executable, '-c', code], check=True, timeout=30)
+    assert fakeserver.getStats().get('feedback_2') is None
+    assert len(getJournal(journal)) == 1
+    fakeserver.failures.clear()
+    with FeedbackQueue(client, journalPath=journal) as feedbackqueue:
+        assert waitFor(lambda: feedbackqueue.getStats()['sent'] == 1)
+    assert fakeserver.getStats()['feedback_2'] == 1
+    assert fakeserver.credits[apikey] == fakeserver.config.credits
+    assert getJournal(journal) == []
+
+
+def test_feedback_of_other_api_keys_is_not_journaled(client, fakeserver, configure, apikey, tmp_path):
+    journal = str(tmp_path / 'feedback.sqlite')
+    other = Py9kw(apikey + 'other')
+    configure(other)
+    try:
+        assert other.uploadcaptcha(b'image') > 0
+        assert other.sleepAndGetResult() is not None
+        fakeserver.failNext(1000, 500, FEEDBACK)
+        feedbackqueue = FeedbackQueue(client, initialWaitSeconds=0.05, journalPath=journal, flushSeconds=0.3)
+        # Could only be sent with the API key of client after a restart
+        assert feedbackqueue.put(other._getFeedbackData(2))
+        assert getJournal(journal) == []
+        fakeserver.failures.clear()
+        assert feedbackqueue.flush(5)
+        feedbackqueue.close()
+    finally:
+        other.close()
+    assert feedbackqueue.getStats()['sent'] == 1
+    assert fakeserver.credits[apikey + 'other'] == fakeserver.config.credits
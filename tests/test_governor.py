@@ -0,0 +1,197 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import py9kw
+from py9kw import Py9kw, CircuitBreaker, CircuitOpenError, Metrics, RateGovernor
+from py9kw_async import AsyncPy9kw
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ Replaces time.monotonic by a clock which only moves on clock.advance(seconds). """
+    class Clock:
+        now = 1000.0
+
+        def advance(self, seconds: float):
+            self.now += seconds
+
+    clock = Clock()
+    monkeypatch.setattr(py9kw.time, 'monotonic', lambda: clock.now)
+    return clock
+
+
+def test_tokens_refill(clock):
+    governor = RateGovernor(ratePerSecond=4, burst=2)
+    assert [governor.tryAcquire('usercaptchacorrectdata') for _ in range(2)] == [0, 0]
+    # Empty --> Wait for one token, nothing gets taken meanwhile
+    assert governor.tryAcquire('usercaptchacorrectdata') == 0.25
+    clock.advance(0.125)
+    assert governor.tryAcquire('usercaptchacorrectdata') == 0.125
+    clock.advance(0.125)
+    assert governor.tryAcquire('usercaptchacorrectdata') == 0
+    # Never more than burst
+    clock.advance(60)
+    assert [governor.tryAcquire('usercaptchacorrectdata') > 0 for _ in range(3)] == [False, False, True]
+    stats = governor.getStats()
+    assert stats['delays'] == 3 and stats['delaySeconds'] == 0.625
+
+
+def test_limit_per_action(clock):
+    governor = RateGovernor(ratePerSecond=None)
+    assert governor.tryAcquire('usercaptchacorrectdata') == 0
+    governor.setLimit(1, action='usercaptchacorrectdata')
+    assert governor.tryAcquire('usercaptchacorrectdata') == 0
+    assert governor.tryAcquire('usercaptchacorrectdata') == pytest.approx(1)
+    # Other actions are not limited
+    assert governor.tryAcquire('usercaptchaupload') == 0
+    governor.setLimit(None, action='usercaptchacorrectdata')
+    assert governor.getLimits() == {}
+    assert governor.tryAcquire('usercaptchacorrectdata') == 0
+
+
+def test_acquire_blocks():
+    governor = RateGovernor(ratePerSecond=20, burst=1)
+    starttime = time.monotonic()
+    waited = [governor.acquire('usercaptchaupload') for _ in range(3)]
+    assert waited[0] == 0 and waited[1] > 0 and waited[2] > 0
+    assert time.monotonic() - starttime >= 0.09
+
+
+def test_shared_per_api_key():
+    assert RateGovernor.forApiKey('governorkey') is RateGovernor.forApiKey('governorkey')
+    assert RateGovernor.forApiKey('governorkey') is not RateGovernor.forApiKey('otherkey')
+    assert CircuitBreaker.forApiKey('governorkey') is CircuitBreaker.forApiKey('governorkey')
+
+
+@pytest.mark.skipif(py9kw.fcntl is None, reason='Lock files need fcntl')
+def test_lock_file_shares_tokens_between_processes(tmp_path):
+    lockfile = str(tmp_path / 'governor.lock')
+    governor = RateGovernor(ratePerSecond=0.001, burst=5, lockfile=lockfile)
+    assert [governor.tryAcquire('usercaptchaupload') for _ in range(3)] == [0, 0, 0]
+    code = '''
+import sys
+sys.path.insert(0, %r)
+from py9kw import RateGovernor
+governor = RateGovernor(ratePerSecond=0.001, burst=5, lockfile=%r)
+print(sum(governor.tryAcquire('usercaptchaupload') == 0 for _ in range(5)))
+''' % (REPOSITORY, lockfile)
+    result = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+    # Only what this process left over
+    assert result.stdout.strip() == '2'
+    assert governor.tryAcquire('usercaptchaupload') > 0
+
+
+def test_client_waits_for_governor(fakeserver, configure, apikey):
+    client = Py9kw(apikey)
+    configure(client)
+    governor = RateGovernor(ratePerSecond=10, burst=1)
+    client.setRateGovernor(governor)
+    assert client.uploadcaptcha(b'image') > 0
+    assert client.sleepAndGetResult() is not None
+    assert governor.getStats()['delays'] > 0
+    client.close()
+
+
+def test_breaker_opens_half_opens_and_closes(clock):
+    breaker = CircuitBreaker(failureRate=0.5, minRequests=4, openSeconds=5, probeRequests=1)
+    breaker.onSuccess()
+    breaker.onResponse({'error': '0012 Bereits erledigt.'})
+    breaker.onFailure()
+    assert breaker.getState() == 'closed'
+    breaker.onResponse({'error': '0002 Keine ID gefunden.'})
+    assert breaker.getState() == 'open'
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.allowRequest()
+    assert e.value.retryAfter == pytest.approx(5)
+    clock.advance(5)
+    # One probe gets through, everything else waits for its outcome
+    breaker.allowRequest()
+    assert breaker.getState() == 'half-open'
+    with pytest.raises(CircuitOpenError):
+        breaker.allowRequest()
+    breaker.onSuccess()
+    assert breaker.getState() == 'closed'
+    breaker.allowRequest()
+    stats = breaker.getStats()
+    assert (stats['trips'], stats['shed'], stats['requests'], stats['failures']) == (1, 2, 0, 0)
+
+
+def test_failed_probe_reopens_for_longer(clock):
+    breaker = CircuitBreaker(minRequests=1, openSeconds=5, maxOpenSeconds=15)
+    breaker.onFailure()
+    for openSeconds in (10, 15, 15):
+        clock.advance(100)
+        breaker.allowRequest()
+        breaker.onFailure()
+        assert breaker.getState() == 'open'
+        assert breaker.getStats()['retryAfter'] == pytest.approx(openSeconds)
+    clock.advance(100)
+    breaker.allowRequest()
+    breaker.onSuccess()
+    # Closed again --> Back to openSeconds on the next trip
+    breaker.onFailure()
+    assert breaker.getStats()['retryAfter'] == pytest.approx(5)
+
+
+def test_only_failures_within_window_count(clock):
+    breaker = CircuitBreaker(failureRate=0.5, minRequests=2, windowSeconds=30)
+    breaker.onFailure()
+    clock.advance(31)
+    breaker.onSuccess()
+    breaker.onSuccess()
+    breaker.onFailure()
+    assert breaker.getState() == 'closed'
+    assert breaker.getStats()['requests'] == 3
+
+
+@pytest.fixture
+def client(configure, apikey):
+    client = Py9kw(apikey)
+    configure(client)
+    client.setMetrics(Metrics())
+    client.setCircuitBreaker(CircuitBreaker(openSeconds=10))
+    yield client
+    client.close()
+
+
+def test_shed_polls_wait_for_breaker(client):
+    assert client.uploadcaptcha(b'image') > 0
+    client.getCircuitBreaker()._open(0.3)
+    starttime = time.monotonic()
+    assert client.sleepAndGetResult() is not None
+    assert time.monotonic() - starttime >= 0.3
+    assert client.getMetrics().getCounter('py9kw_requests_total', status='shed') >= 1
+
+
+def test_deadline_while_polls_get_shed_aborts(client):
+    assert client.uploadcaptcha(b'image') > 0
+    client.getCircuitBreaker()._open(10)
+    starttime = time.monotonic()
+    assert client.sleepAndGetResult(deadline=time.monotonic() + 0.3) is None
+    assert time.monotonic() - starttime < 1
+    assert client.getErrorCode() == 601
+    # Same handling as a deadline without shed polls, but the abort request got shed as well --> Nothing saved
+    assert client.getMetrics().getCounter('py9kw_aborts_total', reason='deadline') == 1
+    assert client.getMetrics().getCounter('py9kw_credits_saved_total') == 0
+    assert client.getCreditLedger().getReserved() == 0
+
+
+def test_deadline_while_polls_get_shed_aborts_async(configure, apikey):
+    async def solve():
+        async with AsyncPy9kw(apikey) as asyncclient:
+            configure(asyncclient)
+            asyncclient.setMetrics(Metrics())
+            asyncclient.setCircuitBreaker(CircuitBreaker())
+            assert await asyncclient.uploadcaptcha(b'image') > 0
+            asyncclient.getCircuitBreaker()._open(10)
+            assert await asyncclient.sleepAndGetResult(deadline=time.monotonic() + 0.3) is None
+            return asyncclient.getErrorCode(), asyncclient.getMetrics().getCounter('py9kw_aborts_total', reason='deadline')
+
+    assert asyncio.run(solve()) == (601, 1)
@@ -0,0 +1,200 @@
+import asyncio
+import collections
+import http.server
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from py9kw import ImageFetcher, ResponseTooLargeError
+from py9kw_async import AsyncHTTPClient, AsyncPy9kw
+
+MAX_BYTES = 100 * 1024
+
+
+def getImage(size: int) -> bytes:
+    return bytes(index % 251 for index in range(size))
+
+
+class FetchRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ /image?size=n: n bytes with Content-Length, /chunked?size=n: n bytes chunked, /endless: Body without Content-Length which never ends,
+    /slow: Announces 10 bytes but sends only one. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        parsedurl = urlsplit(self.path)
+        size = int(dict(parse_qsl(parsedurl.query)).get('size', 5))
+        with self.server.lock:
+            self.server.requests[self.path] += 1
+        self.send_response(200)
+        try:
+            if parsedurl.path == '/image':
+                self.send_header('Content-Length', str(size))
+                self.end_headers()
+                self.wfile.write(getImage(size))
+            elif parsedurl.path == '/chunked':
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for offset in range(0, size, 10000):
+                    chunk = getImage(size)[offset:offset + 10000]
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                self.wfile.write(b'0\r\n\r\n')
+            elif parsedurl.path == '/endless':
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                while True:
+                    self.wfile.write(b'x' * 8192)
+            elif parsedurl.path == '/slow':
+                self.send_header('Content-Length', '10')
+                self.end_headers()
+                self.wfile.write(b'x')
+                self.wfile.flush()
+                time.sleep(3)
+        except OSError:
+            # Client gave up
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FetchRequestHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = collections.Counter()
+    server.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = ImageFetcher(maxBytes=MAX_BYTES, timeout=1)
+    yield fetcher
+    fetcher.close()
+    fetcher.transport.close()
+
+
+@pytest.mark.parametrize('path', ['/image', '/chunked'])
+def test_fetch_writes_through(server, fetcher, tmp_path, path):
+    url = server.url + path + '?size=50000'
+    assert fetcher.fetch(url) == getImage(50000)
+    assert fetcher.fetch(url, str(tmp_path / 'image')) == getImage(50000)
+    assert (tmp_path / 'image').read_bytes() == getImage(50000)
+
+
+def test_announced_size_above_max_bytes(server, fetcher):
+    with pytest.raises(ResponseTooLargeError):
+        fetcher.fetch(server.url + '/image?size=%d' % (MAX_BYTES + 1))
+    assert fetcher.fetch(server.url + '/image?size=%d' % MAX_BYTES) == getImage(MAX_BYTES)
+
+
+@pytest.mark.parametrize('path', ['/endless', '/chunked?size=%d' % (MAX_BYTES + 1)])
+def test_download_stops_at_max_bytes(server, fetcher, tmp_path, path):
+    starttime = time.monotonic()
+    with pytest.raises(ResponseTooLargeError):
+        fetcher.fetch(server.url + path, str(tmp_path / 'image'))
+    # Aborted while reading, not after the timeout
+    assert time.monotonic() - starttime < 1
+    assert 0 < (tmp_path / 'image').stat().st_size <= MAX_BYTES
+
+
+def test_read_timeout(server, fetcher):
+    starttime = time.monotonic()
+    with pytest.raises(IOError):
+        fetcher.fetch(server.url + '/slow')
+    assert time.monotonic() - starttime < 2.5
+
+
+def test_no_http_url(fetcher):
+    with pytest.raises(IOError):
+        fetcher.fetch('file:///etc/passwd')
+
+
+def test_prefetch(server, fetcher, tmp_path):
+    url = server.url + '/image?size=1000'
+    future = fetcher.prefetch(url, str(tmp_path / 'image'))
+    assert fetcher.prefetch(url, str(tmp_path / 'image')) is future
+    future.result(5)
+    assert (tmp_path / 'image').read_bytes() == getImage(1000)
+    assert fetcher.fetch(url, str(tmp_path / 'image')) == getImage(1000)
+    assert server.requests['/image?size=1000'] == 1
+    assert fetcher.prefetched == {}
+    # Not prefetched anymore --> Downloaded again
+    assert fetcher.fetch(url) == getImage(1000)
+    assert server.requests['/image?size=1000'] == 2
+
+
+def test_prefetched_images_nobody_fetches_get_dropped(server, fetcher):
+    fetcher.maxPrefetched = 2
+    urls = [server.url + '/image?size=%d' % size for size in (1, 2, 3)]
+    futures = [fetcher.prefetch(url) for url in urls]
+    assert list(fetcher.prefetched) == [(url, None) for url in urls[1:]]
+    assert futures[0].result(5) == getImage(1)
+    assert fetcher.fetch(urls[0]) == getImage(1)
+    assert server.requests['/image?size=1'] == 2
+
+
+def test_prefetch_all(server, fetcher):
+    urls = [server.url + '/image?size=%d' % size for size in range(1, 10)] + [server.url + '/image?size=%d' % (MAX_BYTES + 1)]
+    results = list(fetcher.prefetchAll(urls, ahead=3))
+    assert results == [(url, getImage(size)) for url, size in zip(urls, range(1, 10))] + [(urls[-1], None)]
+    assert fetcher.prefetched == {}
+
+
+async def fetchAsync(server, path: str, image_path: str = None):
+    async with AsyncPy9kw('key') as client:
+        client.getImageFetcher().maxBytes = MAX_BYTES
+        client.getImageFetcher().timeout = 1
+        starttime = time.monotonic()
+        imagedata = await client.getCaptchaImageFromWebsite(server.url + path, image_path)
+        return imagedata, client.getErrorCode(), time.monotonic() - starttime
+
+
+@pytest.mark.parametrize('path', ['/image', '/chunked'])
+def test_async_download_writes_through(server, tmp_path, path):
+    imagedata, errorcode, seconds = asyncio.run(fetchAsync(server, path + '?size=50000', str(tmp_path / 'image')))
+    assert imagedata == getImage(50000) and errorcode == -1
+    assert (tmp_path / 'image').read_bytes() == getImage(50000)
+
+
+@pytest.mark.parametrize('path', ['/endless', '/chunked?size=%d' % (MAX_BYTES + 1), '/image?size=%d' % (MAX_BYTES + 1)])
+def test_async_download_stops_at_max_bytes(server, tmp_path, path):
+    imagedata, errorcode, seconds = asyncio.run(fetchAsync(server, path, str(tmp_path / 'image')))
+    assert imagedata is None and errorcode == 603
+    assert seconds < 1
+    assert (tmp_path / 'image').stat().st_size <= MAX_BYTES
+
+
+def test_async_read_timeout(server):
+    imagedata, errorcode, seconds = asyncio.run(fetchAsync(server, '/slow'))
+    assert imagedata is None and errorcode == 603
+    assert seconds < 2.5
+
+
+def test_async_client_streams_into_sink(server):
+    class Sink:
+        def __init__(self):
+            self.chunks = []
+
+        def write(self, chunk: bytes):
+            self.chunks.append(chunk)
+
+    async def get():
+        client = AsyncHTTPClient()
+        try:
+            sink = Sink()
+            assert await client.get(server.url + '/image?size=200000', sink=sink) == b''
+            return sink.chunks
+        finally:
+            await client.close()
+
+    chunks = asyncio.run(get())
+    assert len(chunks) > 1 and b''.join(chunks) == getImage(200000)
@@ -0,0 +1,94 @@
+import asyncio
+import io
+import warnings
+from base64 import b64decode
+
+import pytest
+
+from py9kw import Py9kw, Base64Image, ImageFile
+from py9kw_async import AsyncPy9kw
+from py9kw_fakeserver import FakeApiRequestHandler
+from py9kw_poller import CaptchaPoller
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """ Image bytes of every upload the fake server gets, no matter how they were sent. """
+    uploads = []
+    respond = FakeApiRequestHandler._respond
+
+    def recordingRespond(self, params: dict):
+        if params.get('action') == 'usercaptchaupload':
+            filedata = params['file-upload-01']
+            uploads.append(b64decode(filedata) if params.get('base64') == '1' else filedata)
+        respond(self, params)
+
+    monkeypatch.setattr(FakeApiRequestHandler, '_respond', recordingRespond)
+    return uploads
+
+
+@pytest.fixture
+def client(configure, apikey):
+    client = Py9kw(apikey)
+    configure(client)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def imagefile(tmp_path):
+    path = tmp_path / 'captcha.png'
+    path.write_bytes(b'image')
+    return str(path)
+
+
+def getInputs(imageserver: str, imagefile: str) -> dict:
+    return {'bytes': b'image', 'bytearray': bytearray(b'image'), 'memoryview': memoryview(b'xximage')[2:], 'file': io.BytesIO(b'image'),
+            'path': ImageFile(imagefile), 'url': imageserver + '/image', 'base64': Base64Image('aW1hZ2U='), 'base64bytes': Base64Image(b'aW1hZ2U=')}
+
+
+@pytest.mark.parametrize('kind', ['bytes', 'bytearray', 'memoryview', 'file', 'path', 'url', 'base64', 'base64bytes'])
+def test_typed_inputs(client, uploads, imageserver, imagefile, kind):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert client.uploadcaptcha(getInputs(imageserver, imagefile)[kind]) > 0
+    assert client.sleepAndGetResult() is not None
+    assert uploads == [b'image']
+
+
+def test_empty_image_file(client, uploads, tmp_path):
+    (tmp_path / 'empty.png').write_bytes(b'')
+    # Cannot be memory mapped but still gets sent, the server rejects it
+    assert client.uploadcaptcha(ImageFile(str(tmp_path / 'empty.png'))) == -1
+    assert uploads == [b'']
+
+
+def test_failed_download_is_not_uploaded(client, uploads, imageserver):
+    assert client.uploadcaptcha(imageserver + '/missing') == -1
+    assert client.getErrorCode() == 603
+    assert uploads == []
+
+
+def test_base64_str_is_deprecated(client, uploads):
+    with pytest.warns(DeprecationWarning, match='Base64Image') as record:
+        assert client.uploadcaptcha('aW1hZ2U=') > 0
+    assert record[0].filename == __file__
+    assert client.sleepAndGetResult() is not None
+    assert uploads == [b'image']
+
+
+def test_base64_str_is_deprecated_in_poller_and_async(client, uploads, configure, apikey):
+    with CaptchaPoller(client) as poller:
+        with pytest.warns(DeprecationWarning):
+            ticket = poller.upload('aW1hZ2U=')
+        assert ticket.result(10) is not None
+
+    async def solve():
+        async with AsyncPy9kw(apikey) as asyncclient:
+            configure(asyncclient)
+            with pytest.warns(DeprecationWarning):
+                assert await asyncclient.uploadcaptcha('aW1hZ2U=') > 0
+            return await asyncclient.sleepAndGetResult()
+
+    assert asyncio.run(solve()) is not None
+    assert uploads == [b'image', b'image']
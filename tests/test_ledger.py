@@ -0,0 +1,47 @@
+import time
+
+from py9kw import Py9kw, CreditLedger, PARAM_MIN_MAXTIMEOUT
+
+
+def test_reservations_of_dropped_clients_expire(fakeserver, configure, apikey):
+    fakeserver.config.credits = 100
+    # Expire one second after the upload instead of waiting for the minimal maxtimeout
+    ledger = CreditLedger(graceSeconds=1 - PARAM_MIN_MAXTIMEOUT)
+    for _ in range(10):
+        client = Py9kw(apikey)
+        configure(client)
+        client.setCreditLedger(ledger)
+        assert client.uploadcaptcha(b'image') > 0
+        # Dropped without polling, settling or releasing its reservation
+        del client
+    assert ledger.getReserved() == 100
+    assert ledger.getAvailable() == 0
+    time.sleep(1.1)
+    assert ledger.getReserved() == 0
+    client = Py9kw(apikey)
+    configure(client)
+    client.setCreditLedger(ledger)
+    assert client.canSolveOneMoreCaptcha()
+
+
+def test_absorb_recounts_reserved_credits():
+    ledger = CreditLedger()
+    ledger.absorb(100)
+    reservation = ledger.reserve(10)
+    ledger.reserved = 50
+    ledger.absorb(100)
+    assert ledger.getReserved() == 10
+    ledger.settle(reservation)
+    assert ledger.getReserved() == 0
+    assert ledger.getBalance() == 90
+
+
+def test_late_answer_of_expired_reservation_is_charged():
+    ledger = CreditLedger(graceSeconds=0)
+    ledger.absorb(100)
+    reservation = ledger.reserve(10, 0)
+    assert ledger.getAvailable() == 100
+    assert reservation.state == 'expired'
+    ledger.settle(reservation)
+    assert reservation.state == 'settled'
+    assert ledger.getAvailable() == 90
@@ -0,0 +1,118 @@
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+import py9kw
+from py9kw import Py9kw, LOG_MODE_EVENTS, LOG_MODE_QUIET, LOG_MODE_TEXT, LogSampler, eventlogger, logger, setLogMode
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def levels():
+    """ setLogMode changes process wide logger levels --> Restore them for the other tests. """
+    saved = logger.level, eventlogger.level
+    yield
+    logger.setLevel(saved[0])
+    eventlogger.setLevel(saved[1])
+
+
+@pytest.fixture
+def solve(fakeserver, configure, apikey, caplog):
+    """ Solves one captcha and returns the py9kw records it caused. """
+    def solve() -> list:
+        client = Py9kw(apikey)
+        configure(client)
+        caplog.set_level(logging.DEBUG)
+        # caplog lowers the level of the root logger only, the py9kw loggers keep the levels of the log mode
+        caplog.clear()
+        assert client.uploadcaptcha(b'image') > 0
+        assert client.sleepAndGetResult() is not None
+        client.close()
+        return [record for record in caplog.records if record.name.startswith('py9kw')]
+    return solve
+
+
+def test_text_mode(solve):
+    setLogMode(LOG_MODE_TEXT)
+    records = solve()
+    assert {record.name for record in records} == {'py9kw'}
+    assert min(record.levelno for record in records) == logging.INFO
+    setLogMode(LOG_MODE_TEXT, debug=True)
+    debugrecords = [record for record in solve() if record.levelno == logging.DEBUG]
+    # Every poll and request
+    assert any('[getresult]' in record.getMessage() for record in debugrecords)
+    assert any('json debug' in record.getMessage() for record in debugrecords)
+
+
+def test_events_mode(solve):
+    setLogMode(LOG_MODE_EVENTS)
+    records = solve()
+    assert [(record.name, record.levelno) for record in records] == [('py9kw.events', logging.INFO)]
+    fields = records[0].py9kw
+    assert fields['event'] == 'solved' and fields['errorcode'] == -1 and fields['credits'] == 10 and fields['polls'] >= 1
+    assert records[0].getMessage().startswith('captcha solved id=%d polls=%d' % (fields['captchaid'], fields['polls']))
+
+
+def test_quiet_mode(solve):
+    setLogMode(LOG_MODE_QUIET)
+    assert solve() == []
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        setLogMode('verbose')
+
+
+def makeRecord(event: str = None, msg: str = 'message', levelno: int = logging.INFO) -> logging.LogRecord:
+    fields = {'msg': msg, 'levelno': levelno}
+    if event is not None:
+        fields['py9kw'] = {'event': event}
+    return logging.makeLogRecord(fields)
+
+
+def test_sampler_rates():
+    sampler = LogSampler({'solved': 0.25}, defaultRate=0.5)
+    records = [makeRecord('solved') for _ in range(100)]
+    passed = [record for record in records if sampler.filter(record)]
+    assert len(passed) == 25
+    # First record passes, then every fourth one and tells how many were dropped before it
+    assert passed[0] is records[0] and passed[0].dropped == 0
+    assert all(record.dropped == 3 for record in passed[1:])
+    # Per event: Other messages get the default rate, failures are not thinned out by solved ones
+    assert sum(sampler.filter(makeRecord(msg='poll')) for _ in range(10)) == 5
+    assert sum(sampler.filter(makeRecord('failed')) for _ in range(10)) == 5
+    # Warnings always pass
+    sampler = LogSampler(defaultRate=0)
+    assert sum(sampler.filter(makeRecord(msg='poll', levelno=logging.WARNING)) for _ in range(10)) == 10
+    assert sum(sampler.filter(makeRecord(msg='poll')) for _ in range(10)) == 1
+
+
+def test_sampler_rate_limit(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(py9kw.time, 'monotonic', lambda: now[0])
+    sampler = LogSampler(maxPerSecond=2)
+    assert sum(sampler.filter(makeRecord('solved')) for _ in range(10)) == 2
+    now[0] += 1
+    assert sum(sampler.filter(makeRecord('solved')) for _ in range(10)) == 2
+    now[0] += 0.5
+    record = makeRecord('solved')
+    assert sampler.filter(record) and record.dropped == 8
+    assert not sampler.filter(makeRecord('solved'))
+
+
+def test_import_configures_no_logging():
+    code = '''
+import logging
+import sys
+sys.path.insert(0, %r)
+import py9kw, py9kw_async, py9kw_poller
+root = logging.getLogger()
+assert root.handlers == [] and root.level == logging.WARNING, (root.handlers, root.level)
+assert [type(handler) for handler in logging.getLogger('py9kw').handlers] == [logging.NullHandler]
+assert logging.getLogger('py9kw.events').handlers == []
+''' % REPOSITORY
+    subprocess.run([sys.executable, '-c', code], check=True)
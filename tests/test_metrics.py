@@ -0,0 +1,123 @@
+import re
+
+import pytest
+
+from py9kw import Py9kw, Metrics, PHASE_DOWNLOAD, PHASE_ENCODE, PHASE_QUEUE, PHASE_UPLOAD
+from py9kw_poller import CaptchaPoller
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)",?')
+
+
+def parsePrometheus(text: str) -> tuple:
+    """ Parses the text exposition format strictly enough for our export: Returns type by metric name and (name, labels, value) of all samples.
+    Every sample has to follow the HELP and TYPE lines of its metric. """
+    assert text.endswith('\n')
+    types = {}
+    helps = set()
+    samples = []
+    for line in text.splitlines():
+        if line.startswith('# HELP '):
+            helps.add(line.split(' ')[2])
+            continue
+        if line.startswith('# TYPE '):
+            name, metrictype = line.split(' ')[2:]
+            assert name in helps and name not in types
+            types[name] = metrictype
+            continue
+        match = SAMPLE.match(line)
+        assert match is not None, line
+        name, labeltext, value = match.groups()
+        labels = {}
+        if labeltext:
+            assert ''.join(part.group(0) for part in LABEL.finditer(labeltext)) == labeltext, line
+            labels = {key: re.sub(r'\\(.)', lambda escape: {'n': '\n'}.get(escape.group(1), escape.group(1)), value)
+                      for key, value in LABEL.findall(labeltext)}
+        family = re.sub('_(bucket|sum|count)$', '', name) if types.get(name) is None else name
+        assert family in types, line
+        samples.append((name, labels, float(value)))
+    return types, samples
+
+
+def getSamples(samples: list, name: str, **labels) -> list:
+    return [(sampleLabels, value) for sampleName, sampleLabels, value in samples if sampleName == name and labels.items() <= sampleLabels.items()]
+
+
+def test_counters():
+    metrics = Metrics()
+    metrics.onRequest('usercaptchaupload', 0.1, {'captchaid': '1'})
+    metrics.onRequest('usercaptchaupload', 0.1, {'error': '0010 Nicht genug Guthaben.'})
+    metrics.onRequest('usercaptchacorrectdata', 0.1, {'answer': 'NO DATA'})
+    metrics.inc('py9kw_credits_spent_total', (), 2.5)
+    metrics.inc('custom_total', (('name', 'a "quoted" \\ value\n'),))
+    types, samples = parsePrometheus(metrics.exportPrometheus())
+    assert types['py9kw_requests_total'] == 'counter'
+    assert sorted((labels['action'], labels['status'], value) for labels, value in getSamples(samples, 'py9kw_requests_total')) == [
+        ('usercaptchacorrectdata', 'ok', 1), ('usercaptchaupload', 'apierror', 1), ('usercaptchaupload', 'ok', 1)]
+    assert getSamples(samples, 'py9kw_credits_spent_total') == [({}, 2.5)]
+    # Unknown metrics are untyped, label values escaped
+    assert types['custom_total'] == 'untyped'
+    assert getSamples(samples, 'custom_total') == [({'name': 'a "quoted" \\ value\n'}, 1)]
+    assert metrics.getCounter('py9kw_requests_total', action='usercaptchaupload') == 2
+
+
+def test_histograms():
+    metrics = Metrics()
+    for seconds in (0.003, 0.2, 0.2, 7, 1000):
+        metrics.onPhase(PHASE_UPLOAD, seconds)
+    metrics.onPhase(PHASE_QUEUE, 1)
+    types, samples = parsePrometheus(metrics.exportPrometheus())
+    assert types['py9kw_phase_seconds'] == 'histogram'
+    buckets = getSamples(samples, 'py9kw_phase_seconds_bucket', phase=PHASE_UPLOAD)
+    bounds = [labels['le'] for labels, value in buckets]
+    assert bounds == [str(bound) for bound in Metrics.LATENCY_BUCKETS] + ['+Inf']
+    counts = dict(zip(bounds, [value for labels, value in buckets]))
+    # Cumulative
+    assert (counts['0.005'], counts['0.1'], counts['0.25'], counts['5'], counts['10'], counts['300'], counts['+Inf']) == (1, 1, 3, 3, 4, 4, 5)
+    assert [value for labels, value in buckets] == sorted(value for labels, value in buckets)
+    assert getSamples(samples, 'py9kw_phase_seconds_sum', phase=PHASE_UPLOAD) == [({'phase': PHASE_UPLOAD}, pytest.approx(1007.403))]
+    assert getSamples(samples, 'py9kw_phase_seconds_count', phase=PHASE_UPLOAD) == [({'phase': PHASE_UPLOAD}, 5)]
+    assert getSamples(samples, 'py9kw_phase_seconds_count', phase=PHASE_QUEUE) == [({'phase': PHASE_QUEUE}, 1)]
+    assert metrics.getHistogram('py9kw_phase_seconds') == (6, pytest.approx(1008.403))
+
+
+def test_hooks_get_every_value_and_failing_hooks_are_ignored():
+    metrics = Metrics()
+    events = []
+    metrics.addHook(lambda event, fields: 1 / 0)
+    metrics.addHook(lambda event, fields: events.append((event, fields)))
+    metrics.onPhase(PHASE_UPLOAD, 0.5, 7)
+    metrics.onCaptchaAborted(7, 'deadline', 15)
+    assert events == [('phase', {'phase': PHASE_UPLOAD, 'seconds': 0.5, 'captchaid': 7}), ('abort', {'captchaid': 7, 'reason': 'deadline', 'saved': 15})]
+
+
+def test_export_of_solved_captchas(fakeserver, configure, apikey):
+    metrics = Metrics()
+    client = Py9kw(apikey)
+    configure(client)
+    client.setMetrics(metrics)
+    for _ in range(2):
+        assert client.uploadcaptcha(b'image') > 0
+        assert client.sleepAndGetResult() is not None
+    client.close()
+    types, samples = parsePrometheus(metrics.exportPrometheus())
+    assert getSamples(samples, 'py9kw_captchas_total') == [({'result': 'solved'}, 2)]
+    assert getSamples(samples, 'py9kw_credits_spent_total') == [({}, 2 * 10)]
+    assert getSamples(samples, 'py9kw_requests_total', action='usercaptchaupload') == [({'action': 'usercaptchaupload', 'status': 'ok'}, 2)]
+    assert getSamples(samples, 'py9kw_polls_per_captcha_count') == [({}, 2)]
+    assert getSamples(samples, 'py9kw_polls_per_captcha_bucket', le='+Inf') == [({'le': '+Inf'}, 2)]
+    for phase in (PHASE_ENCODE, PHASE_UPLOAD, PHASE_QUEUE):
+        assert getSamples(samples, 'py9kw_phase_seconds_count', phase=phase) == [({'phase': phase}, 2)]
+
+
+def test_phases_end_up_in_the_ticket(fakeserver, configure, apikey, imageserver):
+    client = Py9kw(apikey)
+    configure(client)
+    client.setMetrics(Metrics())
+    with CaptchaPoller(client) as poller:
+        for _ in range(2):
+            ticket = poller.upload(imageserver + '/image')
+            assert ticket.result(10) is not None
+            assert set(ticket.phases) == {PHASE_DOWNLOAD, PHASE_ENCODE, PHASE_UPLOAD, PHASE_QUEUE}
+    assert client.phases == {}
+    client.close()
@@ -0,0 +1,118 @@
+import random
+import time
+
+import pytest
+
+from py9kw import Py9kw, Metrics, PHASE_DOWNLOAD
+from py9kw_fakeserver import FakeApiServer, constant
+from py9kw_poller import CaptchaPoller
+
+
+@pytest.fixture
+def client(configure, apikey):
+    client = Py9kw(apikey)
+    configure(client)
+    client.setMetrics(Metrics())
+    yield client
+    client.close()
+
+
+def test_download_failure_is_reported_on_the_ticket(client, imageserver):
+    with CaptchaPoller(client) as poller:
+        ticket = poller.upload(imageserver + '/missing')
+        assert ticket.result(10) is None
+        assert ticket.errorcode == 603
+        assert set(ticket.phases) == {PHASE_DOWNLOAD}
+    assert client.getErrorCode() == -1
+
+
+def waitFor(condition, seconds: float = 5) -> bool:
+    until = time.monotonic() + seconds
+    while not condition() and time.monotonic() < until:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_many_captchas_from_one_loop(client, fakeserver):
+    fakeserver.config.solveTime = lambda: random.uniform(0.1, 0.5)
+    called = []
+    with CaptchaPoller(client, maxParallelPolls=2) as poller:
+        tickets = [poller.upload(b'image') for _ in range(10)]
+        for ticket in tickets:
+            ticket.addCallback(called.append)
+        assert poller.getOutstandingCount() == 10
+        for ticket in tickets:
+            assert ticket.result(10) == 'answer%d' % ticket.captchaid
+            assert ticket.errorcode == -1 and ticket.getResponse()['answer'] == ticket.answer
+        assert waitFor(lambda: poller.getOutstandingCount() == 0)
+    assert len({ticket.captchaid for ticket in tickets}) == 10
+    assert sorted(called, key=id) == sorted(tickets, key=id)
+    assert fakeserver.getStats()['solved'] == 10
+    # Already done --> Called right away
+    tickets[0].addCallback(called.append)
+    assert called[-1] is tickets[0]
+
+
+def test_no_user_does_not_leak_into_other_tickets(client, fakeserver, monkeypatch):
+    correctdata = FakeApiServer._correctdata
+    nouserids = set()
+
+    # Real API and fake server answer this at the maxtimeout of the captcha, at least 60 seconds
+    def noUser(self, apikey: str, params: dict) -> dict:
+        if int(params['id']) in nouserids:
+            return self._ok({'answer': 'ERROR NO USER'})
+        return correctdata(self, apikey, params)
+
+    monkeypatch.setattr(FakeApiServer, '_correctdata', noUser)
+    with CaptchaPoller(client) as poller:
+        nouser = poller.upload(b'image')
+        nouserids.add(nouser.captchaid)
+        solved = poller.upload(b'image')
+        assert nouser.result(10) is None and solved.result(10) == 'answer%d' % solved.captchaid
+    assert (nouser.errorcode, nouser.errormsg, nouser.getResponse()['answer']) == (600, 'ERROR_NO_USER', 'ERROR NO USER')
+    assert (solved.errorcode, solved.errormsg, solved.getResponse()['answer']) == (-1, None, solved.answer)
+    # Only the solved one got charged
+    assert client.getCreditLedger().getReserved() == 0
+    assert client.getCreditLedger().getBalance() == fakeserver.config.credits - 10
+
+
+def test_timeout(client, fakeserver):
+    fakeserver.config.solveTime = constant(60)
+    captchaid = client.uploadcaptcha(b'image')
+    with CaptchaPoller(client) as poller:
+        ticket = poller.track(captchaid, timeout=0.3)
+        assert ticket.result(5) is None
+        assert ticket.errorcode == 601 and ticket.getPollCount() >= 1
+        assert poller.getOutstandingCount() == 0
+    # Only the caller's deadline gets aborted serverside
+    assert fakeserver.getStats().get('feedback_3') is None
+
+
+def test_poll_failures(client, fakeserver):
+    fakeserver.failNext(2, 500, 'usercaptchacorrectdata')
+    with CaptchaPoller(client, maxPollFailures=3) as poller:
+        # Fewer failures in a row than allowed --> Keeps polling
+        ticket = poller.upload(b'image')
+        assert ticket.result(10) == 'answer%d' % ticket.captchaid
+        fakeserver.failNext(1000, 500, 'usercaptchacorrectdata')
+        ticket = poller.upload(b'image')
+        assert ticket.result(10) is None
+        assert (ticket.errorcode, ticket.errormsg) == (605, 'CAPTCHA_POLL_FAILURE')
+        fakeserver.failures.clear()
+        fakeserver.failNext(1, 403, 'usercaptchacorrectdata')
+        # Client errors do not get better by trying again
+        ticket = poller.upload(b'image')
+        assert ticket.result(10) is None and ticket.errorcode == 605
+        assert waitFor(lambda: poller.getOutstandingCount() == 0)
+    assert client.getCreditLedger().getReserved() == 0
+
+
+def test_close_resolves_outstanding_tickets(client, fakeserver):
+    fakeserver.config.solveTime = constant(60)
+    poller = CaptchaPoller(client)
+    tickets = [poller.upload(b'image') for _ in range(2)]
+    poller.close()
+    assert [ticket.result(0) for ticket in tickets] == [None, None]
+    assert [ticket.errorcode for ticket in tickets] == [601, 601]
+    assert poller.getOutstandingCount() == 0
+    assert client.getCreditLedger().getReserved() == 0
@@ -0,0 +1,114 @@
+import pytest
+
+from py9kw import Py9kw, AdaptivePollScheduler, ExponentialBackoffPollScheduler, FixedPollScheduler, Metrics
+from py9kw_fakeserver import FakeApiServer, constant
+from py9kw_poller import CaptchaPoller
+
+
+@pytest.fixture
+def client(configure, apikey):
+    client = Py9kw(apikey)
+    configure(client)
+    yield client
+    client.close()
+
+
+def test_fixed_schedule(client):
+    pollscheduler = FixedPollScheduler()
+    assert pollscheduler.getNextWaitSeconds(client, 0, 0) == 0
+    assert pollscheduler.getNextWaitSeconds(client, 3, 1) == 0.05
+
+
+def test_exponential_backoff():
+    pollscheduler = ExponentialBackoffPollScheduler(1, 2, 5)
+    assert [pollscheduler.getNextWaitSeconds(None, polls, 0) for polls in range(5)] == [1, 2, 4, 5, 5]
+
+
+def test_adaptive_wait_seconds(client):
+    pollscheduler = AdaptivePollScheduler(minSamples=5, densePolls=5, minWaitSeconds=0.1, maxWaitSeconds=3)
+    for solveSeconds in (2, 3, 4, 5):
+        pollscheduler.onResult(client, solveSeconds, 1)
+    # Fallback until minSamples solve times are known
+    assert pollscheduler.getSolveTimeQuantiles(client) is None
+    assert pollscheduler.getNextWaitSeconds(client, 0, 0) == 0
+    assert pollscheduler.getNextWaitSeconds(client, 1, 0) == client.getWaitSecondsPerLoop()
+    pollscheduler.onResult(client, 6, 1)
+    assert pollscheduler.getSolveTimeQuantiles(client) == (2, 5)
+    # First poll at the earliest expected answer
+    assert pollscheduler.getNextWaitSeconds(client, 0, 0) == 2
+    assert pollscheduler.getNextWaitSeconds(client, 0, 0.5) == 1.5
+    # Densely between the quantiles
+    assert pollscheduler.getNextWaitSeconds(client, 1, 3) == pytest.approx(0.6)
+    # Backs off once it takes longer than usual, within minWaitSeconds and maxWaitSeconds
+    assert pollscheduler.getNextWaitSeconds(client, 5, 5.01) == 0.1
+    assert pollscheduler.getNextWaitSeconds(client, 5, 7) == 2
+    assert pollscheduler.getNextWaitSeconds(client, 5, 50) == 3
+
+
+def test_adaptive_history_per_prio_and_params(client):
+    pollscheduler = AdaptivePollScheduler(minSamples=1)
+    client.setPriority(5)
+    pollscheduler.onResult(client, 10, 1)
+    assert pollscheduler.getSolveTimeQuantiles(client) == (10, 10)
+    client.setPriority(10)
+    assert pollscheduler.getSolveTimeQuantiles(client) is None
+    client.setPriority(5)
+    client.setAdditionalCaptchaUploadParams({'numeric': '1'})
+    assert pollscheduler.getSolveTimeQuantiles(client) is None
+
+
+def test_adaptive_polling_needs_fewer_polls(fakeserver, client):
+    fakeserver.config.solveTime = constant(0.5)
+    client.setPollScheduler(AdaptivePollScheduler(minSamples=3, minWaitSeconds=0.05))
+    polls = []
+    for _ in range(5):
+        assert client.uploadcaptcha(b'image') > 0
+        assert client.sleepAndGetResult() is not None
+        polls.append(client.getPollCount())
+    # Fixed polling every 0.05 seconds until the first solve times are known, then right around the expected answer
+    assert min(polls[:3]) >= 5
+    # A slow request on a busy machine may cost one more poll, still far fewer
+    assert max(polls[3:]) <= min(4, min(polls[:3]) // 2)
+
+
+def test_poll_count(fakeserver, client):
+    assert client.getPollCount() == 0
+    assert client.uploadcaptcha(b'image') > 0
+    assert client.getPollCount() == 0
+    assert client.getresult() is None
+    assert client.getPollCount() == 1
+    assert client.sleepAndGetResult() is not None
+    polls = client.getPollCount()
+    assert polls >= 2
+    metrics = Metrics()
+    client.setMetrics(metrics)
+    assert client.uploadcaptcha(b'image') > 0
+    assert client.getPollCount() == 0
+    assert client.sleepAndGetResult() is not None
+    assert metrics.getHistogram('py9kw_polls_per_captcha') == (1, client.getPollCount())
+
+
+def test_polling_stops_once_server_does_not_want_us_to_try_again(fakeserver, client, monkeypatch):
+    fakeserver.config.solveTime = constant(60)
+
+    def noTryAgain(self, apikey: str, params: dict) -> dict:
+        return self._ok({'answer': 'NO DATA', 'nodata': 1, 'try_again': 0, 'info': 1})
+
+    monkeypatch.setattr(FakeApiServer, '_correctdata', noTryAgain)
+    assert client.uploadcaptcha(b'image') > 0
+    assert client.sleepAndGetResult() is None
+    assert client.getPollCount() == 1
+    assert client.getErrorCode() == 601
+    assert client.getCreditLedger().getReserved() == 0
+
+
+def test_poller_keeps_history_per_prio_of_the_captcha(client, apikey):
+    pollscheduler = AdaptivePollScheduler()
+    client.setPollScheduler(pollscheduler)
+    uploadclient = Py9kw(apikey)
+    uploadclient.setApiUrl(client.getApiUrl())
+    with CaptchaPoller(client) as poller:
+        for prio in (3, 7):
+            uploadclient.setPriority(prio)
+            assert poller.upload(b'image', client=uploadclient).result(10) is not None
+    assert sorted(prio for prio, params in pollscheduler.history) == [3, 7]
@@ -0,0 +1,114 @@
+import queue
+import time
+
+import pytest
+
+from py9kw import PrioOptimizer
+from py9kw_fakeserver import constant
+from py9kw_pool import CaptchaSolverPool
+
+
+def waitFor(condition, seconds: float = 5) -> bool:
+    until = time.monotonic() + seconds
+    while not condition() and time.monotonic() < until:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_configured_prio_is_uploaded_and_charged(fakeserver, configure, apikey):
+    def configurePrio(client):
+        configure(client)
+        client.setPriority(15)
+
+    with CaptchaSolverPool(apikey, 2, configure=configurePrio) as pool:
+        tickets = [pool.submit(b'image%d' % number) for number in range(3)]
+        assert all(ticket.result(10) is not None for ticket in tickets)
+        assert [ticket.reservation.cost for ticket in tickets] == [25, 25, 25]
+    assert sorted(captcha.cost for captcha in fakeserver.captchas.values()) == [25, 25, 25]
+    assert fakeserver.credits[apikey] == fakeserver.config.credits - 75
+
+
+def test_admission_counts_the_prio_of_the_prio_optimizer(fakeserver, configure, apikey):
+    priooptimizer = PrioOptimizer(1, prios=(5,))
+
+    def configureOptimizer(client):
+        configure(client)
+        client.setPrioOptimizer(priooptimizer)
+
+    with CaptchaSolverPool(apikey, 1, configure=configureOptimizer) as pool:
+        ticket = pool.submit(b'image')
+        assert ticket.result(10) is not None
+        assert ticket.reservation.cost == 15
+    assert [captcha.cost for captcha in fakeserver.captchas.values()] == [15]
+
+
+def test_refund_of_wrong_answer(fakeserver, configure, apikey):
+    with CaptchaSolverPool(apikey, 1, configure=configure) as pool:
+        ticket = pool.submit(b'image')
+        assert ticket.result(10) is not None
+        assert pool.setCaptchaCorrect(ticket, False)
+        assert ticket.reservation.state == 'refunded'
+    assert fakeserver.credits[apikey] == fakeserver.config.credits
+
+
+def test_submit_blocks_while_queue_is_full(fakeserver, configure, apikey):
+    fakeserver.config.solveTime = constant(0.5)
+    with CaptchaSolverPool(apikey, 1, maxQueued=1, configure=configure) as pool:
+        tickets = [pool.submit(b'image1')]
+        assert waitFor(lambda: fakeserver.getStats().get('uploads') == 1)
+        tickets.append(pool.submit(b'image2'))
+        starttime = time.monotonic()
+        with pytest.raises(queue.Full):
+            pool.submit(b'image3', timeout=0.2)
+        assert 0.2 <= time.monotonic() - starttime < 0.5
+        # Room again once the worker takes the next one
+        tickets.append(pool.submit(b'image3', timeout=5))
+        assert all(ticket.result(10) is not None for ticket in tickets)
+        assert pool.admittedcost == 0
+    assert fakeserver.getStats()['uploads'] == 3
+
+
+def test_refuses_captchas_the_credits_cannot_pay_for(fakeserver, configure, apikey):
+    fakeserver.config.credits = 15
+    fakeserver.config.solveTime = constant(0.5)
+    with CaptchaSolverPool(apikey, 1, configure=configure) as pool:
+        admitted = pool.submit(b'image1')
+        # 15 credits minus the 10 of the admitted one
+        refused = pool.submit(b'image2')
+        assert refused.done() and refused.captchaid == -1 and refused.result() is None
+        assert admitted.result(10) is not None
+    assert fakeserver.getStats()['uploads'] == 1
+
+
+def test_abort_of_queued_captcha(fakeserver, configure, apikey):
+    fakeserver.config.solveTime = constant(0.5)
+    with CaptchaSolverPool(apikey, 1, configure=configure) as pool:
+        first = pool.submit(b'image1')
+        queued = pool.submit(b'image2')
+        assert pool.abortCaptcha(queued)
+        assert queued.result(0) is None and queued.errorcode == 601
+        assert first.result(10) is not None
+    # Never uploaded --> Nothing to abort serverside
+    assert fakeserver.getStats()['uploads'] == 1
+    assert fakeserver.getStats().get('feedback_3') is None
+
+
+def test_close_cancels_pending(fakeserver, configure, apikey):
+    fakeserver.config.solveTime = constant(0.3)
+    pool = CaptchaSolverPool(apikey, 1, configure=configure)
+    tickets = [pool.submit(b'image%d' % number) for number in range(3)]
+    assert waitFor(lambda: fakeserver.getStats().get('uploads') == 1)
+    pool.close(cancelPending=True)
+    # The one in flight still gets solved
+    assert tickets[0].result(0) is not None
+    assert [ticket.result(0) for ticket in tickets[1:]] == [None, None]
+    assert [ticket.errorcode for ticket in tickets[1:]] == [601, 601]
+    assert pool.admittedcost == 0 and pool.getClient().getCreditLedger().getReserved() == 0
+    assert fakeserver.getStats()['uploads'] == 1
+
+
+def test_env_proxy_is_used_by_the_shared_transport(apikey, monkeypatch):
+    monkeypatch.setenv('https_proxy', 'http://proxyhost:3128')
+    with CaptchaSolverPool(apikey, 1, env_proxy=True) as pool:
+        assert pool.getClient().proxy == 'http://proxyhost:3128'
+        assert pool.getClient().transport.proxy.hostname == 'proxyhost'
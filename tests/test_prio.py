@@ -0,0 +1,132 @@
+import math
+import time
+
+import pytest
+
+from py9kw import Py9kw, PrioOptimizer
+from py9kw_fakeserver import constant
+from py9kw_poller import CaptchaPoller
+
+
+def getOptimizer(**kwargs) -> PrioOptimizer:
+    settings = {'targetSeconds': 1, 'prios': (0, 10, 20), 'minSamples': 2, 'explorationRate': 0, 'controlRate': 0}
+    settings.update(kwargs)
+    return PrioOptimizer(**settings)
+
+
+def test_choose_cheapest_prio_meeting_target():
+    optimizer = getOptimizer()
+    # Unknown prios get measured from cheap to expensive
+    assert optimizer.choosePrio() == 0
+    for _ in range(2):
+        optimizer.onResult(0, 5)
+    assert optimizer.choosePrio() == 10
+    for _ in range(2):
+        optimizer.onResult(10, 0.5)
+        optimizer.onResult(20, 0.1)
+    assert optimizer.choosePrio() == 10
+    # Nothing meets the target --> Fastest one
+    for _ in range(2):
+        optimizer.onNoAnswer(10)
+        optimizer.onResult(20, 2)
+    assert optimizer.getSolveTimeQuantile(10, 0.9) == math.inf
+    assert optimizer.choosePrio() == 20
+
+
+def test_hedge_plan():
+    optimizer = getOptimizer()
+    # Solve times unknown --> Hedge after targetSeconds with the fastest prio
+    assert optimizer.getHedgePlan(0) == (1, 20)
+    for seconds in (2, 3):
+        optimizer.onResult(0, seconds)
+    for _ in range(2):
+        optimizer.onResult(10, 0.5)
+    assert optimizer.getHedgePlan(0) == (2, 10)
+    assert optimizer.getHedgePlan(20) is None
+    assert getOptimizer(hedgeQuantile=None).getHedgePlan(0) is None
+    assert getOptimizer(controlRate=1).getHedgePlan(0) is None
+
+
+def test_censored_solve_times_are_lower_bounds():
+    optimizer = getOptimizer(minSamples=4)
+    for seconds in (1, 2):
+        optimizer.onResult(0, seconds)
+        optimizer.onCensoredResult(0, 5)
+    assert list(optimizer.history[0]) == [1, 2]
+    # Half got answered by 2 seconds, the others were still unanswered after 5 --> Unknown when 90% were
+    assert optimizer.getSolveTimeQuantile(0, 0.5) == 2
+    assert optimizer.getSolveTimeQuantile(0, 0.9) == math.inf
+    optimizer.onResult(0, 8)
+    optimizer.onResult(0, 9)
+    # Censored ones drop out after 5 seconds: One of the two still at risk then answered by 8
+    assert optimizer.getSolveTimeQuantile(0, 0.5) == 8
+    assert optimizer.getSolveTimeQuantile(0, 0.9) == 9
+
+
+def test_hedge_accounting():
+    optimizer = getOptimizer()
+    for seconds in (10, 20, 30, math.inf):
+        optimizer.onResult(0, seconds, unhedged=True)
+    # Hedged captchas do not tell what the hedges saved
+    optimizer.onResult(0, 100)
+    optimizer.onHedgeDone(0, 15, True, 10)
+    optimizer.onHedgeDone(0, 5, False, 20)
+    # Won after all unhedged captchas were answered --> Saved nothing known
+    optimizer.onHedgeDone(0, 40, True, 10)
+    stats = optimizer.getStats()
+    # Unhedged captchas which took longer than 15 seconds took 25 on average
+    assert (stats['hedges'], stats['hedgeWins'], stats['extraCredits'], stats['secondsSaved']) == (3, 2, 40, 10)
+    assert stats['creditsPerSecondSaved'] == 4
+    assert getOptimizer().getStats()['creditsPerSecondSaved'] is None
+
+
+@pytest.fixture
+def poller(fakeserver, configure, apikey):
+    fakeserver.config.prioSpeedup = 1
+    client = Py9kw(apikey)
+    configure(client)
+    optimizer = getOptimizer(targetSeconds=0.3, minSamples=1)
+    client.setPrioOptimizer(optimizer)
+    with CaptchaPoller(client) as poller:
+        yield poller
+    client.close()
+
+
+def test_hedge_wins(fakeserver, poller, apikey):
+    # Prio 0 takes 2 seconds, prio 20 a tenth
+    fakeserver.config.solveTime = constant(2.1)
+    ticket = poller.upload(b'image')
+    primaryid = ticket.captchaid
+    assert ticket.result(10) is not None
+    assert ticket.captchaid != primaryid and ticket.prio == 20
+    optimizer = poller.client.getPrioOptimizer()
+    stats = optimizer.getStats()
+    assert (stats['hedges'], stats['hedgeWins'], stats['extraCredits']) == (1, 1, 20)
+    # The primary only tells that it would have taken longer than until the hedge won
+    assert 0 not in optimizer.history
+    assert len(optimizer.censoredHistory[0]) == 1 and 0.3 < optimizer.censoredHistory[0][0] < 2
+    # Primary got aborted before it got solved --> Only the hedge got charged
+    for _ in range(50):
+        if fakeserver.getStats().get('feedback_3') == 1:
+            break
+        time.sleep(0.05)
+    assert fakeserver.getStats()['feedback_3'] == 1
+    assert fakeserver.credits[apikey] == fakeserver.config.credits - 30
+
+
+def test_hedge_loses(fakeserver, poller, apikey):
+    fakeserver.config.prioSpeedup = 0
+    fakeserver.config.solveTime = constant(0.5)
+    ticket = poller.upload(b'image')
+    primaryid = ticket.captchaid
+    assert ticket.result(10) is not None
+    assert ticket.captchaid == primaryid and ticket.prio == 0
+    optimizer = poller.client.getPrioOptimizer()
+    for _ in range(50):
+        if optimizer.getStats()['hedges'] == 1:
+            break
+        time.sleep(0.05)
+    stats = optimizer.getStats()
+    assert (stats['hedges'], stats['hedgeWins'], stats['extraCredits'], stats['secondsSaved']) == (1, 0, 0, 0)
+    assert len(optimizer.history[0]) == 1 and 0 not in optimizer.censoredHistory
+    assert fakeserver.credits[apikey] == fakeserver.config.credits - 10
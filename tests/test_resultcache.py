@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from py9kw import Py9kw, CACHED_CAPTCHA_ID, ResultCache, SQLiteResultCache
+
+
+def test_hits_and_misses():
+    resultcache = ResultCache()
+    assert resultcache.get('key', 10) is None
+    resultcache.put('key', 'answer', 5)
+    assert resultcache.get('key', 10) == 'answer'
+    assert resultcache.get('key', 15) == 'answer'
+    stats = resultcache.getStats()
+    assert (stats['size'], stats['hits'], stats['misses'], stats['savedCredits'], stats['savedSeconds']) == (1, 2, 1, 25, 10)
+
+
+def test_least_recently_used_entries_get_dropped():
+    resultcache = ResultCache(maxsize=2)
+    resultcache.put('a', 'answer a')
+    resultcache.put('b', 'answer b')
+    assert resultcache.get('a') == 'answer a'
+    resultcache.put('c', 'answer c')
+    assert resultcache.get('b') is None
+    assert resultcache.get('a') == 'answer a'
+    assert resultcache.get('c') == 'answer c'
+
+
+def test_entries_expire():
+    resultcache = ResultCache(ttlSeconds=-1)
+    resultcache.put('key', 'answer')
+    assert resultcache.get('key') is None
+    assert resultcache.getStats()['size'] == 0
+
+
+def test_evict():
+    resultcache = ResultCache()
+    resultcache.put('key', 'answer')
+    resultcache.evict('key')
+    resultcache.evict('unknown')
+    assert resultcache.get('key') is None
+    assert resultcache.getStats()['evictions'] == 1
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def resultcache(request, tmp_path):
+    if request.param == 'memory':
+        yield ResultCache()
+        return
+    resultcache = SQLiteResultCache(str(tmp_path / 'results.db'))
+    yield resultcache
+    resultcache.close()
+
+
+def test_solver_uses_cache_and_evicts_wrong_answers(fakeserver, configure, apikey, resultcache):
+    client = Py9kw(apikey)
+    configure(client)
+    client.setResultCache(resultcache)
+    assert client.uploadcaptcha(b'image') > 0
+    answer = client.sleepAndGetResult()
+    assert answer is not None
+    # Same image again --> Answered without upload and without costs
+    assert client.uploadcaptcha(b'image') == CACHED_CAPTCHA_ID
+    assert client.sleepAndGetResult() == answer
+    assert fakeserver.getStats()['uploads'] == 1
+    # Other upload params --> Other captcha
+    client.setAdditionalCaptchaUploadParams({'numeric': '1'})
+    assert client.uploadcaptcha(b'image') > 0
+    assert client.sleepAndGetResult() is not None
+    client.setAdditionalCaptchaUploadParams({})
+    # Wrong answer of a cached captcha --> Evicted, nothing to tell the server
+    assert client.uploadcaptcha(b'image') == CACHED_CAPTCHA_ID
+    assert client.setCaptchaCorrect(False)
+    assert client.uploadcaptcha(b'image') > 0
+    assert client.sleepAndGetResult() is not None
+    assert fakeserver.getStats()['uploads'] == 3
+    assert client.getCreditLedger().getReserved() == 0
+    client.close()
+
+
+def runInOtherProcess(code: str):
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', 'import sys\nsys.path.insert(0, %r)\nfrom py9kw import SQLiteResultCache\n' % repository + textwrap.dedent(code)],
+                   check=True)
+
+
+def test_sqlite_cache_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'results.db')
+    resultcache = SQLiteResultCache(path)
+    try:
+        resultcache.put('wrong', 'wrong answer')
+        assert resultcache.get('wrong') == 'wrong answer'
+        runInOtherProcess('''
+            resultcache = SQLiteResultCache(%r)
+            assert resultcache.get('wrong') == 'wrong answer'
+            resultcache.evict('wrong')
+            resultcache.put('other', 'other answer')
+            resultcache.close()
+        ''' % path)
+        # Evicted by the other process --> Not served from memory anymore
+        assert resultcache.get('wrong') is None
+        assert resultcache.get('other') == 'other answer'
+    finally:
+        resultcache.close()
@@ -0,0 +1,169 @@
+import collections
+import http.server
+import threading
+import time
+
+import pytest
+
+from py9kw import PHASE_DOWNLOAD, CircuitBreaker
+from py9kw_fakeserver import constant
+from py9kw_router import AccountRouter, CreditWeightedStrategy, LeastOutstandingStrategy, LowestLatencyStrategy
+
+
+class SlowImageRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        time.sleep(1)
+        self.send_response(200)
+        self.send_header('Content-Length', '5')
+        self.end_headers()
+        self.wfile.write(b'image')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def apikeys(apikey) -> list:
+    return [apikey + suffix for suffix in ('a', 'b', 'c')]
+
+
+@pytest.fixture
+def router(fakeserver, configure, apikeys):
+    """ Router over the three apikeys, with circuit breakers which trip after two failures. """
+    def configureBreaker(client):
+        configure(client)
+        client.setCircuitBreaker(CircuitBreaker(minRequests=2, openSeconds=0.5))
+
+    with AccountRouter(apikeys, LeastOutstandingStrategy(), configure=configureBreaker) as router:
+        yield router
+
+
+def getOwners(fakeserver, tickets) -> list:
+    return [fakeserver.captchas[ticket.captchaid].apikey for ticket in tickets]
+
+
+def test_credit_weighted_strategy(router, fakeserver, apikeys):
+    for apikey, credits in zip(apikeys, (100, 300, 600)):
+        fakeserver.credits[apikey] = credits
+        router.getAccount(apikey).getClient().getcredits()
+    chosen = collections.Counter(CreditWeightedStrategy().choose(router.getAccounts()).getApiKey() for _ in range(3000))
+    assert 200 < chosen[apikeys[0]] < 400 and 800 < chosen[apikeys[1]] < 1000 and 1700 < chosen[apikeys[2]] < 1900
+
+
+def test_least_outstanding_strategy(router, fakeserver, apikeys):
+    accounts = router.getAccounts()
+    for account, outstanding in zip(accounts, (2, 1, 1)):
+        account.outstanding = outstanding
+        account.getClient().getcredits()
+    fakeserver.credits[apikeys[2]] += 10
+    accounts[2].getClient().getcredits()
+    # Tie --> More credits
+    assert LeastOutstandingStrategy().choose(accounts) is accounts[2]
+    accounts[2].outstanding = 3
+    assert LeastOutstandingStrategy().choose(accounts) is accounts[1]
+
+
+def test_lowest_latency_strategy(router):
+    accounts = router.getAccounts()
+    strategy = LowestLatencyStrategy(explorationRate=0)
+    accounts[0].latency, accounts[1].latency = 2, 1
+    accounts[2].outstanding = 1
+    # Unmeasured ones first
+    assert strategy.choose(accounts) is accounts[2]
+    accounts[2].latency = 3
+    assert strategy.choose(accounts) is accounts[1]
+    chosen = {LowestLatencyStrategy(explorationRate=1).choose(accounts) for _ in range(200)}
+    assert chosen == set(accounts)
+
+
+def test_latency_is_measured_per_account(router, fakeserver):
+    router.setStrategy(LowestLatencyStrategy(explorationRate=0))
+    tickets = [router.upload(b'image%d' % number) for number in range(3)]
+    assert all(ticket.result(10) is not None for ticket in tickets)
+    assert all(0.1 <= account.getLatency() < 1 for account in router.getAccounts())
+
+
+def test_uploads_get_spread_over_all_keys(router, fakeserver, apikeys):
+    fakeserver.config.solveTime = constant(0.5)
+    tickets = [router.upload(b'image%d' % number) for number in range(6)]
+    assert sorted(getOwners(fakeserver, tickets)) == sorted(apikeys * 2)
+    assert [router.getAccountForTicket(ticket).getApiKey() for ticket in tickets] == getOwners(fakeserver, tickets)
+    assert all(ticket.result(10) is not None for ticket in tickets)
+    assert [stats['solved'] for stats in router.getStats()] == [2, 2, 2]
+    assert all(fakeserver.credits[apikey] == fakeserver.config.credits - 20 for apikey in apikeys)
+
+
+def test_feedback_goes_to_the_owning_key(router, fakeserver, apikeys):
+    fakeserver.config.solveTime = constant(60)
+    slow = router.upload(b'image1')
+    fakeserver.config.solveTime = constant(0.1)
+    solved = router.upload(b'image2')
+    slowkey, solvedkey = getOwners(fakeserver, [slow, solved])
+    assert slowkey != solvedkey
+    assert solved.result(10) is not None
+    assert fakeserver.credits[solvedkey] == fakeserver.config.credits - 10
+    # The fake server only accepts feedback with the key which uploaded the captcha
+    assert router.setCaptchaCorrect(solved, False)
+    assert fakeserver.credits[solvedkey] == fakeserver.config.credits
+    assert router.abortCaptcha(slow)
+    assert slow.result(1) is None
+    assert fakeserver.captchas[slow.captchaid].aborted
+    assert fakeserver.getStats()['feedback_2'] == 1 and fakeserver.getStats()['feedback_3'] == 1
+
+
+def test_account_without_credits_leaves_rotation(router, fakeserver, apikeys):
+    fakeserver.credits[apikeys[0]] = 0
+    assert router.getAccount(apikeys[0]).getClient().getcredits() == 0
+    tickets = [router.upload(b'image%d' % number) for number in range(4)]
+    assert apikeys[0] not in getOwners(fakeserver, tickets)
+    assert not router.getStats()[0]['available']
+    # Credits got bought
+    fakeserver.credits[apikeys[0]] = 100
+    router.getAccount(apikeys[0]).getClient().getcredits()
+    tickets = [router.upload(b'image%d' % number) for number in range(4, 7)]
+    assert apikeys[0] in getOwners(fakeserver, tickets)
+    assert all(ticket.result(10) is not None for ticket in tickets)
+
+
+def test_account_with_open_circuit_breaker_leaves_rotation(router, fakeserver, apikeys):
+    breaker = router.getAccount(apikeys[0]).getClient().getCircuitBreaker()
+    for _ in range(2):
+        breaker.onFailure()
+    assert breaker.getState() == 'open'
+    tickets = [router.upload(b'image%d' % number) for number in range(4)]
+    assert apikeys[0] not in getOwners(fakeserver, tickets)
+    assert router.getStats()[0]['breaker'] == 'open' and not router.getStats()[0]['available']
+    # Probe request (its credits) once openSeconds are over
+    time.sleep(0.6)
+    tickets = [router.upload(b'image%d' % number) for number in range(4, 7)]
+    assert apikeys[0] in getOwners(fakeserver, tickets)
+    assert all(ticket.result(10) is not None for ticket in tickets)
+    assert breaker.getState() == 'closed'
+
+
+def test_slow_image_download_does_not_block_other_uploads(configure, apikey):
+    imageserver = http.server.ThreadingHTTPServer(('127.0.0.1', 0), SlowImageRequestHandler)
+    threading.Thread(target=imageserver.serve_forever, daemon=True).start()
+    tickets = []
+    try:
+        with AccountRouter([apikey], configure=configure) as router:
+            thread = threading.Thread(target=lambda: tickets.append(router.upload('http://127.0.0.1:%d/image' % imageserver.server_address[1])))
+            thread.start()
+            time.sleep(0.2)
+            starttime = time.monotonic()
+            assert router.upload(b'image').captchaid > 0
+            assert time.monotonic() - starttime < 0.5
+            thread.join()
+            assert tickets[0].result(10) is not None
+            assert PHASE_DOWNLOAD in tickets[0].phases
+    finally:
+        imageserver.shutdown()
+        imageserver.server_close()
+
+
+def test_env_proxy_is_used_by_the_shared_transport(apikey, monkeypatch):
+    monkeypatch.setenv('https_proxy', 'http://proxyhost:3128')
+    with AccountRouter([apikey], env_proxy=True) as router:
+        assert router.transport.proxy.hostname == 'proxyhost'
+        assert router.accounts[0].client.proxy == 'http://proxyhost:3128'
@@ -0,0 +1,99 @@
+import os
+import stat
+
+import pytest
+
+from py9kw import CreditLedger
+from py9kw_sidecar import SidecarPy9kw, SolverSidecar, SidecarRequestHandler
+
+
+@pytest.fixture
+def sidecar(configure, apikey, tmp_path, monkeypatch):
+    handlers = []
+    setup = SidecarRequestHandler.setup
+
+    def recordingSetup(self):
+        setup(self)
+        handlers.append(self)
+
+    monkeypatch.setattr(SidecarRequestHandler, 'setup', recordingSetup)
+    sidecar = SolverSidecar(apikey, str(tmp_path / 'sidecar.sock'), configure=configure).start()
+    sidecar.handlers = handlers
+    yield sidecar
+    sidecar.stop()
+
+
+def test_socket_is_only_accessible_by_its_owner(sidecar):
+    assert stat.S_IMODE(os.stat(sidecar.path).st_mode) == 0o600
+
+
+def test_tickets_are_dropped_once_their_result_got_sent(sidecar, fakeserver, apikey):
+    worker = SidecarPy9kw(sidecar.path)
+    try:
+        for _ in range(3):
+            assert worker.uploadcaptcha(b'image') > 0
+            assert worker.sleepAndGetResult() is not None
+        handler = sidecar.handlers[0]
+        assert handler.tickets == {}
+        assert len(handler.answered) == 3
+        # Feedback still works for answered captchas
+        assert worker.setCaptchaCorrect(False)
+    finally:
+        worker.close()
+    assert fakeserver.credits[apikey] == fakeserver.config.credits - 20
+
+
+@pytest.fixture
+def imagesidecar(configure, apikey, tmp_path):
+    (tmp_path / 'images').mkdir()
+    sidecar = SolverSidecar(apikey, str(tmp_path / 'sidecar.sock'), configure=configure, imageDir=str(tmp_path / 'images')).start()
+    yield sidecar
+    sidecar.stop()
+
+
+def test_images_get_stored_only_in_image_dir(imagesidecar, fakeserver, imageserver, tmp_path):
+    worker = SidecarPy9kw(imagesidecar.path)
+    try:
+        assert worker.uploadcaptcha(imageserver + '/image', str(tmp_path / 'images' / 'captcha.png')) > 0
+        assert worker.sleepAndGetResult() is not None
+        assert (tmp_path / 'images' / 'captcha.png').read_bytes() == b'image'
+        for path in (tmp_path / 'captcha.png', tmp_path / 'images' / '..' / 'captcha.png', tmp_path / 'images' / 'sub' / 'captcha.png'):
+            assert worker.uploadcaptcha(imageserver + '/image', str(path)) == -1
+            assert 'image directory' in worker.errormsg
+        assert not (tmp_path / 'captcha.png').exists()
+        # Symlinks must not lead out of it either
+        os.symlink(str(tmp_path / 'outside.png'), str(tmp_path / 'images' / 'link.png'))
+        assert worker.uploadcaptcha(imageserver + '/image', str(tmp_path / 'images' / 'link.png')) == -1
+        assert not (tmp_path / 'outside.png').exists()
+    finally:
+        worker.close()
+    assert fakeserver.getStats()['uploads'] == 1
+
+
+def test_store_image_path_needs_image_dir(sidecar, fakeserver, imageserver, tmp_path):
+    worker = SidecarPy9kw(sidecar.path)
+    try:
+        assert worker.uploadcaptcha(imageserver + '/image', str(tmp_path / 'captcha.png')) == -1
+        assert not (tmp_path / 'captcha.png').exists()
+        assert worker.uploadcaptcha(imageserver + '/image') > 0
+        assert worker.sleepAndGetResult() is not None
+    finally:
+        worker.close()
+
+
+def test_worker_has_no_connections_or_shared_ledger_of_its_own():
+    ledgers = dict(CreditLedger.ledgers)
+    worker = SidecarPy9kw('/nonexistent.sock')
+    assert CreditLedger.ledgers == ledgers
+    assert worker.getCreditLedger() is not CreditLedger.forApiKey(None)
+    assert worker.transport.maxsize == 0 and worker.transport.sslcontext is None
+    worker.close()
+
+
+def test_env_proxy_is_used_by_the_transport(apikey, tmp_path, monkeypatch):
+    monkeypatch.setenv('https_proxy', 'http://proxyhost:3128')
+    sidecar = SolverSidecar(apikey, str(tmp_path / 'sidecar.sock'), env_proxy=True).start()
+    try:
+        assert sidecar.client.transport.proxy.hostname == 'proxyhost'
+    finally:
+        sidecar.stop()
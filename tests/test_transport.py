@@ -0,0 +1,140 @@
+import asyncio
+import socketserver
+import threading
+
+import pytest
+
+from py9kw import HTTPConnectionPool, MultipartBody
+from py9kw_async import AsyncHTTPClient
+
+
+class ScriptedRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        while True:
+            length = 0
+            requestline = self.rfile.readline()
+            if requestline == b'':
+                return
+            while True:
+                line = self.rfile.readline()
+                if line in (b'', b'\r\n'):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            self.rfile.read(length)
+            with server.lock:
+                server.requests.append(requestline.split(b' ', 1)[0].decode('ascii'))
+                failure = server.failures.pop(0) if server.failures else None
+            if failure == 'close':
+                return
+            if failure == 'partial':
+                self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nok')
+                return
+            self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+
+
+class ScriptedServer(socketserver.ThreadingTCPServer):
+    """ Keep-alive HTTP server answering 'ok' which misbehaves once per entry of failures after it has read the whole request (including its body):
+    'close' = closes the connection without answering, 'partial' = sends part of the response and closes. requests = methods of all requests read. """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ScriptedRequestHandler)
+        self.lock = threading.Lock()
+        self.failures = []
+        self.requests = []
+
+    def getUrl(self) -> str:
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+
+@pytest.fixture
+def server():
+    server = ScriptedServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def requestAfterFailure(server: ScriptedServer, method: str, failure: str):
+    """ Sends one request to get a pooled connection, then method on that connection while the server fails with failure.
+    Returns the result or exception of the second request. """
+    pool = HTTPConnectionPool()
+    try:
+        assert pool.get(server.getUrl()) == b'ok'
+        server.failures.append(failure)
+        try:
+            if method == 'POST':
+                return pool.post(server.getUrl(), b'body', 'text/plain')
+            return pool.get(server.getUrl())
+        except IOError as e:
+            return e
+    finally:
+        pool.close()
+
+
+async def requestAfterFailureAsync(server: ScriptedServer, method: str, failure: str):
+    client = AsyncHTTPClient()
+    try:
+        assert await client.get(server.getUrl()) == b'ok'
+        server.failures.append(failure)
+        try:
+            if method == 'POST':
+                return await client.post(server.getUrl(), b'body', 'text/plain')
+            return await client.get(server.getUrl())
+        except IOError as e:
+            return e
+    finally:
+        await client.close()
+
+
+@pytest.fixture(params=['sync', 'async'])
+def send(request, server):
+    if request.param == 'sync':
+        return lambda method, failure: requestAfterFailure(server, method, failure)
+    return lambda method, failure: asyncio.run(requestAfterFailureAsync(server, method, failure))
+
+
+def test_connections_are_reused(server):
+    pool = HTTPConnectionPool()
+    try:
+        for _ in range(3):
+            assert pool.get(server.getUrl()) == b'ok'
+        assert pool.connectionsCreated == 1
+    finally:
+        pool.close()
+
+
+def test_get_is_retried_if_reused_connection_got_closed(server, send):
+    assert send('GET', 'close') == b'ok'
+    assert server.requests == ['GET', 'GET', 'GET']
+
+
+def test_no_retry_after_response_bytes_arrived(server, send):
+    for method in ('GET', 'POST'):
+        server.requests.clear()
+        assert isinstance(send(method, 'partial'), IOError)
+        assert server.requests == ['GET', method]
+
+
+def test_post_is_not_retried_once_sent(server, send):
+    # Server has read the whole upload and may have processed (and charged) it
+    assert isinstance(send('POST', 'close'), IOError)
+    assert server.requests == ['GET', 'POST']
+
+
+def test_multipart_post_is_not_retried_once_sent(server):
+    pool = HTTPConnectionPool()
+    try:
+        assert pool.get(server.getUrl()) == b'ok'
+        server.failures.append('close')
+        body = MultipartBody({'action': 'usercaptchaupload'}, 'file-upload-01', b'image' * 1000)
+        with pytest.raises(IOError):
+            pool.post(server.getUrl(), body, body.contenttype)
+        assert server.requests.count('POST') == 1
+    finally:
+        pool.close()
@@ -0,0 +1,112 @@
+import email.parser
+import email.policy
+import io
+
+import pytest
+
+from py9kw import Py9kw, Base64Image, HTTPStatusError, MultipartBody, UPLOAD_MODE_GET, UPLOAD_MODE_POST
+from py9kw_fakeserver import FakeApiRequestHandler
+
+
+def parseMultipart(body: MultipartBody) -> dict:
+    """ Parses the body like the fake server does: name -> bytes of file parts, str of all other parts. """
+    data = b''.join(bytes(chunk) for chunk in body)
+    assert len(data) == len(body)
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(b'Content-Type: ' + body.contenttype.encode('latin-1') + b'\r\n\r\n' + data)
+    assert message.is_multipart()
+    params = {}
+    for part in message.iter_parts():
+        value = part.get_payload(decode=True)
+        params[part.get_param('name', header='content-disposition')] = value if part.get_filename() else value.decode('utf-8')
+    return params
+
+
+@pytest.mark.parametrize('filedata', [b'\x89PNG\r\n--\r\n' * 10000, bytearray(b'image'), memoryview(b'xximage')[2:], io.BytesIO(b'image')])
+def test_multipart_framing(filedata):
+    body = MultipartBody({'action': 'usercaptchaupload', 'prio': 5}, 'file-upload-01', filedata)
+    expected = filedata.getvalue() if isinstance(filedata, io.BytesIO) else bytes(filedata)
+    assert body.getFileSize() == len(expected)
+    for _ in range(2):
+        # Retries and fallbacks iterate it again
+        assert parseMultipart(body) == {'action': 'usercaptchaupload', 'prio': '5', 'file-upload-01': expected}
+
+
+def test_file_part_is_read_from_its_current_position():
+    file = io.BytesIO(b'headerimage')
+    file.seek(6)
+    body = MultipartBody({}, 'file-upload-01', file)
+    assert parseMultipart(body)['file-upload-01'] == b'image'
+    assert file.tell() == 6
+
+
+def test_body_without_file():
+    body = MultipartBody({'action': 'usercaptchaupload', 'file-upload-01': b'aW1hZ2U=', 'base64': 1})
+    assert body.getFileSize() == 0
+    assert parseMultipart(body) == {'action': 'usercaptchaupload', 'file-upload-01': 'aW1hZ2U=', 'base64': '1'}
+
+
+@pytest.fixture
+def client(configure, apikey):
+    client = Py9kw(apikey)
+    configure(client)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """ Records method and params of every upload the fake server gets. """
+    uploads = []
+    respond = FakeApiRequestHandler._respond
+
+    def recordingRespond(self, params: dict):
+        if params.get('action') == 'usercaptchaupload':
+            uploads.append((self.command, params))
+        respond(self, params)
+
+    monkeypatch.setattr(FakeApiRequestHandler, '_respond', recordingRespond)
+    return uploads
+
+
+@pytest.mark.parametrize('imagedata', [b'image', io.BytesIO(b'image'), Base64Image('aW1hZ2U=')])
+def test_upload_is_posted(client, uploads, imagedata):
+    assert client.uploadcaptcha(imagedata) > 0
+    assert client.sleepAndGetResult() is not None
+    method, params = uploads[0]
+    assert method == 'POST'
+    if isinstance(imagedata, Base64Image):
+        assert params['file-upload-01'] == 'aW1hZ2U=' and params['base64'] == '1'
+    else:
+        assert params['file-upload-01'] == b'image' and 'base64' not in params
+
+
+@pytest.mark.parametrize('status', [405, 501])
+def test_fallback_to_get_if_post_is_not_supported(client, uploads, monkeypatch, status):
+    def rejectPost(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    monkeypatch.setattr(FakeApiRequestHandler, 'do_POST', rejectPost)
+    for _ in range(2):
+        assert client.uploadcaptcha(b'image') > 0
+        assert client.sleepAndGetResult() is not None
+    assert client.getUploadMode() == UPLOAD_MODE_GET
+    # Only the first upload tried POST, the fallback and all later ones use GET
+    assert [method for method, params in uploads] == ['GET', 'GET']
+    assert uploads[0][1]['file-upload-01'] == 'aW1hZ2U=' and uploads[0][1]['base64'] == '1'
+
+
+def test_no_fallback_on_other_errors(client, monkeypatch):
+    def failPost(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(500)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    monkeypatch.setattr(FakeApiRequestHandler, 'do_POST', failPost)
+    with pytest.raises(HTTPStatusError):
+        client.uploadcaptcha(b'image')
+    assert client.getUploadMode() == UPLOAD_MODE_POST
+    assert client.getCreditLedger().getReserved() == 0